@@ -0,0 +1,158 @@
+# coding: utf-8
+
+"""
+Compare accuracy and CPU latency of the CLIP inference backends
+
+Accuracy is the cosine similarity of every backend's embeddings to those of the eager float32 model. Latency is
+the median time of a forward pass per batch size and intra-op thread count, with the matching throughput.
+
+Usage:
+    python -m benchmarks.clip_backends [--image-dir DIR] [--model-path clip.pt] [--onnx-dir DIR]
+        [--backends torchscript-fp32 torch-int8 onnx] [--batch-sizes 1 8 32] [--threads 1 4 0]
+"""
+
+import argparse
+import os
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+from loguru import logger
+from PIL import Image
+from transformers import CLIPModel, CLIPProcessor, CLIPTokenizerFast
+
+from src import config
+from src.services.clip_backend import (
+    ClipBackend,
+    OnnxBackend,
+    TorchInt8Backend,
+    TorchScriptBackend,
+    _features,
+    export_onnx,
+)
+
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png", ".webp"}
+TEXTS = [
+    "a cat sleeping on a sofa",
+    "receipt from a grocery store",
+    "screenshot of a chat conversation",
+    "mountain landscape at sunset with a lake",
+    "handwritten notes about linear algebra",
+    "a group of friends at a birthday party",
+    "diagram of a system architecture",
+    "dog",
+]
+
+
+def load_images(image_dir: Path | None, num_images: int) -> list[Image.Image]:
+    if image_dir is None:
+        rng = np.random.default_rng(0)
+        return [Image.fromarray(rng.integers(0, 256, (256, 256, 3), dtype=np.uint8)) for _ in range(num_images)]
+
+    paths = sorted(path for path in image_dir.rglob("*") if path.suffix.lower() in IMAGE_SUFFIXES)
+    assert len(paths) > 0, f"No image found in {image_dir}"
+
+    return [Image.open(paths[i % len(paths)]).convert("RGB") for i in range(num_images)]
+
+
+def cosine(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    a, b = a.astype(np.float32), b.astype(np.float32)
+    return (a * b).sum(1) / np.linalg.norm(a, axis=1) / np.linalg.norm(b, axis=1)
+
+
+def create(name: str, args: argparse.Namespace, num_threads: int) -> ClipBackend:
+    match name:
+        case "torchscript-fp32":
+            return TorchScriptBackend(args.model_path, torch.float32, "cpu")
+        case "torchscript-fp16":
+            return TorchScriptBackend(args.model_path, torch.float16, "cpu")
+        case "torch-int8":
+            return TorchInt8Backend(config.EMBD_MODEL_NAME)
+        case "onnx":
+            return OnnxBackend(args.onnx_dir, num_threads)
+        case _:
+            raise NotImplementedError(f"Unknown backend: {name}")
+
+
+def measure(fn, repeats: int) -> float:
+    fn()
+    elapsed = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        elapsed.append(time.perf_counter() - start)
+
+    return statistics.median(elapsed) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark CLIP inference backends on CPU")
+    parser.add_argument("--image-dir", type=Path, default=None, help="Images to encode; random noise if unset")
+    parser.add_argument("--model-path", default=config.EMBD_MODEL_PATH, help="TorchScript model")
+    parser.add_argument("--onnx-dir", default=None, help="Exported towers; exported to a temporary dir if unset")
+    parser.add_argument("--backends", nargs="+", default=["torchscript-fp32", "torch-int8", "onnx"])
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 4, 0], help="Intra-op threads; 0 for all")
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    backends = [name for name in args.backends if args.model_path is not None or not name.startswith("torchscript")]
+    if len(backends) < len(args.backends):
+        logger.warning("Skip TorchScript backends: no --model-path nor EMBD_MODEL_PATH")
+
+    tmp_dir = None
+    if "onnx" in backends and args.onnx_dir is None:
+        tmp_dir = tempfile.TemporaryDirectory()
+        args.onnx_dir = tmp_dir.name
+        export_onnx(config.EMBD_MODEL_NAME, args.onnx_dir)
+
+    tokenizer = CLIPTokenizerFast.from_pretrained(config.EMBD_MODEL_NAME)
+    processor = CLIPProcessor.from_pretrained(config.EMBD_MODEL_NAME)
+    max_batch = max(args.batch_sizes)
+    texts = [TEXTS[i % len(TEXTS)] for i in range(max_batch)]
+    tokens = tokenizer(texts, return_tensors="np", padding="max_length", truncation=True)
+    pixels = processor(images=load_images(args.image_dir, max_batch), return_tensors="np")["pixel_values"]
+
+    # Reference embeddings of the eager float32 model
+    reference = CLIPModel.from_pretrained(config.EMBD_MODEL_NAME, dtype=torch.float32).eval()
+    with torch.inference_mode():
+        ref_text = _features(
+            reference.get_text_features(
+                input_ids=torch.from_numpy(tokens["input_ids"]),
+                attention_mask=torch.from_numpy(tokens["attention_mask"]),
+            )
+        ).numpy()
+        ref_image = _features(reference.get_image_features(pixel_values=torch.from_numpy(pixels))).numpy()
+    del reference
+
+    cpu_count = os.cpu_count() or 1
+    for name in backends:
+        for num_threads in args.threads:
+            torch.set_num_threads(num_threads if num_threads > 0 else cpu_count)
+            backend = create(name, args, num_threads)
+
+            sim_text = cosine(backend.encode_text(tokens["input_ids"], tokens["attention_mask"]), ref_text)
+            sim_image = cosine(backend.encode_image(pixels), ref_image)
+            print(
+                f"{name:16s} threads={num_threads or cpu_count:<3d} | cosine to fp32 text min {sim_text.min():.4f}"
+                f" mean {sim_text.mean():.4f} | image min {sim_image.min():.4f} mean {sim_image.mean():.4f}"
+            )
+
+            for batch_size in args.batch_sizes:
+                ids, mask = tokens["input_ids"][:batch_size], tokens["attention_mask"][:batch_size]
+                ms_text = measure(lambda: backend.encode_text(ids, mask), args.repeats)
+                ms_image = measure(lambda: backend.encode_image(pixels[:batch_size]), args.repeats)
+                print(
+                    f"{'':16s} batch {batch_size:3d} | text {ms_text:8.1f} ms ({batch_size / ms_text * 1000:7.1f}/s)"
+                    f" | image {ms_image:8.1f} ms ({batch_size / ms_image * 1000:7.1f}/s)"
+                )
+
+    if tmp_dir is not None:
+        tmp_dir.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+# coding: utf-8
+
+"""
+Compare preprocessing cost of the previous double-decode path against a single shared `DecodedImage`
+
+The previous path decoded the full image, resized it, re-encoded it to JPEG (quality 20), base64-encoded it and
+decoded it again for the keyword model, then decoded the original bytes once more for CLIP.
+
+Usage:
+    python -m benchmarks.image_decode <image directory> [--num-images 50]
+"""
+
+import argparse
+import base64
+import io
+import resource
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+from loguru import logger
+from PIL import Image
+
+from src.services.image import DecodedImage
+
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png", ".webp"}
+
+
+def preprocess_legacy(raw: bytes) -> int:
+    buffer = io.BytesIO()
+    img_tmp = Image.open(io.BytesIO(raw))
+    img_tmp = img_tmp.resize((img_tmp.width // 2, img_tmp.height // 2))
+    img_tmp.save(buffer, quality=20, optimize=True, format="JPEG")
+    img_base64 = base64.b64encode(buffer.getvalue()).decode("utf-8")
+
+    img_keyword = Image.open(io.BytesIO(base64.b64decode(img_base64))).convert("RGB")
+    img_clip = Image.open(io.BytesIO(raw))
+    img_clip.load()
+
+    return sum(img.width * img.height * len(img.getbands()) for img in [img_tmp, img_keyword, img_clip])
+
+
+def preprocess_shared(raw: bytes) -> int:
+    decoded = DecodedImage.from_bytes(raw)
+    decoded.keyword_image
+
+    return decoded.nbytes
+
+
+def run(mode: str, paths: list[Path]):
+    fn = preprocess_legacy if mode == "legacy" else preprocess_shared
+    raws = [path.read_bytes() for path in paths]
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    start = time.perf_counter()
+    nbytes = sum(fn(raw) for raw in raws)
+    elapsed = time.perf_counter() - start
+
+    rss_peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(
+        f"{mode:7s}: {elapsed / len(raws) * 1000:7.2f} ms/image | decoded buffers {nbytes / len(raws) / 2**20:6.2f}"
+        f" MiB/image | peak RSS growth {(rss_peak - rss_before) / 1024:7.1f} MiB"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark image preprocessing")
+    parser.add_argument("image_dir", type=Path)
+    parser.add_argument("--num-images", type=int, default=50)
+    parser.add_argument("--mode", choices=["legacy", "shared"], default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    paths = sorted(path for path in args.image_dir.rglob("*") if path.suffix.lower() in IMAGE_SUFFIXES)
+    paths = paths[: args.num_images]
+    assert len(paths) > 0, f"No image found in {args.image_dir}"
+
+    if args.mode is not None:
+        run(args.mode, paths)
+        return
+
+    # Every mode runs in a fresh process so that peak RSS is not shared between them
+    for mode in ["legacy", "shared"]:
+        logger.info(f"Run mode '{mode}'")
+        cmd = [sys.executable, "-m", "benchmarks.image_decode", str(args.image_dir)]
+        subprocess.run([*cmd, "--num-images", str(args.num_images), "--mode", mode], check=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+# coding: utf-8
+
+"""
+Sweep recall@k and latency of the index families picked by `choose_index` over their search parameter
+
+Vectors come from a collection of the local embedding store (`<store dir>/<collection>`) or are drawn synthetically
+around random centroids. Queries are perturbed copies of stored vectors; ground truth is the exact top k. Use the
+output to check the `nprobe`/`ef` defaults of `IndexSpec` on real data before tuning them.
+
+Usage:
+    python -m benchmarks.index_sweep --collection embd_store/resource_embd [--num-queries 200] [--topk 10]
+    python -m benchmarks.index_sweep --synthetic 200000 [--dim 512]
+"""
+
+import argparse
+import json
+import time
+from pathlib import Path
+
+import faiss
+import numpy as np
+from loguru import logger
+
+from src.services.index_manager import IndexSpec, choose_index
+
+
+def load_collection(path_dir: Path) -> np.ndarray:
+    embd_dim = json.loads((path_dir / "meta.json").read_text())["embd_dim"]
+    vectors = np.fromfile(path_dir / "vectors.f16", dtype=np.float16).reshape(-1, embd_dim)
+
+    return vectors.astype(np.float32)
+
+
+def make_synthetic(num_rows: int, dim: int, num_clusters: int = 256) -> np.ndarray:
+    rng = np.random.default_rng(0)
+    centroids = rng.standard_normal((num_clusters, dim), dtype=np.float32)
+    vectors = centroids[rng.integers(0, num_clusters, num_rows)] + 0.5 * rng.standard_normal(
+        (num_rows, dim), dtype=np.float32
+    )
+
+    return vectors
+
+
+def build(spec: IndexSpec, vectors: np.ndarray) -> faiss.Index:
+    dim = vectors.shape[1]
+    match spec.index_type:
+        case "FLAT":
+            index = faiss.IndexFlatIP(dim)
+        case "HNSW":
+            index = faiss.IndexHNSWFlat(dim, spec.params["M"], faiss.METRIC_INNER_PRODUCT)
+            index.hnsw.efConstruction = spec.params["efConstruction"]
+        case "IVF_FLAT" | "IVF_SQ8":
+            quantizer = faiss.IndexFlatIP(dim)
+            if spec.index_type == "IVF_FLAT":
+                index = faiss.IndexIVFFlat(quantizer, dim, spec.params["nlist"], faiss.METRIC_INNER_PRODUCT)
+            else:
+                index = faiss.IndexIVFScalarQuantizer(
+                    quantizer, dim, spec.params["nlist"], faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT
+                )
+            sample = np.random.default_rng(0).choice(len(vectors), min(len(vectors), spec.params["nlist"] * 64))
+            index.train(vectors[np.sort(sample)])
+        case _:
+            raise NotImplementedError(f"Unknown index type: {spec.index_type}")
+    index.add(vectors)
+
+    return index
+
+
+def sweep(spec: IndexSpec, index: faiss.Index, queries: np.ndarray, truth: np.ndarray, topk: int):
+    match spec.search_param:
+        case "ef":
+            levels = [16, 32, 64, 128, 256]
+        case "nprobe":
+            levels = sorted({n for n in [1, 4, 8, 16, 32, 64, 128] if n <= spec.params["nlist"]})
+        case _:
+            levels = [None]
+
+    default = spec.default_search_level(topk)
+    for level in levels:
+        match spec.search_param:
+            case "ef":
+                params = faiss.SearchParametersHNSW(efSearch=max(level, topk))
+            case "nprobe":
+                params = faiss.SearchParametersIVF(nprobe=level)
+            case _:
+                params = None
+
+        start = time.perf_counter()
+        _, found = index.search(queries, topk, params=params)
+        elapsed = time.perf_counter() - start
+
+        recall = np.mean([len(np.intersect1d(f, t)) / topk for f, t in zip(found, truth)])
+        mark = " (default)" if level is not None and level == default else ""
+        print(
+            f"{spec.index_type:8s} {spec.search_param or '-':>6s}={str(level):>4s} | recall@{topk} {recall:.3f}"
+            f" | {elapsed / len(queries) * 1000:7.3f} ms/query{mark}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep recall and latency of vector index types")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--collection", type=Path, help="Collection directory of the local embedding store")
+    source.add_argument("--synthetic", type=int, help="Number of synthetic vectors")
+    parser.add_argument("--dim", type=int, default=512)
+    parser.add_argument("--num-queries", type=int, default=200)
+    parser.add_argument("--topk", type=int, default=10)
+    parser.add_argument("--index-types", nargs="+", default=["FLAT", "HNSW", "IVF_FLAT", "IVF_SQ8"])
+    args = parser.parse_args()
+
+    if args.collection is not None:
+        vectors = load_collection(args.collection)
+    else:
+        vectors = make_synthetic(args.synthetic, args.dim)
+    faiss.normalize_L2(vectors)
+    logger.info(f"Loaded {len(vectors)} vectors of dim {vectors.shape[1]}")
+
+    rng = np.random.default_rng(1)
+    queries = vectors[rng.choice(len(vectors), args.num_queries, replace=False)]
+    queries = queries + 0.05 * rng.standard_normal(queries.shape, dtype=np.float32)
+    faiss.normalize_L2(queries)
+
+    exact = faiss.IndexFlatIP(vectors.shape[1])
+    exact.add(vectors)
+    _, truth = exact.search(queries, args.topk)
+
+    # Build parameters follow what `choose_index` would pick for this size, whatever family is swept
+    auto = choose_index(len(vectors))
+    logger.info(f"choose_index({len(vectors)}) -> {auto.index_type} {auto.params}")
+    nlist = auto.params.get("nlist") or choose_index(max(len(vectors), 1_000_000)).params["nlist"]
+    specs = {
+        "FLAT": IndexSpec("FLAT"),
+        "HNSW": IndexSpec("HNSW", {"M": 16, "efConstruction": 200}),
+        "IVF_FLAT": IndexSpec("IVF_FLAT", {"nlist": min(nlist, len(vectors) // 39)}),
+        "IVF_SQ8": IndexSpec("IVF_SQ8", {"nlist": min(nlist, len(vectors) // 39)}),
+    }
+
+    for index_type in args.index_types:
+        spec = specs[index_type]
+        start = time.perf_counter()
+        index = build(spec, vectors)
+        logger.info(f"Built {index_type} {spec.params} in {time.perf_counter() - start:.1f}s")
+        sweep(spec, index, queries, truth, args.topk)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+# coding: utf-8
+
+"""
+Compare keyword extraction throughput of the single-image path against batched generation
+
+Usage:
+    python -m benchmarks.keyword_batch <image directory> [--num-images 16] [--batch-sizes 2 4 8]
+"""
+
+import argparse
+import time
+from pathlib import Path
+
+from loguru import logger
+
+from src.services.keyword_extraction import KeywordExtractionUtils
+
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png", ".webp"}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark single-image vs batched keyword extraction")
+    parser.add_argument("image_dir", type=Path)
+    parser.add_argument("--num-images", type=int, default=16)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[2, 4, 8])
+    args = parser.parse_args()
+
+    paths = sorted(path for path in args.image_dir.rglob("*") if path.suffix.lower() in IMAGE_SUFFIXES)
+    images = [path.read_bytes() for path in paths[: args.num_images]]
+    assert len(images) > 0, f"No image found in {args.image_dir}"
+
+    extractor = KeywordExtractionUtils()
+
+    # Warm up so that lazy initialization is not counted
+    extractor.extract_keyword(images[0])
+
+    start = time.perf_counter()
+    reference = [extractor.extract_keyword(img) for img in images]
+    elapsed = time.perf_counter() - start
+    logger.info(f"single     : {len(images) / elapsed * 60:8.2f} images/min")
+
+    for batch_size in args.batch_sizes:
+        start = time.perf_counter()
+        output = []
+        for i in range(0, len(images), batch_size):
+            output.extend(extractor.extract_keywords_batch(images[i : i + batch_size]))
+        elapsed = time.perf_counter() - start
+
+        num_same = sum(ref == out for ref, out in zip(reference, output))
+        logger.info(
+            f"batch = {batch_size:3d}: {len(images) / elapsed * 60:8.2f} images/min"
+            f" | {num_same}/{len(images)} identical to single-image output"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+# coding: utf-8
+
+"""
+Measure recall gain and latency cost of re-scoring ANN candidates against full-precision vectors
+
+The first stage mirrors production: float16 vectors in an IVF_FLAT index searched at `nprobe=10`. The second stage
+fetches `topk * factor` candidates and re-scores them with `ExactEmbdStore`. Recall@k is measured against the exact
+float32 top k, and top-1 agreement stands for near-duplicate detection, which only looks at the best match.
+
+Usage:
+    python -m benchmarks.rerank --synthetic 200000 [--dim 512] [--factors 1 2 4 8]
+    python -m benchmarks.rerank --collection embd_store/resource_embd
+"""
+
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+import faiss
+import numpy as np
+from loguru import logger
+
+from benchmarks.index_sweep import load_collection, make_synthetic
+from src.services.emb_store import EmbdObj
+from src.services.exact_store import ExactEmbdStore
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark exact re-ranking of ANN candidates")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--collection", type=Path, help="Collection directory of the local embedding store")
+    source.add_argument("--synthetic", type=int, help="Number of synthetic vectors")
+    parser.add_argument("--dim", type=int, default=512)
+    parser.add_argument("--num-queries", type=int, default=200)
+    parser.add_argument("--topk", type=int, default=10)
+    parser.add_argument("--nlist", type=int, default=1024)
+    parser.add_argument("--nprobe", type=int, default=10)
+    parser.add_argument("--factors", type=int, nargs="+", default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    if args.collection is not None:
+        vectors = load_collection(args.collection)
+    else:
+        vectors = make_synthetic(args.synthetic, args.dim)
+    faiss.normalize_L2(vectors)
+    dim = vectors.shape[1]
+
+    rng = np.random.default_rng(1)
+    queries = vectors[rng.choice(len(vectors), args.num_queries, replace=False)]
+    queries = queries + 0.05 * rng.standard_normal(queries.shape, dtype=np.float32)
+    faiss.normalize_L2(queries)
+
+    exact = faiss.IndexFlatIP(dim)
+    exact.add(vectors)
+    _, truth = exact.search(queries, args.topk)
+
+    # First stage sees float16-rounded vectors, as stored in FLOAT16_VECTOR fields
+    vectors_f16 = vectors.astype(np.float16).astype(np.float32)
+    index = faiss.IndexIVFFlat(faiss.IndexFlatIP(dim), dim, args.nlist, faiss.METRIC_INNER_PRODUCT)
+    index.train(vectors_f16[np.sort(rng.choice(len(vectors), min(len(vectors), args.nlist * 64), replace=False))])
+    index.add(vectors_f16)
+    params = faiss.SearchParametersIVF(nprobe=args.nprobe)
+
+    with tempfile.TemporaryDirectory() as root_dir:
+        store = ExactEmbdStore(root_dir, dim, "COSINE")
+        for start in range(0, len(vectors), 65536):
+            chunk = vectors[start : start + 65536]
+            store.put(list(range(start, start + len(chunk))), list(chunk))
+        logger.info(f"Indexed {len(vectors)} vectors of dim {dim} (nlist={args.nlist}, nprobe={args.nprobe})")
+
+        for factor in [0, *args.factors]:
+            num_fetch = args.topk * max(factor, 1)
+
+            start = time.perf_counter()
+            scores, rows = index.search(queries, num_fetch, params=params)
+            elapsed_ann = time.perf_counter() - start
+
+            candidates = [
+                [EmbdObj(obj_id=int(row), similarity=float(score), resource_id=int(row)) for score, row in zip(s, r)]
+                for s, r in zip(scores, rows)
+            ]
+            start = time.perf_counter()
+            if factor > 0:
+                candidates = store.rerank(list(queries), candidates, args.topk)
+            elapsed_rerank = time.perf_counter() - start
+
+            found = [[entry.resource_id for entry in arr[: args.topk]] for arr in candidates]
+            recall = np.mean([len(np.intersect1d(f, t)) / args.topk for f, t in zip(found, truth)])
+            top1 = np.mean([len(f) > 0 and f[0] == t[0] for f, t in zip(found, truth)])
+            name = f"rerank x{factor}" if factor > 0 else "ANN only"
+            print(
+                f"{name:10s} | recall@{args.topk} {recall:.3f} | top-1 {top1:.3f}"
+                f" | ANN {elapsed_ann / len(queries) * 1000:6.3f} + rerank {elapsed_rerank / len(queries) * 1000:6.3f}"
+                " ms/query"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+# coding: utf-8
+
+"""
+Measure memory per worker process with private and memory-mapped model weights, and throughput as workers scale
+
+Each worker loads the model either privately (`from_pretrained`) or mapped from a snapshot (`load_shared`). Once
+all of them are loaded, every worker reports its memory from `/proc/self/smaps_rollup`: RSS counts shared pages in
+full, PSS splits them between the processes mapping them, and USS (private pages) is what one more worker costs.
+CLIP workers then encode text batches concurrently, each with an even share of the cores, for the throughput.
+
+Linux only.
+
+Usage:
+    python -m benchmarks.shared_weights [--model clip|keyword] [--model-name NAME] [--workers 1 2 4]
+        [--modes private shared] [--weights-dir DIR] [--iters 20] [--batch-size 32]
+"""
+
+import argparse
+import multiprocessing as mp
+import os
+import tempfile
+import time
+
+import torch
+
+from src import config
+from src.services.shared_weights import load_shared
+
+
+def model_class(kind: str):
+    match kind:
+        case "clip":
+            from transformers import CLIPModel
+
+            return CLIPModel
+        case "keyword":
+            from transformers import Qwen2_5_VLForConditionalGeneration
+
+            return Qwen2_5_VLForConditionalGeneration
+        case _:
+            raise NotImplementedError(f"Unknown model: {kind}")
+
+
+def memory_mb() -> dict:
+    fields = {}
+    with open("/proc/self/smaps_rollup") as file:
+        for line in file:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                fields[parts[0].rstrip(":")] = int(parts[1]) / 1024
+
+    return {
+        "rss": fields["Rss"],
+        "pss": fields["Pss"],
+        "uss": fields["Private_Clean"] + fields["Private_Dirty"],
+    }
+
+
+def work(args: argparse.Namespace, mode: str, num_threads: int, barrier, results):
+    torch.set_num_threads(num_threads)
+    dtype = torch.float16 if args.model == "keyword" else config.DTYPE
+    cls = model_class(args.model)
+    if mode == "shared":
+        model = load_shared(cls, args.model_name, dtype, args.weights_dir)
+    else:
+        model = cls.from_pretrained(args.model_name, dtype=dtype).eval()
+
+    # Mapped pages only count once read: touch every weight, as serving would
+    with torch.inference_mode():
+        for tensor in model.state_dict().values():
+            tensor.sum()
+
+    barrier.wait()
+    memory = memory_mb()
+    barrier.wait()
+
+    items_per_s = None
+    if args.model == "clip":
+        vocab_size = model.config.text_config.vocab_size
+        input_ids = torch.randint(0, vocab_size - 2, (args.batch_size, 16))
+        attention_mask = torch.ones_like(input_ids)
+        with torch.inference_mode():
+            model.get_text_features(input_ids=input_ids, attention_mask=attention_mask)
+            barrier.wait()
+            start = time.perf_counter()
+            for _ in range(args.iters):
+                model.get_text_features(input_ids=input_ids, attention_mask=attention_mask)
+            items_per_s = args.iters * args.batch_size / (time.perf_counter() - start)
+
+    results.put({**memory, "items_per_s": items_per_s})
+
+
+def run(args: argparse.Namespace, mode: str, num_workers: int) -> list[dict]:
+    ctx = mp.get_context("spawn")
+    barrier = ctx.Barrier(num_workers)
+    results = ctx.Queue()
+    num_threads = max((os.cpu_count() or 1) // num_workers, 1)
+    workers = [ctx.Process(target=work, args=(args, mode, num_threads, barrier, results)) for _ in range(num_workers)]
+    for worker in workers:
+        worker.start()
+    out = [results.get() for _ in workers]
+    for worker in workers:
+        worker.join()
+
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark sharing model weights between worker processes")
+    parser.add_argument("--model", choices=["clip", "keyword"], default="clip")
+    parser.add_argument("--model-name", default=None, help="Defaults to EMBD_MODEL_NAME or KEYWORD_MODEL_NAME")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--modes", nargs="+", choices=["private", "shared"], default=["private", "shared"])
+    parser.add_argument("--weights-dir", default=None, help="Snapshot directory; a temporary one if unset")
+    parser.add_argument("--iters", type=int, default=20, help="Text batches encoded per CLIP worker")
+    parser.add_argument("--batch-size", type=int, default=32)
+    args = parser.parse_args()
+
+    if args.model_name is None:
+        args.model_name = config.EMBD_MODEL_NAME if args.model == "clip" else config.KEYWORD_MODEL_NAME
+
+    tmp_dir = None
+    if args.weights_dir is None:
+        tmp_dir = tempfile.TemporaryDirectory()
+        args.weights_dir = tmp_dir.name
+    if "shared" in args.modes:
+        # Write the snapshot up front so that its cost is not measured in the workers
+        dtype = torch.float16 if args.model == "keyword" else config.DTYPE
+        load_shared(model_class(args.model), args.model_name, dtype, args.weights_dir)
+
+    for mode in args.modes:
+        for num_workers in args.workers:
+            out = run(args, mode, num_workers)
+            total_pss = sum(r["pss"] for r in out)
+            line = (
+                f"{mode:8s} workers={num_workers:<2d} | total PSS {total_pss:9.1f} MB"
+                f" | per worker RSS {max(r['rss'] for r in out):8.1f} MB USS {max(r['uss'] for r in out):8.1f} MB"
+            )
+            if args.model == "clip":
+                line += f" | {sum(r['items_per_s'] for r in out):8.1f} texts/s"
+            print(line)
+
+    if tmp_dir is not None:
+        tmp_dir.cleanup()
+
+
+if __name__ == "__main__":
+    main()
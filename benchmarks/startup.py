@@ -0,0 +1,100 @@
+# coding: utf-8
+
+"""
+Measure the import time of `src.services` and the time-to-ready of the web server
+
+Import time is measured in fresh interpreters, as it is dominated by module-level work that a warm process would
+not repeat. Time-to-ready starts a uvicorn server and polls `/healthz` (process answering) and `/readyz` (models
+loaded and warmed up) from the moment the process is spawned; the per-step breakdown reported by `/readyz` is
+printed as well.
+
+Usage:
+    python -m benchmarks.startup [--repeats 5] [--port 8765] [--timeout 900] [--skip-server]
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+IMPORT_SNIPPET = "import time; start = time.perf_counter(); import src.services; print(time.perf_counter() - start)"
+
+
+def measure_import(repeats: int) -> list[float]:
+    out = []
+    for _ in range(repeats):
+        result = subprocess.run([sys.executable, "-c", IMPORT_SNIPPET], capture_output=True, text=True, check=True)
+        out.append(float(result.stdout.strip().splitlines()[-1]) * 1000)
+
+    return out
+
+
+def probe(url: str) -> tuple[int, dict | None]:
+    try:
+        with urllib.request.urlopen(url, timeout=2) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read() or b"null")
+    except (urllib.error.URLError, ConnectionError, TimeoutError):
+        return 0, None
+
+
+def measure_server(port: int, timeout: float) -> dict:
+    base = f"http://127.0.0.1:{port}"
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "src.main:app", "--port", str(port), "--log-level", "warning"]
+    )
+
+    out = {"healthz_ms": None, "readyz_ms": None, "readyz": None}
+    try:
+        while time.perf_counter() - start < timeout and server.poll() is None:
+            if out["healthz_ms"] is None and probe(f"{base}/healthz")[0] == 200:
+                out["healthz_ms"] = (time.perf_counter() - start) * 1000
+
+            status, body = probe(f"{base}/readyz")
+            if status == 200 or (body is not None and body.get("error") is not None):
+                out["readyz_ms"] = (time.perf_counter() - start) * 1000 if status == 200 else None
+                out["readyz"] = body
+                break
+
+            time.sleep(0.05)
+    finally:
+        server.terminate()
+        server.wait()
+
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark import time and time-to-ready of the web server")
+    parser.add_argument("--repeats", type=int, default=5, help="Fresh interpreters to time the import in")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--timeout", type=float, default=900, help="Seconds to wait for readiness")
+    parser.add_argument("--skip-server", action="store_true", help="Only measure the import time")
+    args = parser.parse_args()
+
+    import_ms = measure_import(args.repeats)
+    print(
+        f"import src.services: median {statistics.median(import_ms):8.1f} ms"
+        f" | min {min(import_ms):8.1f} ms | max {max(import_ms):8.1f} ms ({args.repeats} runs)"
+    )
+
+    if args.skip_server:
+        return
+
+    result = measure_server(args.port, args.timeout)
+    for name in ["healthz", "readyz"]:
+        elapsed_ms = result[f"{name}_ms"]
+        print(f"/{name:8s}: " + (f"{elapsed_ms:8.1f} ms after spawn" if elapsed_ms is not None else "never ready"))
+
+    if result["readyz"] is not None:
+        print(json.dumps(result["readyz"], indent=2))
+
+
+if __name__ == "__main__":
+    main()
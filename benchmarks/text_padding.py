@@ -0,0 +1,96 @@
+# coding: utf-8
+
+"""
+Compare max-length padding of CLIP text inputs against length-bucketed dynamic padding
+
+Texts follow the mix of our text traffic: mostly keywords of one to three words ("red-color", "birthday party"),
+then search queries of a few words and a tail of long descriptions. Both paths run the configured CLIP backend on
+the same batches; outputs are compared by cosine similarity.
+
+Usage:
+    python -m benchmarks.text_padding [--num-texts 2048] [--batch-size 32] [--buckets 8 16 32]
+"""
+
+import argparse
+import time
+
+import numpy as np
+from loguru import logger
+
+from src.services import embd_extractor
+
+WORDS = (
+    "red blue green black white color cat dog car house tree beach mountain city street night sunset food pizza "
+    "coffee receipt invoice document screenshot chat message diagram chart table person people friend family party "
+    "birthday wedding holiday travel airport train ticket passport book notes whiteboard code laptop phone screen "
+    "flower garden snow rain river lake forest building bridge kitchen office meeting presentation slide"
+).split()
+
+
+def sample_texts(num_texts: int, seed: int = 0) -> list[str]:
+    rng = np.random.default_rng(seed)
+    texts = []
+    for kind in rng.choice(["keyword", "query", "long"], size=num_texts, p=[0.7, 0.25, 0.05]):
+        match kind:
+            case "keyword":
+                words = rng.choice(WORDS, rng.integers(1, 4))
+                texts.append(("-" if rng.random() < 0.5 else " ").join(words))
+            case "query":
+                texts.append(" ".join(rng.choice(WORDS, rng.integers(3, 13))))
+            case "long":
+                texts.append(" ".join(rng.choice(WORDS, rng.integers(15, 51))))
+
+    return texts
+
+
+def run(fn, texts: list[str], batch_size: int) -> tuple[list[np.ndarray], float]:
+    start = time.perf_counter()
+    out = []
+    for i in range(0, len(texts), batch_size):
+        out.extend(fn(texts[i : i + batch_size]))
+
+    return out, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark dynamic padding of CLIP text inputs")
+    parser.add_argument("--num-texts", type=int, default=2048)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--buckets", type=int, nargs="+", default=None, help="Bucket upper lengths to try")
+    args = parser.parse_args()
+
+    texts = sample_texts(args.num_texts)
+    lengths = np.array([len(ids) for ids in embd_extractor.tokenizer(texts, truncation=True)["input_ids"]])
+    logger.info(
+        f"{len(texts)} texts, token length p50 {np.percentile(lengths, 50):.0f} p90 {np.percentile(lengths, 90):.0f}"
+        f" max {lengths.max()} | backend '{embd_extractor.backend.name}'"
+    )
+    if args.buckets is not None:
+        embd_extractor.text_buckets = sorted(args.buckets)
+
+    # Warm up both paths so that lazy initialization is not counted
+    embd_extractor._forward_text_padded(texts[: args.batch_size])
+    embd_extractor._forward_text_bucketed(texts[: args.batch_size])
+
+    results = {}
+    for name, fn in [
+        ("max_length", embd_extractor._forward_text_padded),
+        ("bucketed", embd_extractor._forward_text_bucketed),
+    ]:
+        num_tokens, num_padded = embd_extractor._num_text_tokens, embd_extractor._num_text_padded
+        out, elapsed = run(fn, texts, args.batch_size)
+        results[name] = np.asarray(out, dtype=np.float32)
+        num_padded = embd_extractor._num_text_padded - num_padded
+        num_tokens = embd_extractor._num_text_tokens - num_tokens
+        logger.info(
+            f"{name:10s}: {len(texts) / elapsed:8.1f} texts/s | {num_padded / len(texts):5.1f} positions/text"
+            f" ({num_tokens / num_padded:.0%} real tokens)"
+        )
+
+    ref, out = results["max_length"], results["bucketed"]
+    sims = (ref * out).sum(1) / np.linalg.norm(ref, axis=1) / np.linalg.norm(out, axis=1)
+    logger.info(f"cosine bucketed vs max_length: min {sims.min():.6f} | max abs diff {np.abs(ref - out).max():.2e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,2 +1,5 @@
+from .health.router import require_ready
+from .health.router import router as HealthRouter
+from .monitor.router import router as MonitorRouter
 from .resource.router import router as ResourceRouter
 from .retrieval.router import router as RetrievalRouter
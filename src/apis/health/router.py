@@ -0,0 +1,44 @@
+# coding: utf-8
+
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import JSONResponse
+
+from src import services
+
+router = APIRouter(tags=["Health"])
+
+
+def require_ready():
+    # Routes needing the models answer 503 until they are loaded, instead of blocking the event loop on the loading
+    if not services.startup_state.ready:
+        raise HTTPException(status_code=503, detail="Service is starting up", headers={"Retry-After": "5"})
+
+
+@router.get(
+    "/healthz",
+    responses={
+        200: {"model": object, "description": "Process is alive"},
+        503: {"model": object, "description": "Startup failed; the process should be restarted"},
+    },
+    summary="Liveness probe",
+)
+async def healthz_get() -> JSONResponse:
+    state = services.startup_state
+    if state.error is not None:
+        return JSONResponse(status_code=503, content={"status": "failed", "error": state.error})
+
+    return JSONResponse(status_code=200, content={"status": "alive"})
+
+
+@router.get(
+    "/readyz",
+    responses={
+        200: {"model": object, "description": "Models are loaded and warmed up"},
+        503: {"model": object, "description": "Still starting up, or startup failed"},
+    },
+    summary="Readiness probe",
+)
+async def readyz_get() -> JSONResponse:
+    stats = services.startup_state.stats()
+
+    return JSONResponse(status_code=200 if stats["ready"] else 503, content=stats)
@@ -0,0 +1,35 @@
+# coding: utf-8
+
+from fastapi import APIRouter
+
+from src import services
+
+router = APIRouter(tags=["Monitor"], prefix="/monitor")
+
+
+def stats_if_loaded(name: str, method: str = "stats") -> dict | None:
+    # Services still loading are reported as None rather than built by this call
+    return getattr(getattr(services, name), method)() if services.is_loaded(name) else None
+
+
+@router.get(
+    "/stats",
+    responses={
+        200: {"model": object, "description": "Successful Response"},
+    },
+    summary="Get runtime statistics of inference services",
+)
+async def monitor_stats_get() -> dict:
+    return {
+        "startup": services.startup_state.stats(),
+        "embd_extractor": stats_if_loaded("embd_extractor"),
+        "clip_executor": services.clip_executor.stats(),
+        "keyword_executor": services.keyword_executor.stats(),
+        "ingest_pipeline": stats_if_loaded("ingest_pipeline"),
+        "keyword_index": services.keyword_index.stats(),
+        "embd_index": stats_if_loaded("embd_store", "index_stats"),
+        "embd_buffer": stats_if_loaded("embd_store", "buffer_stats"),
+        "result_cache": services.result_cache.stats(),
+        "db_pool": services.db.pool_stats(),
+        "db_dictionary": services.db.dictionary.stats(),
+    }
@@ -1,112 +1,147 @@
 # coding: utf-8
 
 
+import shutil
+import threading
+import uuid
 from io import BytesIO
+from pathlib import Path as FilePath
 
-from fastapi import APIRouter, BackgroundTasks, HTTPException, Path, UploadFile
-from fastapi.responses import Response, StreamingResponse
-from loguru import logger
+from fastapi import APIRouter, HTTPException, Path, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import Field
 from typing_extensions import Annotated
 
-from src.services import RESOURCE_TYPE, db, embd_extractor, embd_store, keyword_extractor, obj_store
+from src import config, services
+from src.services import RESOURCE_TYPE, BulkStats, JobInfo, content_hash, db
 
 router = APIRouter(
     prefix="/resource",
     tags=["Resource"],
 )
 
+# Bulk ingests started via the API, keyed by bulk ID, in start order
+bulk_jobs: dict[str, BulkStats] = {}
 
-def process_uploaded_file(raw: bytes, filename: str, content_type: str, thres_match: float = 0.95):
-    # =================================================
-    # Extract stuffs related to resource
-    # =================================================
-    # Extract keywords
-    logger.debug("Extract keywords")
+TAR_SUFFIXES = (".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tar.xz")
 
-    keywords = keyword_extractor.extract_keyword(raw)
 
-    # Extract embedding
-    logger.debug("Extract embeddings")
+def track_bulk(bulk_id: str, stats: BulkStats):
+    # Running ingests are always kept; finished ones only up to BULK_MAX_FINISHED, the oldest forgotten first
+    bulk_jobs[bulk_id] = stats
+    finished = [key for key, value in bulk_jobs.items() if value.status != "running"]
+    for key in finished[: max(len(finished) - config.BULK_MAX_FINISHED, 0)]:
+        del bulk_jobs[key]
 
-    embd_keywords = embd_extractor.get_embd_text([word["word"] for word in keywords if word is not None])
-    embd_img = embd_extractor.get_embd_image(BytesIO(raw))
 
-    # =================================================
-    # Check matching
-    # =================================================
-    # Check match using image
-    logger.debug("Check matching with image")
+def run_bulk_ingest(source: FilePath, stats: BulkStats):
+    services.bulk_ingestor.run(source, stats)
 
-    out = embd_store.search_similar_res(embd_img)
-    if out != []:
-        res_similar = out[0]
-        if res_similar.similarity >= thres_match:
-            logger.info(f"Uploaded resource similar with one already in system: {res_similar.resource_id}")
-            return
+    # Keep the spooled upload when it failed so that re-posting or the CLI can resume it
+    if stats.status == "done":
+        shutil.rmtree(source.parent, ignore_errors=True)
 
-    keywords_similar = embd_store.search_similar_keyword(embd_keywords)
-    for similar, keyword in zip(keywords_similar, keywords):
-        keyword["resource_id"] = (
-            similar[0].resource_id if similar != [] and similar[0].similarity >= thres_match else None
-        )
 
-    # =================================================
-    # Store extracted things
-    # =================================================
+@router.post(
+    "",
+    responses={
+        200: {"model": object, "description": "Identical item already exists or is being processed"},
+        202: {"model": object, "description": "Accepted"},
+        422: {"model": object, "description": "Validation Error"},
+        503: {"model": object, "description": "Processing queue is full"},
+    },
+    summary="Upload item",
+    response_model_by_alias=True,
+)
+async def resource_post(file: UploadFile) -> object:
+    raw = await file.read()
+    assert file.filename and file.content_type
+
+    # Byte-identical re-uploads cost one hash and one lookup
+    raw_hash = content_hash(raw)
+    existing = await db.afetch_resource_by_hash(raw_hash)
+    if raw_hash in existing:
+        return JSONResponse(status_code=200, content={"resource_id": existing[raw_hash], "detail": "Duplicate"})
+    job_id = services.ingest_pipeline.journal.find_unfinished(raw_hash)
+    if job_id is not None:
+        return JSONResponse(status_code=200, content={"job_id": job_id, "detail": "Duplicate of a queued upload"})
 
-    # Store in Object store
-    logger.debug("Store file")
+    job_id = services.ingest_pipeline.submit(raw, file.filename, file.content_type, raw_hash)
 
-    obj_store.save(filename, BytesIO(raw))
+    return JSONResponse(status_code=202, content={"job_id": job_id, "detail": "Uploaded file is queued for processing"})
 
-    # Store new keywords in Attribute DB and Embd store
-    logger.debug("Store keyword")
 
-    for keyword, embd in zip(keywords, embd_keywords):
-        if keyword["resource_id"] is not None:
-            continue
+@router.post(
+    "/bulk",
+    responses={
+        202: {"model": object, "description": "Accepted"},
+        422: {"model": object, "description": "Validation Error"},
+    },
+    summary="Upload many items at once, either as several files or as a single tar archive",
+    response_model_by_alias=True,
+)
+async def resource_bulk_post(files: list[UploadFile]) -> object:
+    bulk_id = uuid.uuid4().hex
+    spool_dir = FilePath(config.BULK_SPOOL_DIR) / bulk_id
+
+    if len(files) == 1 and files[0].filename and files[0].filename.endswith(TAR_SUFFIXES):
+        # Spool the archive to disk in chunks; it is then streamed member by member
+        spool_dir.mkdir(parents=True)
+        source = spool_dir / FilePath(files[0].filename).name
+        with open(source, "wb") as out:
+            while chunk := await files[0].read(1 << 20):
+                out.write(chunk)
+    else:
+        source = spool_dir / "files"
+        source.mkdir(parents=True)
+        for file in files:
+            assert file.filename
+            with open(source / FilePath(file.filename).name, "wb") as out:
+                while chunk := await file.read(1 << 20):
+                    out.write(chunk)
 
-        instance = db.insert_keyword(keyword["category"], keyword["word"])
-        keyword["resource_id"] = instance.id
+    stats = BulkStats(source=str(source.resolve()))
+    track_bulk(bulk_id, stats)
+    threading.Thread(target=run_bulk_ingest, args=(source, stats), name=f"bulk-{bulk_id}", daemon=True).start()
 
-        embd_store.insert_keyword_embd(embd, instance.id)
+    return JSONResponse(status_code=202, content={"bulk_id": bulk_id, "detail": "Bulk upload is queued for processing"})
 
-    # Store resource metadata in Attribute DB
-    logger.debug("Store metadata")
 
-    assert content_type
-    logger.debug(f"content_type: {content_type}")
-    if content_type.startswith("image"):
-        res_type = RESOURCE_TYPE.IMAGE.val
-    elif content_type.startswith("video"):
-        res_type = RESOURCE_TYPE.VIDEO.val
-    else:
-        raise NotImplementedError()
-    resource = db.insert_resource(res_type, filename, [word["word"] for word in keywords])
+@router.get(
+    "/bulk/{bulkId}",
+    responses={
+        200: {"model": object, "description": "Successful Response"},
+        404: {"model": object, "description": "Bulk upload not found"},
+    },
+    summary="Get progress and throughput of a bulk upload",
+    response_model_by_alias=True,
+)
+async def resource_bulk_get(bulk_id: str = Path(..., alias="bulkId", description="Bulk ID")) -> object:
+    stats = bulk_jobs.get(bulk_id)
 
-    # Store in Embedding store
-    logger.debug("Store embedding")
+    if stats is None:
+        raise HTTPException(404, "Bulk upload not found")
 
-    assert resource.id
-    embd_store.insert_res_embd(embd_img, resource.id)
+    return stats
 
 
-@router.post(
-    "",
+@router.get(
+    "/jobs/{jobId}",
     responses={
-        202: {"model": object, "description": "Accepted"},
-        422: {"model": object, "description": "Validation Error"},
+        200: {"model": JobInfo, "description": "Successful Response"},
+        404: {"model": object, "description": "Job not found"},
     },
-    summary="Upload item",
+    summary="Get processing status of an uploaded item",
     response_model_by_alias=True,
 )
-async def resource_post(file: UploadFile, background_tasks: BackgroundTasks) -> object:
-    raw = await file.read()
-    assert file.filename and file.content_type
-    background_tasks.add_task(process_uploaded_file, raw, file.filename, file.content_type)
+async def resource_job_get(job_id: str = Path(..., alias="jobId", description="Job ID")) -> JobInfo:
+    job = services.ingest_pipeline.journal.fetch(job_id)
+
+    if job is None:
+        raise HTTPException(404, "Job not found")
 
-    return Response(status_code=202, content="Uploaded file is queued for processing")
+    return job
 
 
 @router.get(
@@ -123,12 +158,12 @@ async def resource_resource_id_get(
     resource_id: Annotated[int, Field(description="Resource ID")] = Path(..., description="Resource ID", ge=0),
 ) -> StreamingResponse:
     # TODO: HoangLe [Jul-20]: Implement this
-    resource = db.fetch_resource(resource_id=resource_id)
+    resource = await db.afetch_resource(resource_id=resource_id)
 
     if resource is None:
         raise HTTPException(404, "Resource not found")
 
-    data = obj_store.load(resource.name)
+    data = await run_in_threadpool(services.obj_store.load, resource.name)
     match resource.res_type.type:
         case RESOURCE_TYPE.IMAGE.val:
             media_type = "image/png"
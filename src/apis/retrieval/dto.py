@@ -0,0 +1,31 @@
+from datetime import datetime
+from typing import Optional
+
+from pydantic import Base64Bytes, BaseModel, Field, StrictStr, model_validator
+
+from src import config
+
+
+class BatchQuery(BaseModel):
+    """One query of a batch: either a text or a base64-encoded image."""
+
+    text: Optional[StrictStr] = None
+    image: Optional[Base64Bytes] = None
+
+    @model_validator(mode="after")
+    def check_one_input(self) -> "BatchQuery":
+        if (self.text is None) == (self.image is None):
+            raise ValueError("Exactly one of 'text' and 'image' must be given")
+
+        return self
+
+
+class BatchRetrievalRequest(BaseModel):
+    queries: list[BatchQuery] = Field(..., min_length=1, max_length=config.RETRIEVAL_BATCH_MAX_QUERIES)
+    # Milvus rejects searches with a limit of 0
+    topk: int = Field(2, ge=1)
+    res_type: Optional[StrictStr] = None
+    added_after: Optional[datetime] = None
+    added_before: Optional[datetime] = None
+    nprobe: Optional[int] = Field(None, ge=1)
+    ef: Optional[int] = Field(None, ge=1)
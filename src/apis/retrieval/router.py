@@ -1,13 +1,21 @@
 # coding: utf-8
 
-from typing import List, Optional, Tuple, Union
+import asyncio
+import time
+from datetime import datetime
+from typing import Callable, List, Literal, Optional, Tuple, Union
 
-from fastapi import APIRouter, Body, Query
+from fastapi import APIRouter, Body, HTTPException, Query, Response
+from fastapi.concurrency import run_in_threadpool
+from PIL import Image
 from pydantic import Field, StrictBytes, StrictStr
 from typing_extensions import Annotated
 
 from src import services
+from src.services.db import db
+from src.services.image import DecodedImage
 
+from .dto import BatchRetrievalRequest
 from .model import NearestItem
 
 router = APIRouter(tags=["Retrieval"], prefix="/retrieval")
@@ -33,20 +41,52 @@ async def retrieval_image_post(
     "/text",
     responses={
         200: {"model": List[NearestItem], "description": "Successful Response"},
+        503: {"model": object, "description": "Inference queue is full"},
     },
     summary="Get top k resources via query text",
     response_model_by_alias=True,
 )
 async def retrieval_text_get(
-    text: StrictStr = Query(None, description="", alias="text"),
-    topk: Optional[Annotated[int, Field(strict=False, ge=0)]] = Query(2, description="", alias="topk", ge=0),
+    response: Response,
+    text: StrictStr = Query(..., description="", alias="text"),
+    # Milvus rejects searches with a limit of 0
+    topk: Optional[Annotated[int, Field(strict=False, ge=1)]] = Query(2, description="", alias="topk", ge=1),
+    mode: Literal["vector", "keyword", "hybrid"] = Query("hybrid", description="Retrieval legs to run", alias="mode"),
+    fusion: Optional[Literal["rrf", "weighted"]] = Query(None, description="Fusion of hybrid legs", alias="fusion"),
+    res_type: Optional[StrictStr] = Query(None, description="Resource type to keep", alias="res_type"),
+    added_after: Optional[datetime] = Query(None, description="Keep resources added at or after", alias="added_after"),
+    added_before: Optional[datetime] = Query(None, description="Keep resources added before", alias="added_before"),
+    nprobe: Optional[int] = Query(None, description="IVF lists to probe", alias="nprobe", ge=1),
+    ef: Optional[int] = Query(None, description="HNSW search breadth", alias="ef", ge=1),
 ) -> List[NearestItem]:
-    text_embd = services.embd_extractor.get_embd_text(text)[0].tolist()
+    filters = services.EmbdFilter(added_after=added_after, added_before=added_before)
+    if res_type is not None:
+        filters.res_type = db.dictionary.lookup_res_type(res_type)
+        if filters.res_type is None:
+            return []
+
+    # Polled queries are answered from the result cache, skipping both the encoder and the vector store
+    key = ("text", " ".join(text.split()).lower(), topk, mode, fusion, nprobe, ef, filters.model_dump_json())
+    epoch = services.retriever.epoch()
+    fetched = services.result_cache.get(key, epoch)
+    if fetched is not None:
+        response.headers["Server-Timing"] = "cache;desc=hit"
+        return [NearestItem(item_id=resource_id) for resource_id, _ in fetched]
+
+    start = time.perf_counter()
+    text_embd = (await services.clip_executor.run(services.embd_extractor.get_embd_text, text))[0]
+    elapsed_embd = (time.perf_counter() - start) * 1000
+
+    fetched, timings = await services.retriever.search(
+        text_embd, topk or 0, mode, filters, fusion, nprobe=nprobe, ef=ef
+    )
+    services.result_cache.put(key, epoch, fetched)
 
-    # TODO: HoangLe [Jul-20]: Fix this: Retrieve with embd_store instead
-    # fetched = db.fetch_similar_items(text_embd=str(text_embd), topk=topk)
-    fetched = [1, 2, 3]
-    ret = [NearestItem(item_id=entry) for entry in fetched]
+    # Latency of every step, in the standard Server-Timing format
+    timings = {"embed": elapsed_embd, **timings}
+    response.headers["Server-Timing"] = ", ".join(f"{name};dur={elapsed:.2f}" for name, elapsed in timings.items())
+
+    ret = [NearestItem(item_id=resource_id) for resource_id, _ in fetched]
 
     return ret
 
@@ -60,14 +100,96 @@ async def retrieval_text_get(
     response_model_by_alias=True,
 )
 async def retrieval_keyword_get(
-    keyword: list[str] = Query(None, description="", alias="text"),
+    keyword: list[str] = Query(..., description="", alias="keyword"),
+    mode: Literal["or", "and"] = Query("or", description="Match any or every keyword", alias="mode"),
     topk: Optional[Annotated[int, Field(strict=False, ge=0)]] = Query(2, description="", alias="topk", ge=0),
 ) -> List[NearestItem]:
-    text_embd = services.embd_extractor.get_embd_text(text)[0].tolist()
+    match_all = mode == "and"
+
+    key = ("keyword", tuple(sorted(set(keyword))), topk, mode)
+    epoch = services.retriever.epoch()
+    fetched = services.result_cache.get(key, epoch)
+    if fetched is not None:
+        return [NearestItem(item_id=resource_id) for resource_id, _ in fetched]
+
+    word2id = await run_in_threadpool(db.dictionary.keyword_ids, keyword)
+    if len(word2id) == 0 or (match_all and len(word2id) < len(set(keyword))):
+        return []
+    keyword_ids = list(word2id.values())
 
-    # TODO: HoangLe [Jul-20]: Fix this: Retrieve with embd_store instead
-    # fetched = db.fetch_similar_items(text_embd=str(text_embd), topk=topk)
-    fetched = [1, 2, 3]
-    ret = [NearestItem(item_id=entry) for entry in fetched]
+    if services.keyword_index.ready:
+        fetched = services.keyword_index.search(keyword_ids, topk, match_all=match_all)
+    else:
+        fetched = await db.afetch_resources_by_keywords(keyword_ids, match_all, topk)
+    services.result_cache.put(key, epoch, fetched)
+    ret = [NearestItem(item_id=resource_id) for resource_id, _ in fetched]
 
     return ret
+
+
+async def _encode_batch(fn: Callable, inputs: list) -> list:
+    return await services.clip_executor.run(fn, inputs) if len(inputs) > 0 else []
+
+
+def _decode_images(images: dict[int, bytes]) -> dict[int, DecodedImage]:
+    """Decode the images of a batch, keyed by query index; raise 422 listing every query that is not an image."""
+
+    decoded, errors = {}, []
+    for i, raw in images.items():
+        try:
+            decoded[i] = DecodedImage.from_bytes(raw)
+        except (OSError, ValueError, Image.DecompressionBombError) as e:
+            errors.append(
+                {
+                    "loc": ["body", "queries", i, "image"],
+                    "msg": f"Not a decodable image ({type(e).__name__})",
+                    "type": "value_error",
+                }
+            )
+
+    if len(errors) > 0:
+        raise HTTPException(422, errors)
+
+    return decoded
+
+
+@router.post(
+    "/batch",
+    responses={
+        200: {"model": List[List[NearestItem]], "description": "Successful Response"},
+        422: {"model": object, "description": "Validation Error"},
+        503: {"model": object, "description": "Inference queue is full"},
+    },
+    summary="Get top k resources for many text or image queries in one request",
+    response_model_by_alias=True,
+)
+async def retrieval_batch_post(body: BatchRetrievalRequest) -> List[List[NearestItem]]:
+    filters = services.EmbdFilter(added_after=body.added_after, added_before=body.added_before)
+    if body.res_type is not None:
+        filters.res_type = db.dictionary.lookup_res_type(body.res_type)
+        if filters.res_type is None:
+            return [[] for _ in body.queries]
+
+    # Images are decoded up front so that one corrupted image fails its own query with a 422, not the batch with a 500
+    images = await run_in_threadpool(
+        _decode_images, {i: query.image for i, query in enumerate(body.queries) if query.image is not None}
+    )
+
+    # Texts and images are each encoded as one batch, both batches concurrently
+    idx_texts = [i for i, query in enumerate(body.queries) if query.text is not None]
+    idx_images = list(images)
+    embds_text, embds_image = await asyncio.gather(
+        _encode_batch(services.embd_extractor.get_embd_text, [body.queries[i].text for i in idx_texts]),
+        _encode_batch(services.embd_extractor.get_embd_images, list(images.values())),
+    )
+
+    embds = [None] * len(body.queries)
+    for i, embd in zip(idx_texts + idx_images, embds_text + embds_image):
+        embds[i] = embd
+
+    # A single multi-vector search for the whole batch
+    results = await run_in_threadpool(
+        services.embd_store.search_similar_res_many, embds, body.topk, filters, body.nprobe, body.ef
+    )
+
+    return [[NearestItem(item_id=entry.resource_id) for entry in result] for result in results]
@@ -0,0 +1,47 @@
+# coding: utf-8
+
+"""
+Backfill images from a directory or a tarball
+
+Usage:
+    python -m src.bulk_ingest <directory | archive.tar[.gz]> [--batch-size N]
+
+Progress is recorded per item, so re-running the same command after a crash skips what was already ingested.
+"""
+
+import argparse
+from pathlib import Path
+
+from loguru import logger
+
+from src import services
+from src.services.db import db
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk ingest images from a directory or a tarball")
+    parser.add_argument("source", type=Path, help="Directory or (compressed) tar archive of images")
+    parser.add_argument("--batch-size", type=int, default=None, help="Number of images processed together")
+    args = parser.parse_args()
+
+    if not args.source.exists():
+        parser.error(f"Source not found: {args.source}")
+
+    if args.batch_size is not None:
+        services.bulk_ingestor.batch_size = args.batch_size
+
+    db.create_db()
+    db.dictionary.load()
+    # Perceptual hashes of stored resources, so that near-duplicates of them are skipped as by the server
+    services.phash_index.load(db.fetch_phashes())
+
+    stats = services.bulk_ingestor.run(args.source)
+    services.embd_store.close()
+    logger.info(
+        f"Finished with status '{stats.status}': {stats.num_done} ingested, {stats.num_duplicate} duplicate, "
+        f"{stats.num_skipped} skipped in {stats.elapsed:.1f}s ({stats.throughput:.2f} images/s)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -10,6 +10,12 @@ load_dotenv()
 # =================================================
 FASTAPI_ENV = os.getenv("FASTAPI_ENV", "development")
 API_VERSION = os.getenv("VERSION")
+# Server worker processes, also read by uvicorn as the default of `--workers`. CPU threads of the models are split
+# between them unless EMBD_NUM_THREADS is set, so that N workers do not oversubscribe the cores
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+# Snapshots of model weights in their runtime dtype, memory-mapped by every worker so that the host holds one copy
+# of each model instead of one per worker; written on first start. Weights moved to a GPU are never shared
+SHARED_WEIGHTS_DIR = os.getenv("SHARED_WEIGHTS_DIR")
 
 DB_PORT = os.getenv("DB_PORT")
 DB_PWD = os.getenv("DB_PWD")
@@ -17,6 +23,15 @@ DB_USER = os.getenv("DB_USER")
 DB_NAME = os.getenv("DB_NAME")
 DB_HOST = os.getenv("DB_HOST")
 
+# Connection pool shared by all sessions (sync and async engines each have one)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT_S = float(os.getenv("DB_POOL_TIMEOUT_S", "30"))
+
+# Models and vector stores are loaded in the background after the server starts; `/readyz` reports when they are.
+# The warm-up runs a synthetic pass through them first, so the first requests do not pay for lazy initialization
+STARTUP_WARMUP = os.getenv("STARTUP_WARMUP", "true").lower() == "true"
+
 
 # =================================================
 # Configs for Keyword Extractor
@@ -24,11 +39,34 @@ DB_HOST = os.getenv("DB_HOST")
 KEYWORD_MODEL_NAME = os.getenv("KEYWORD_MODEL_NAME")
 PROMPTS_PATH = os.getenv("PROMPTS_PATH")
 
+# Concurrency and backlog limits of the keyword model
+KEYWORD_MAX_CONCURRENCY = int(os.getenv("KEYWORD_MAX_CONCURRENCY", "1"))
+KEYWORD_MAX_QUEUE = int(os.getenv("KEYWORD_MAX_QUEUE", "16"))
+
+# Number of images generated together in one call, and how long a queued upload waits for others to join it
+KEYWORD_BATCH_SIZE = int(os.getenv("KEYWORD_BATCH_SIZE", "4"))
+KEYWORD_BATCH_MAX_WAIT_MS = float(os.getenv("KEYWORD_BATCH_MAX_WAIT_MS", "50"))
+
+# Stop generating once every suffix pattern has matched. The constrained mode instead forces the output into
+# "<prefix><value>" lines and requires a "prefix" entry for every suffix in the prompts file
+KEYWORD_EARLY_STOP = os.getenv("KEYWORD_EARLY_STOP", "true").lower() == "true"
+KEYWORD_CONSTRAINED = os.getenv("KEYWORD_CONSTRAINED", "false").lower() == "true"
+
 
 # =================================================
 # Configs for Embedding Extractor
 # =================================================
 DEVICE = os.getenv("DEVICE", "cpu")
+# "torchscript" (EMBD_MODEL_PATH cast to DTYPE on DEVICE), "torch" (eager EMBD_MODEL_NAME in DTYPE on DEVICE, the
+# only one whose weights SHARED_WEIGHTS_DIR shares), "torch-int8" (dynamically quantized, CPU) or "onnx" (ONNX
+# Runtime on CPU; towers are exported from EMBD_MODEL_NAME into EMBD_ONNX_DIR on first start)
+EMBD_BACKEND = os.getenv("EMBD_BACKEND", "torchscript")
+EMBD_ONNX_DIR = os.getenv("EMBD_ONNX_DIR", "res/clip_onnx")
+# Intra-op threads of the CPU backends; 0 keeps the runtime default (every core) or, with several server workers,
+# gives each an even share of the cores
+EMBD_NUM_THREADS = int(os.getenv("EMBD_NUM_THREADS", "0"))
+if EMBD_NUM_THREADS == 0 and WEB_CONCURRENCY > 1:
+    EMBD_NUM_THREADS = max((os.cpu_count() or 1) // WEB_CONCURRENCY, 1)
 EMBD_MODEL_NAME = os.getenv("EMBD_MODEL_NAME", "openai/clip-vit-base-patch32")
 EMBD_MODEL_PATH = os.getenv("EMBD_MODEL_PATH")
 dtype = os.getenv("DTYPE", "float16")
@@ -40,15 +78,103 @@ match dtype:
     case _:
         raise NotImplementedError()
 
+# Upper token lengths of the buckets texts are grouped and padded into; empty pads every text to the model maximum
+EMBD_TEXT_BUCKETS = [int(n) for n in os.getenv("EMBD_TEXT_BUCKETS", "8,16,32").split(",") if n.strip()]
+
+# Micro-batching of concurrent encode requests
+EMBD_BATCH_MAX_SIZE = int(os.getenv("EMBD_BATCH_MAX_SIZE", "32"))
+EMBD_BATCH_MAX_WAIT_MS = float(os.getenv("EMBD_BATCH_MAX_WAIT_MS", "5"))
+
+EMBD_DIM = int(os.getenv("EMBD_DIM", "512"))
+
+# Persistent embedding cache keyed by content hash, model name and dtype; set empty to disable
+EMBD_CACHE_DIR = os.getenv("EMBD_CACHE_DIR", "embd_cache")
+
+# Cache of query text embeddings; TTL in seconds, unset for no expiry
+EMBD_TEXT_CACHE_SIZE = int(os.getenv("EMBD_TEXT_CACHE_SIZE", "10000"))
+EMBD_TEXT_CACHE_TTL_S = float(os.getenv("EMBD_TEXT_CACHE_TTL_S")) if os.getenv("EMBD_TEXT_CACHE_TTL_S") else None
+
+# Concurrency and backlog limits of the embedding model; concurrency should be at least the batch size
+EMBD_MAX_CONCURRENCY = int(os.getenv("EMBD_MAX_CONCURRENCY", "32"))
+EMBD_MAX_QUEUE = int(os.getenv("EMBD_MAX_QUEUE", "128"))
+
 
 # =================================================
 # Configs for embedding store
 # =================================================
+# Either "milvus" or "local" (in-process memory-mapped index, see `services/local_index.py`)
+EMBDSTORE_BACKEND = os.getenv("EMBDSTORE_BACKEND", "milvus")
+EMBDSTORE_LOCAL_DIR = os.getenv("EMBDSTORE_LOCAL_DIR", "embd_store")
+
 EMBDSTORE_HOST = os.getenv("EMBDSTORE_HOST")
 EMBDSTORE_PORT = os.getenv("EMBDSTORE_PORT")
 
+# Inserts are buffered and written once the buffer reaches this size or age
+EMBDSTORE_FLUSH_SIZE = int(os.getenv("EMBDSTORE_FLUSH_SIZE", "512"))
+EMBDSTORE_FLUSH_AGE_S = float(os.getenv("EMBDSTORE_FLUSH_AGE_S", "2"))
+# Writers are turned away (HTTP 503) once this many entities wait in the buffer and Milvus cannot take them
+EMBDSTORE_MAX_BUFFER = int(os.getenv("EMBDSTORE_MAX_BUFFER", "8192"))
+# "AUTO" picks FLAT/HNSW/IVF by collection size; any other value forces that index family
+EMBDSTORE_INDEX_TYPE = os.getenv("EMBDSTORE_INDEX_TYPE", "AUTO")
+EMBDSTORE_INDEX_CHECK_S = float(os.getenv("EMBDSTORE_INDEX_CHECK_S", "600"))
+# Searches fetch this many times more candidates and re-score them against float32 copies kept in a local side
+# store (see `services/exact_store.py`); 0 disables the second stage
+EMBDSTORE_RERANK_FACTOR = int(os.getenv("EMBDSTORE_RERANK_FACTOR", "0"))
+EMBDSTORE_EXACT_DIR = os.getenv("EMBDSTORE_EXACT_DIR", "embd_exact")
+# Compression: projections fitted by `python -m src.maintenance compress-embd-store` are kept here per collection,
+# and "SQ8" or "PQ" quantizes the codes of indexes past the exact-search range
+EMBDSTORE_PROJECTION_DIR = os.getenv("EMBDSTORE_PROJECTION_DIR", "embd_projection")
+EMBDSTORE_QUANTIZATION = os.getenv("EMBDSTORE_QUANTIZATION") or None
+
+
+# =================================================
+# Configs for retrieval
+# =================================================
+# Hybrid retrieval fuses the vector and keyword legs with "rrf" (reciprocal rank) or "weighted" (normalized scores)
+RETRIEVAL_FUSION = os.getenv("RETRIEVAL_FUSION", "rrf")
+RETRIEVAL_RRF_K = int(os.getenv("RETRIEVAL_RRF_K", "60"))
+RETRIEVAL_VECTOR_WEIGHT = float(os.getenv("RETRIEVAL_VECTOR_WEIGHT", "0.5"))
+# Keywords closest to the query text (above the similarity threshold) feed the keyword leg
+RETRIEVAL_NUM_KEYWORDS = int(os.getenv("RETRIEVAL_NUM_KEYWORDS", "5"))
+RETRIEVAL_KEYWORD_MIN_SIM = float(os.getenv("RETRIEVAL_KEYWORD_MIN_SIM", "0.8"))
+# Each leg fetches this many times `topk` candidates before fusion
+RETRIEVAL_FETCH_FACTOR = int(os.getenv("RETRIEVAL_FETCH_FACTOR", "4"))
+# Largest number of queries accepted by one /retrieval/batch request
+RETRIEVAL_BATCH_MAX_QUERIES = int(os.getenv("RETRIEVAL_BATCH_MAX_QUERIES", "256"))
+# Cache of query results, invalidated by writes of this process and by new DB rows of any process (polled every
+# RETRIEVAL_CACHE_EPOCH_POLL_S). Changes that insert no row (e.g. maintenance rebuilds) only show once entries
+# expire after RETRIEVAL_CACHE_TTL_S; set it to 0 for no expiry
+RETRIEVAL_CACHE_SIZE = int(os.getenv("RETRIEVAL_CACHE_SIZE", "1024"))
+RETRIEVAL_CACHE_TTL_S = float(os.getenv("RETRIEVAL_CACHE_TTL_S", "60")) or None
+RETRIEVAL_CACHE_EPOCH_POLL_S = float(os.getenv("RETRIEVAL_CACHE_EPOCH_POLL_S", "1"))
 
 # =================================================
 # Configs for object store
 # =================================================
 FILESTORE_DIR = os.getenv("FILESTORE_DIR")
+
+
+# =================================================
+# Configs for ingest pipeline
+# =================================================
+INGEST_JOURNAL_PATH = os.getenv("INGEST_JOURNAL_PATH", "ingest_journal.sqlite3")
+# Workers sharing the journal replay the unfinished jobs of another only once it is dead or stopped renewing them
+INGEST_JOB_LEASE_S = float(os.getenv("INGEST_JOB_LEASE_S", "60"))
+# Uploads whose perceptual hash is within this Hamming distance of a stored resource are treated as duplicates
+PHASH_MAX_DISTANCE = int(os.getenv("PHASH_MAX_DISTANCE", "4"))
+INGEST_MAX_PENDING = int(os.getenv("INGEST_MAX_PENDING", "256"))
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "16"))
+INGEST_WORKERS_DECODE = int(os.getenv("INGEST_WORKERS_DECODE", "2"))
+INGEST_WORKERS_KEYWORD = int(os.getenv("INGEST_WORKERS_KEYWORD", "1"))
+INGEST_WORKERS_EMBED = int(os.getenv("INGEST_WORKERS_EMBED", "4"))
+# Persist re-checks dedup under a lock before writing, so two near-identical uploads to one server worker cannot
+# both be stored; persist workers take turns on that lock, hence a single one by default
+INGEST_WORKERS_DEDUP = int(os.getenv("INGEST_WORKERS_DEDUP", "1"))
+INGEST_WORKERS_PERSIST = int(os.getenv("INGEST_WORKERS_PERSIST", "1"))
+
+# Bulk ingest
+BULK_BATCH_SIZE = int(os.getenv("BULK_BATCH_SIZE", "32"))
+BULK_PROGRESS_PATH = os.getenv("BULK_PROGRESS_PATH", "bulk_progress.sqlite3")
+BULK_SPOOL_DIR = os.getenv("BULK_SPOOL_DIR", "bulk_spool")
+# Finished bulk uploads whose progress stays queryable through the API; older ones are forgotten
+BULK_MAX_FINISHED = int(os.getenv("BULK_MAX_FINISHED", "100"))
@@ -1,22 +1,89 @@
 # coding: utf-8
 
 
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import asynccontextmanager
 
-from fastapi import FastAPI
+from fastapi import Depends, FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 
-from src import config
-from src.apis import ResourceRouter, RetrievalRouter
+from src import config, services
+from src.apis import HealthRouter, MonitorRouter, ResourceRouter, RetrievalRouter, require_ready
+from src.services import QueueFullError
 from src.services.db import db
 
 
+def load_services():
+    state = services.startup_state
+
+    # Models and vector store connections are independent: build them concurrently. Loading mostly reads weights
+    # and runs native code that releases the GIL, so threads overlap well
+    with state.step("load"):
+        names = ["embd_store", "obj_store", "embd_extractor", "keyword_extractor"]
+        with ThreadPoolExecutor(len(names), thread_name_prefix="load") as pool:
+            list(pool.map(services.load, names))
+        services.load("retriever")
+        services.load("ingest_pipeline")
+
+    if config.STARTUP_WARMUP:
+        with state.step("warm_up"):
+            services.embd_extractor.warm_up()
+            services.keyword_extractor.warm_up()
+            services.embd_store.warm_up()
+
+    # Rebuild vector indexes in the background as collections outgrow them
+    services.embd_store.start_index_managers()
+
+    # Start ingest workers and replay uploads left unfinished by the previous run
+    services.ingest_pipeline.start()
+
+
+async def prepare():
+    try:
+        await asyncio.to_thread(load_services)
+    except Exception as e:
+        services.startup_state.set_failed(e)
+        return
+
+    services.startup_state.set_ready()
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    services.startup_state.begin()
+
     # Create tables
-    db.create_db()
+    with services.startup_state.step("db"):
+        db.create_db()
+
+        # Name -> id lookups of resource types, keyword categories and keywords
+        db.dictionary.load()
+
+        # Perceptual hashes of stored resources, used to skip near-duplicate uploads
+        services.phash_index.load(db.fetch_phashes())
+
+    # Keyword retrieval is served from the DB until the in-memory index is built in the background
+    services.keyword_index.start_loading(db.fetch_resource_keywords_after)
+
+    # Cached retrieval results go stale on inserts of other workers and of the bulk CLI too, and the keyword index
+    # has to read the resources they inserted
+    services.shared_epoch.on_change(lambda: services.keyword_index.catch_up(db.fetch_resource_keywords_after))
+    services.shared_epoch.start()
+
+    # Models load after the server starts listening, so that liveness probes answer meanwhile
+    task = asyncio.create_task(prepare())
     yield
 
+    # Loading threads cannot be interrupted; let them finish so that what they started is closed properly
+    await task
+    services.shared_epoch.stop()
+
+    # Write buffered embeddings before shutting down
+    if services.is_loaded("embd_store"):
+        services.embd_store.close()
+
 
 app = FastAPI(
     title="xButler webserver", description="Web server for ML services of xButler", version="1.1.0", lifespan=lifespan
@@ -26,6 +93,15 @@ app.add_middleware(
     CORSMiddleware, allow_origins=["*"], allow_credentials=True, allow_methods=["*"], allow_headers=["*"]
 )
 
+
+@app.exception_handler(QueueFullError)
+async def queue_full_handler(request: Request, exc: QueueFullError):
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": "1"})
+
+
 api_version = f"/{config.API_VERSION}"
-app.include_router(ResourceRouter, prefix=api_version)
-app.include_router(RetrievalRouter, prefix=api_version)
+app.include_router(ResourceRouter, prefix=api_version, dependencies=[Depends(require_ready)])
+app.include_router(RetrievalRouter, prefix=api_version, dependencies=[Depends(require_ready)])
+app.include_router(MonitorRouter, prefix=api_version)
+# Probes stay unversioned, as orchestrators address them by fixed paths
+app.include_router(HealthRouter)
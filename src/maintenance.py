@@ -0,0 +1,187 @@
+# coding: utf-8
+
+"""
+Maintenance commands
+
+Usage:
+    python -m src.maintenance rebuild-embd-store [--batch-size N]
+    python -m src.maintenance compact-embd-cache [--drop-other-models]
+    python -m src.maintenance compress-embd-store --dim N [--method pca|truncate] [--sample-size N]
+    python -m src.maintenance evaluate-compression [--dims 64 128 256] [--quantizations none SQ8 PQ]
+"""
+
+import argparse
+import time
+from io import BytesIO
+from pathlib import Path
+
+from loguru import logger
+
+from src import config, services
+from src.services import EmbdStoreUtils
+from src.services.compression import Projection, evaluate
+from src.services.db import db
+from src.services.embd_cache import EmbdDiskCache
+
+
+def rebuild_embd_store(batch_size: int):
+    """Drop both vector collections and re-fill them from the attribute DB and the object store.
+
+    Embeddings come from the on-disk embedding cache whenever possible, so CLIP only runs for files it never saw.
+    """
+
+    # Collections are rebuilt because they may not match the configuration any more: open them unchecked
+    stale = EmbdStoreUtils(check_schema=False)
+    stale.resource_embd.drop_collection()
+    stale.keyword_embd.drop_collection()
+    embd_store = EmbdStoreUtils()
+
+    start = time.perf_counter()
+
+    keywords = db.fetch_all_keywords()
+    for i in range(0, len(keywords), batch_size):
+        chunk = keywords[i : i + batch_size]
+        embds = services.embd_extractor.get_embd_text([keyword.word for keyword in chunk])
+        embd_store.insert_keyword_embd(embds, [keyword.id for keyword in chunk])
+    logger.info(f"Re-indexed {len(keywords)} keywords")
+
+    num_resources, last_id = 0, 0
+    while True:
+        resources = db.fetch_resources_after(last_id, batch_size)
+        if len(resources) == 0:
+            break
+
+        raws = [BytesIO(services.obj_store.load(resource.name)) for resource in resources]
+        embds = services.embd_extractor.get_embd_images(raws)
+        embd_store.insert_res_embd(
+            embds,
+            [resource.id for resource in resources],
+            [resource.resource_type for resource in resources],
+            [resource.date_added for resource in resources],
+        )
+
+        num_resources += len(resources)
+        last_id = resources[-1].id
+        logger.info(f"Re-indexed {num_resources} resources ({num_resources / (time.perf_counter() - start):.1f}/s)")
+
+    embd_store.close()
+
+
+def compact_embd_cache(drop_other_models: bool):
+    disk_cache = services.embd_extractor.disk_cache
+    if disk_cache is None:
+        logger.warning("Embedding cache is disabled (EMBD_CACHE_DIR is empty)")
+        return
+
+    cache_tag = services.embd_extractor.backend.cache_tag
+    keep_prefix = EmbdDiskCache.make_key("", config.EMBD_MODEL_NAME, cache_tag) if drop_other_models else None
+    disk_cache.compact(keep_prefix=keep_prefix)
+
+
+def compress_embd_store(dim: int, method: str, sample_size: int, batch_size: int):
+    """Fit a projection to `dim` dimensions for both collections, then rebuild them in the projected space.
+
+    `dim` 0 removes the projections, so the rebuilt collections are stored uncompressed again.
+    """
+
+    embd_store = services.embd_store
+    fitted = {}
+    for controller, projection in [
+        (embd_store.resource_embd, embd_store.res_projection),
+        (embd_store.keyword_embd, embd_store.keyword_projection),
+    ]:
+        if dim == 0:
+            fitted[controller.coll_name] = None
+        elif method == "truncate":
+            fitted[controller.coll_name] = Projection.truncate(embd_store.embd_dim, dim)
+        else:
+            # PCA is fitted on original vectors, which a compressed collection no longer holds
+            if projection is not None:
+                raise ValueError(
+                    f"Collection '{controller.coll_name}' is already compressed with '{projection.version}'; "
+                    "run `compress-embd-store --dim 0` first"
+                )
+            sample = controller.sample_vectors(sample_size)
+            if len(sample) < dim:
+                raise ValueError(f"Collection '{controller.coll_name}' holds too few vectors ({len(sample)}) for PCA")
+            fitted[controller.coll_name] = Projection.fit_pca(sample, dim)
+
+    # Projections are switched together right before the rebuild, which recreates collections in the new space
+    for coll_name, projection in fitted.items():
+        path_dir = Path(config.EMBDSTORE_PROJECTION_DIR) / coll_name
+        if projection is None:
+            Projection.clear(path_dir)
+        else:
+            projection.save(path_dir)
+
+    rebuild_embd_store(batch_size)
+
+
+def evaluate_compression(
+    dims: list[int], quantizations: list[str], method: str, sample_size: int, num_queries: int, topk: int
+):
+    """Report bytes per vector and recall@k, relative to uncompressed exact search, on stored resource vectors."""
+
+    if services.embd_store.res_projection is not None:
+        logger.warning(
+            f"Resource vectors are stored with projection '{services.embd_store.res_projection.version}'; "
+            "recall is measured relative to that space"
+        )
+
+    vectors = services.embd_store.resource_embd.sample_vectors(sample_size + num_queries)
+    if len(vectors) <= num_queries:
+        raise ValueError(f"Too few stored vectors ({len(vectors)}) to evaluate with {num_queries} queries")
+    base, queries = vectors[:-num_queries], vectors[-num_queries:]
+    logger.info(f"Evaluate on {len(base)} vectors and {len(queries)} queries")
+
+    for row in evaluate(base, queries, dims, quantizations, method, topk):
+        print(
+            f"dim {row['dim']:4d} | {row['quantization']:4s} | {row['bytes_per_vector']:5d} bytes/vector"
+            f" | recall@{topk} {row['recall']:.3f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintenance commands")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    parser_rebuild = subparsers.add_parser("rebuild-embd-store", help="Rebuild vector collections from the DB")
+    parser_rebuild.add_argument("--batch-size", type=int, default=256)
+
+    parser_compact = subparsers.add_parser("compact-embd-cache", help="Reclaim space of the embedding cache")
+    parser_compact.add_argument(
+        "--drop-other-models", action="store_true", help="Also drop entries of models other than the current one"
+    )
+
+    parser_compress = subparsers.add_parser("compress-embd-store", help="Store vectors projected to fewer dims")
+    parser_compress.add_argument("--dim", type=int, required=True, help="Target dimension; 0 removes compression")
+    parser_compress.add_argument("--method", choices=["pca", "truncate"], default="pca")
+    parser_compress.add_argument("--sample-size", type=int, default=50000)
+    parser_compress.add_argument("--batch-size", type=int, default=256)
+
+    parser_evaluate = subparsers.add_parser("evaluate-compression", help="Report memory against recall")
+    parser_evaluate.add_argument("--dims", type=int, nargs="+", default=[64, 128, 256, 512])
+    parser_evaluate.add_argument(
+        "--quantizations", nargs="+", choices=["none", "SQ8", "PQ"], default=["none", "SQ8", "PQ"]
+    )
+    parser_evaluate.add_argument("--method", choices=["pca", "truncate"], default="pca")
+    parser_evaluate.add_argument("--sample-size", type=int, default=20000)
+    parser_evaluate.add_argument("--num-queries", type=int, default=200)
+    parser_evaluate.add_argument("--topk", type=int, default=10)
+
+    args = parser.parse_args()
+    match args.command:
+        case "rebuild-embd-store":
+            rebuild_embd_store(args.batch_size)
+        case "compact-embd-cache":
+            compact_embd_cache(args.drop_other_models)
+        case "compress-embd-store":
+            compress_embd_store(args.dim, args.method, args.sample_size, args.batch_size)
+        case "evaluate-compression":
+            evaluate_compression(
+                args.dims, args.quantizations, args.method, args.sample_size, args.num_queries, args.topk
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,141 @@
+import threading
+import time
+from typing import TYPE_CHECKING
+
+from loguru import logger
+
+from src import config
+
+from .bulk_ingest import BulkIngestor, BulkProgress, BulkStats
+from .cache import ResultCache, SharedEpoch
 from .db import db
 from .db.model import RESOURCE_TYPE
-from .emb_store import EmbdStoreUtils
-from .embedding_extraction import EmbdExtractionUtils
-from .keyword_extraction import KeywordExtractionUtils
+from .dedup import PerceptualHashIndex, content_hash
+from .emb_store import EmbdFilter, EmbdStoreUtils
+from .inference import InferenceExecutor, QueueFullError
+from .journal import JobInfo, JobJournal
+from .keyword_index import KeywordIndex
 from .obj_store import ObjStoreUtils
+from .pipeline import IngestPipeline
+from .retrieval import HybridRetriever
+from .startup import StartupState
+
+if TYPE_CHECKING:
+    from .embedding_extraction import EmbdExtractionUtils
+    from .keyword_extraction import KeywordExtractionUtils
+
+phash_index = PerceptualHashIndex(max_dist=config.PHASH_MAX_DISTANCE)
+keyword_index = KeywordIndex()
+
+result_cache = ResultCache(config.RETRIEVAL_CACHE_SIZE, ttl=config.RETRIEVAL_CACHE_TTL_S)
+shared_epoch = SharedEpoch(db.fetch_write_marks, interval=config.RETRIEVAL_CACHE_EPOCH_POLL_S)
+
+clip_executor = InferenceExecutor("clip", config.EMBD_MAX_CONCURRENCY, config.EMBD_MAX_QUEUE)
+keyword_executor = InferenceExecutor("keyword", config.KEYWORD_MAX_CONCURRENCY, config.KEYWORD_MAX_QUEUE)
+
+
+# =================================================
+# Services built on first access
+# =================================================
+# Models and vector store connections are built when first used (the server preloads them in parallel from its
+# lifespan), so importing this package stays cheap for every worker and CLI. The annotations below only declare
+# the types: the names are resolved by the module `__getattr__` and then cached as plain module attributes.
+embd_store: EmbdStoreUtils
+obj_store: ObjStoreUtils
+embd_extractor: "EmbdExtractionUtils"
+keyword_extractor: "KeywordExtractionUtils"
+retriever: HybridRetriever
+ingest_pipeline: IngestPipeline
+bulk_ingestor: BulkIngestor
+
+LAZY_SERVICES = (
+    "embd_store",
+    "obj_store",
+    "embd_extractor",
+    "keyword_extractor",
+    "retriever",
+    "ingest_pipeline",
+    "bulk_ingestor",
+)
+# One lock per service, so that independent services can load concurrently
+_locks = {name: threading.Lock() for name in LAZY_SERVICES}
+
+
+def _build(name: str):
+    match name:
+        case "embd_store":
+            return EmbdStoreUtils()
+        case "obj_store":
+            return ObjStoreUtils()
+        case "embd_extractor":
+            from .embedding_extraction import EmbdExtractionUtils
+
+            return EmbdExtractionUtils()
+        case "keyword_extractor":
+            from .keyword_extraction import KeywordExtractionUtils
+
+            return KeywordExtractionUtils()
+        case "retriever":
+            return HybridRetriever(
+                embd_store=load("embd_store"),
+                keyword_index=keyword_index,
+                shared_epoch=shared_epoch,
+                fusion=config.RETRIEVAL_FUSION,
+                rrf_k=config.RETRIEVAL_RRF_K,
+                vector_weight=config.RETRIEVAL_VECTOR_WEIGHT,
+                num_keywords=config.RETRIEVAL_NUM_KEYWORDS,
+                keyword_min_sim=config.RETRIEVAL_KEYWORD_MIN_SIM,
+                fetch_factor=config.RETRIEVAL_FETCH_FACTOR,
+            )
+        case "ingest_pipeline":
+            return IngestPipeline(
+                journal=JobJournal(config.INGEST_JOURNAL_PATH, config.INGEST_JOB_LEASE_S),
+                embd_store=load("embd_store"),
+                obj_store=load("obj_store"),
+                embd_extractor=load("embd_extractor"),
+                keyword_extractor=load("keyword_extractor"),
+                clip_executor=clip_executor,
+                keyword_executor=keyword_executor,
+                phash_index=phash_index,
+                keyword_index=keyword_index,
+            )
+        case "bulk_ingestor":
+            return BulkIngestor(
+                progress=BulkProgress(config.BULK_PROGRESS_PATH),
+                embd_store=load("embd_store"),
+                obj_store=load("obj_store"),
+                embd_extractor=load("embd_extractor"),
+                keyword_extractor=load("keyword_extractor"),
+                phash_index=phash_index,
+                keyword_index=keyword_index,
+                batch_size=config.BULK_BATCH_SIZE,
+                keyword_batch_size=config.KEYWORD_BATCH_SIZE,
+            )
+
+
+def load(name: str):
+    """Return the service `name`, building it first if needed; concurrent callers wait for the same instance."""
+
+    with _locks[name]:
+        if name not in globals():
+            start = time.perf_counter()
+            globals()[name] = _build(name)
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            startup_state.record(name, elapsed_ms)
+            logger.info(f"Loaded service '{name}' in {elapsed_ms:.0f} ms")
+
+    return globals()[name]
+
+
+def is_loaded(name: str) -> bool:
+    return name in globals()
+
+
+def __getattr__(name: str):
+    if name not in _locks:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    return load(name)
+
 
-embd_store = EmbdStoreUtils()
-obj_store = ObjStoreUtils()
-embd_extractor = EmbdExtractionUtils()
-keyword_extractor = KeywordExtractionUtils()
+startup_state = StartupState()
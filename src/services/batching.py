@@ -0,0 +1,94 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Sequence
+
+from loguru import logger
+
+
+class MicroBatcher:
+    """Collect concurrent single-item requests into one batched call.
+
+    Each caller submits one item and receives a Future. A worker thread takes the first pending item, waits at
+    most `max_wait_ms` for more to arrive (up to `max_batch_size`), runs `fn` once over the whole batch and resolves
+    every Future with its own row of the output.
+    """
+
+    def __init__(self, fn: Callable[[list], Sequence], max_batch_size: int, max_wait_ms: float, name: str):
+        assert max_batch_size >= 1
+
+        self.fn = fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.name = name
+
+        self._queue: queue.Queue[tuple[Any, Future]] = queue.Queue()
+        self._lock = threading.Lock()
+        self._num_batches = 0
+        self._num_items = 0
+        self._batch_sizes: dict[int, int] = {}
+
+        self._thread = threading.Thread(target=self._run, name=f"batcher-{name}", daemon=True)
+        self._thread.start()
+
+    def submit(self, item: Any) -> Future:
+        future: Future = Future()
+        self._queue.put((item, future))
+
+        return future
+
+    def submit_many(self, items: list) -> list[Future]:
+        return [self.submit(item) for item in items]
+
+    def _collect(self) -> list[tuple[Any, Future]]:
+        batch = [self._queue.get()]
+
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining <= 0:
+                    batch.append(self._queue.get_nowait())
+                else:
+                    batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            items = [item for item, _ in batch]
+            futures = [future for _, future in batch]
+
+            try:
+                outputs = self.fn(items)
+                if len(outputs) != len(items):
+                    raise ValueError(f"Batch function returned {len(outputs)} rows for {len(items)} items")
+            except Exception as e:
+                logger.error(f"Batcher '{self.name}' failed on batch of {len(items)}: {e}")
+                for future in futures:
+                    future.set_exception(e)
+                continue
+
+            for future, output in zip(futures, outputs):
+                future.set_result(output)
+
+            with self._lock:
+                self._num_batches += 1
+                self._num_items += len(items)
+                self._batch_sizes[len(items)] = self._batch_sizes.get(len(items), 0) + 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "queue_depth": self._queue.qsize(),
+                "num_batches": self._num_batches,
+                "num_items": self._num_items,
+                "avg_batch_size": self._num_items / self._num_batches if self._num_batches > 0 else 0.0,
+                "batch_sizes": dict(sorted(self._batch_sizes.items())),
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000,
+            }
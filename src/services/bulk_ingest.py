@@ -0,0 +1,343 @@
+import mimetypes
+import sqlite3
+import tarfile
+import threading
+import time
+from dataclasses import dataclass, field
+from io import BytesIO
+from pathlib import Path
+from typing import TYPE_CHECKING, Iterator
+
+from loguru import logger
+from numpy import ndarray
+
+from .db import db
+from .db.model import RESOURCE_TYPE
+from .dedup import PerceptualHashIndex, content_hash, dhash, to_signed
+from .emb_store import EmbdStoreUtils
+from .image import DecodedImage
+from .keyword_index import KeywordIndex
+from .obj_store import ObjStoreUtils
+
+if TYPE_CHECKING:
+    from .embedding_extraction import EmbdExtractionUtils
+    from .keyword_extraction import KeywordExtractionUtils
+
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png", ".webp", ".bmp", ".gif", ".tif", ".tiff"}
+
+
+@dataclass
+class BulkItem:
+    name: str
+    raw: bytes
+    res_type: str
+    image: DecodedImage
+    content_hash: str
+    phash: int
+
+    keywords: list[dict] = field(default_factory=list)
+    embd_img: ndarray | None = None
+    # Set when the resource row exists without its vector (a crash lost the vector): the item completes it
+    resource_id: int | None = None
+
+
+@dataclass
+class BulkStats:
+    source: str
+    status: str = "running"
+    num_done: int = 0
+    num_skipped: int = 0
+    num_duplicate: int = 0
+    num_failed: int = 0
+    elapsed: float = 0.0
+    throughput: float = 0.0
+    error: str | None = None
+
+
+class BulkProgress:
+    """Record which items of a source were already ingested so that a crashed backfill resumes where it stopped."""
+
+    def __init__(self, path: str):
+        Path(path).parent.mkdir(exist_ok=True, parents=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS progress (
+                source          TEXT NOT NULL,
+                name            TEXT NOT NULL,
+                resource_id     INTEGER,
+                PRIMARY KEY (source, name)
+            )
+            """
+        )
+
+    def fetch_done(self, source: str) -> set[str]:
+        with self._lock:
+            rows = self._conn.execute("SELECT name FROM progress WHERE source = ?", (source,)).fetchall()
+
+        return {row[0] for row in rows}
+
+    def mark_done(self, source: str, entries: list[tuple[str, int | None]]):
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO progress (source, name, resource_id) VALUES (?, ?, ?)",
+                [(source, name, resource_id) for name, resource_id in entries],
+            )
+
+
+def iter_source(source: Path) -> Iterator[tuple[str, bytes]]:
+    """Stream (name, raw bytes) of image files from a directory or a (compressed) tarball."""
+
+    if source.is_dir():
+        for path in sorted(source.rglob("*")):
+            if path.is_file() and path.suffix.lower() in IMAGE_SUFFIXES:
+                yield str(path.relative_to(source)), path.read_bytes()
+        return
+
+    # Stream mode reads members sequentially without seeking, so huge archives are never fully loaded
+    with tarfile.open(source, mode="r|*") as tar:
+        for member in tar:
+            if not member.isfile() or Path(member.name).suffix.lower() not in IMAGE_SUFFIXES:
+                continue
+            # Names become object store paths: links were skipped above, absolute or escaping names are skipped here
+            if Path(member.name).is_absolute() or ".." in Path(member.name).parts:
+                logger.warning(f"Skip archive member with unsafe name '{member.name}'")
+                continue
+            file = tar.extractfile(member)
+            if file is None:
+                continue
+            yield member.name, file.read()
+
+
+class BulkIngestor:
+    """Backfill many images at once, batching model calls and database/vector-store writes."""
+
+    def __init__(
+        self,
+        progress: BulkProgress,
+        embd_store: EmbdStoreUtils,
+        obj_store: ObjStoreUtils,
+        embd_extractor: "EmbdExtractionUtils",
+        keyword_extractor: "KeywordExtractionUtils",
+        phash_index: PerceptualHashIndex,
+        keyword_index: KeywordIndex,
+        batch_size: int = 32,
+        keyword_batch_size: int = 4,
+        thres_match: float = 0.95,
+    ):
+        self.progress = progress
+        self.embd_store = embd_store
+        self.obj_store = obj_store
+        self.embd_extractor = embd_extractor
+        self.keyword_extractor = keyword_extractor
+        self.phash_index = phash_index
+        self.keyword_index = keyword_index
+        self.batch_size = batch_size
+        self.keyword_batch_size = keyword_batch_size
+        self.thres_match = thres_match
+
+    def run(self, source: Path, stats: BulkStats | None = None) -> BulkStats:
+        source_key = str(source.resolve())
+        stats = stats or BulkStats(source=source_key)
+        done = self.progress.fetch_done(source_key)
+        if len(done) > 0:
+            logger.info(f"Resume bulk ingest of '{source}': {len(done)} items already done")
+
+        start = time.perf_counter()
+        batch: list[BulkItem] = []
+        try:
+            for name, raw in iter_source(source):
+                if name in done:
+                    stats.num_skipped += 1
+                    continue
+
+                content_type, _ = mimetypes.guess_type(name)
+                if content_type is None or not content_type.startswith("image"):
+                    stats.num_skipped += 1
+                    continue
+
+                try:
+                    image = DecodedImage.from_bytes(raw)
+                except Exception as e:
+                    logger.error(f"Skip corrupted image '{name}': {e}")
+                    stats.num_failed += 1
+                    continue
+
+                item = BulkItem(
+                    name=name,
+                    raw=raw,
+                    res_type=RESOURCE_TYPE.IMAGE.val,
+                    image=image,
+                    content_hash=content_hash(raw),
+                    phash=dhash(image.image),
+                )
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    self._process_batch(source_key, batch, stats)
+                    self._report(stats, start)
+                    batch = []
+
+            if len(batch) > 0:
+                self._process_batch(source_key, batch, stats)
+
+            stats.status = "done"
+        except Exception as e:
+            logger.exception(f"Bulk ingest of '{source}' stopped")
+            stats.status = "failed"
+            stats.error = str(e)
+
+        self._report(stats, start)
+
+        return stats
+
+    def _report(self, stats: BulkStats, start: float):
+        stats.elapsed = time.perf_counter() - start
+        stats.throughput = (stats.num_done + stats.num_duplicate) / stats.elapsed if stats.elapsed > 0 else 0.0
+
+        logger.info(
+            f"Bulk ingest: {stats.num_done} done, {stats.num_duplicate} duplicate, {stats.num_skipped} skipped, "
+            f"{stats.num_failed} failed | {stats.throughput:.2f} images/s"
+        )
+
+    def _process_batch(self, source_key: str, batch: list[BulkItem], stats: BulkStats):
+        finished: list[tuple[str, int | None]] = []
+
+        # =================================================
+        # Drop exact and near duplicates before running any model
+        # =================================================
+        existing = db.fetch_resource_by_hash([item.content_hash for item in batch])
+        # Rows of a batch that crashed before its vectors were written are completed, not skipped
+        missing = self.embd_store.missing_res_embd(list(existing.values()))
+        seen: set[str] = set()
+        pending: list[BulkItem] = []
+        for item in batch:
+            resource_id = existing.get(item.content_hash) or self.phash_index.find(item.phash)
+            if resource_id in missing and item.content_hash not in seen:
+                item.resource_id = resource_id
+                seen.add(item.content_hash)
+                pending.append(item)
+            elif resource_id is not None or item.content_hash in seen:
+                finished.append((item.name, resource_id))
+                stats.num_duplicate += 1
+            else:
+                seen.add(item.content_hash)
+                pending.append(item)
+
+        batch = pending
+        if len(batch) == 0:
+            self.progress.mark_done(source_key, finished)
+            return
+
+        # =================================================
+        # Extract keywords and embeddings
+        # =================================================
+        extracted: list[BulkItem] = []
+        for i in range(0, len(batch), self.keyword_batch_size):
+            chunk = batch[i : i + self.keyword_batch_size]
+            try:
+                keywords = self.keyword_extractor.extract_keywords_batch([item.image for item in chunk])
+            except Exception as e:
+                # Failed items are neither stored nor recorded as done, so that the next run retries them
+                logger.error(f"Failed to extract keywords of {[item.name for item in chunk]}: {e}")
+                stats.num_failed += len(chunk)
+                continue
+
+            for item, words in zip(chunk, keywords):
+                item.keywords = words
+            extracted.extend(chunk)
+
+        batch = extracted
+        if len(batch) == 0:
+            self.progress.mark_done(source_key, finished)
+            return
+
+        embds_img = self.embd_extractor.get_embd_images([item.image for item in batch])
+        for item, embd in zip(batch, embds_img):
+            item.embd_img = embd
+
+        # =================================================
+        # Check matching
+        # =================================================
+        kept: list[BulkItem] = []
+        for item, similar in zip(batch, self.embd_store.search_similar_res_many(embds_img)):
+            if item.resource_id is None and similar != [] and similar[0].similarity >= self.thres_match:
+                finished.append((item.name, similar[0].resource_id))
+                stats.num_duplicate += 1
+            else:
+                kept.append(item)
+
+        # Keywords shared across the batch are embedded, matched and inserted only once
+        words: dict[str, str] = {}
+        for item in kept:
+            for keyword in item.keywords:
+                words.setdefault(keyword["word"], keyword["category"])
+
+        # Fail before writing anything while the vector store cannot take more vectors
+        self.embd_store.check_room()
+
+        if len(words) > 0:
+            word_list = list(words)
+            embds_word = self.embd_extractor.get_embd_text(word_list)
+            similars = self.embd_store.search_similar_keyword(embds_word)
+
+            new_words = [
+                (word, embd)
+                for word, embd, similar in zip(word_list, embds_word, similars)
+                if similar == [] or similar[0].similarity < self.thres_match
+            ]
+
+            # =================================================
+            # Store extracted things
+            # =================================================
+            if len(new_words) > 0:
+                inserted = db.insert_keywords([(words[word], word) for word, _ in new_words])
+                # Words another process stored meanwhile already have their vector
+                fresh = [(embd, keyword_id) for (_, embd), (keyword_id, is_new) in zip(new_words, inserted) if is_new]
+                if len(fresh) > 0:
+                    self.embd_store.insert_keyword_embd([embd for embd, _ in fresh], [i for _, i in fresh])
+
+        for item in kept:
+            self.obj_store.save(item.name, BytesIO(item.raw))
+
+        if len(kept) > 0:
+            new_items = [item for item in kept if item.resource_id is None]
+            inserted = iter(
+                db.insert_resources(
+                    [
+                        (
+                            item.res_type,
+                            item.name,
+                            [keyword["word"] for keyword in item.keywords],
+                            item.content_hash,
+                            to_signed(item.phash),
+                        )
+                        for item in new_items
+                    ]
+                )
+                if len(new_items) > 0
+                else []
+            )
+            resources = [
+                next(inserted) if item.resource_id is None else db.fetch_resource(item.resource_id) for item in kept
+            ]
+            self.embd_store.insert_res_embd(
+                [item.embd_img for item in kept],
+                [resource.id for resource in resources],
+                [resource.resource_type for resource in resources],
+                [resource.date_added for resource in resources],
+            )
+            for item, resource in zip(kept, resources):
+                if item.resource_id is None:
+                    self.phash_index.add(item.phash, resource.id)
+                    self.keyword_index.add(resource.id, resource.keywords)
+
+            finished.extend((item.name, resource.id) for item, resource in zip(kept, resources))
+            stats.num_done += len(kept)
+
+        # Items are only recorded once their vectors are written, so that a crash makes the resume redo them
+        if not self.embd_store.sync():
+            raise RuntimeError("Failed to write vectors into the embedding store")
+        self.progress.mark_done(source_key, finished)
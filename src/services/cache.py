@@ -0,0 +1,154 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable
+
+from loguru import logger
+
+
+class LRUCache:
+    """Thread-safe LRU cache with optional time-to-live and hit/miss counters."""
+
+    def __init__(self, maxsize: int, ttl: float | None = None):
+        assert maxsize > 0
+
+        self.maxsize = maxsize
+        self.ttl = ttl
+
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or (self.ttl is not None and time.monotonic() - entry[0] > self.ttl):
+                if entry is not None:
+                    del self._data[key]
+                self._misses += 1
+                return default
+
+            self._data.move_to_end(key)
+            self._hits += 1
+            return entry[1]
+
+    def put(self, key: Hashable, value: Any):
+        with self._lock:
+            self._data[key] = (time.monotonic(), value)
+            self._data.move_to_end(key)
+
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self._evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self._hits + self._misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "hit_rate": self._hits / total if total > 0 else 0.0,
+            }
+
+
+class ResultCache:
+    """LRU cache of query results tagged with the write epoch they were computed at.
+
+    An entry computed at an older epoch is a miss, so results never outlive a write to the stores they came from.
+    Read the epoch before computing a result: a write racing with the computation then leaves the entry stale.
+    """
+
+    def __init__(self, maxsize: int, ttl: float | None = None):
+        self._cache = LRUCache(maxsize, ttl)
+        self._lock = threading.Lock()
+        self._stale = 0
+
+    def get(self, key: Hashable, epoch: Hashable) -> Any:
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+        if entry[0] != epoch:
+            with self._lock:
+                self._stale += 1
+            return None
+
+        return entry[1]
+
+    def put(self, key: Hashable, epoch: Hashable, value: Any):
+        self._cache.put(key, (epoch, value))
+
+    def clear(self):
+        self._cache.clear()
+
+    def stats(self) -> dict:
+        stats = self._cache.stats()
+        with self._lock:
+            stale = self._stale
+        total = stats["hits"] + stats["misses"]
+        stats["hits"] -= stale
+        stats["misses"] += stale
+        stats["stale"] = stale
+        stats["hit_rate"] = stats["hits"] / total if total > 0 else 0.0
+
+        return stats
+
+
+class SharedEpoch:
+    """Write epoch shared by every process writing to the stores, polled in the background.
+
+    The epochs of the stores only count writes of this process. `fetch` reads a value that any writer changes (e.g.
+    the largest resource and keyword ids in the DB), so that results cached here go stale when another worker or the
+    bulk CLI inserts. It lags writes by up to `interval` seconds, and misses changes that insert no row (e.g. a
+    maintenance rebuild) or that land after the row (vectors another process has yet to flush): the TTL of the
+    result cache bounds those.
+    """
+
+    def __init__(self, fetch: Callable[[], Hashable], interval: float = 1.0):
+        self.fetch = fetch
+        self.interval = interval
+        self.value: Hashable = None
+
+        self._callbacks: list[Callable[[], None]] = []
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def on_change(self, callback: Callable[[], None]):
+        """Run `callback` in the polling thread whenever the epoch changes."""
+
+        self._callbacks.append(callback)
+
+    def poll(self):
+        try:
+            value = self.fetch()
+        except Exception as e:
+            logger.warning(f"Failed to poll the shared write epoch: {e}")
+            return
+
+        changed, self.value = value != self.value, value
+        for callback in self._callbacks if changed else []:
+            try:
+                callback()
+            except Exception:
+                logger.exception("Shared write epoch callback failed")
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.poll()
+
+    def start(self):
+        self.poll()
+        self._thread = threading.Thread(target=self._run, name="shared-epoch", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
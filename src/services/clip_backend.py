@@ -0,0 +1,274 @@
+import fcntl
+import os
+from pathlib import Path
+
+import numpy as np
+import torch
+from loguru import logger
+from numpy import ndarray
+from transformers import CLIPModel
+
+from .shared_weights import load_shared
+
+try:
+    import onnxruntime as ort
+except ImportError:
+    ort = None
+
+
+def _features(out) -> torch.Tensor:
+    # Recent transformers return a model output whose pooler output holds the projected features
+    return out if isinstance(out, torch.Tensor) else out.pooler_output
+
+
+class ClipBackend:
+    """Runtime of the CLIP text and image towers; inputs and outputs are NumPy arrays.
+
+    `cache_tag` identifies the numerics of the backend in embedding cache keys, so switching backends never
+    returns vectors computed by another one.
+    """
+
+    name: str
+    cache_tag: str
+    np_dtype: type
+
+    def encode_text(self, input_ids: ndarray, attention_mask: ndarray) -> ndarray:
+        raise NotImplementedError()
+
+    def encode_image(self, pixel_values: ndarray) -> ndarray:
+        raise NotImplementedError()
+
+
+class TorchScriptBackend(ClipBackend):
+    """Traced model exported by `notebooks/export_model.ipynb`, cast to `dtype` on `device`.
+
+    float16 suits GPUs and Apple silicon; on CPU-only nodes float32 is usually faster as most kernels lack half
+    precision.
+    """
+
+    name = "torchscript"
+
+    def __init__(self, path: str, dtype: torch.dtype, device: str):
+        self.model = torch.jit.load(path, map_location="cpu").to(dtype=dtype, device=device)
+        self.model.eval()
+        self.dtype = dtype
+        self.device = device
+        self.cache_tag = str(dtype)
+        self.np_dtype = np.float16 if dtype == torch.float16 else np.float32
+
+        if device == "cpu" and dtype == torch.float16:
+            logger.warning("Running float16 CLIP on CPU is slow; consider DTYPE=float32 or EMBD_BACKEND=onnx")
+
+    def encode_text(self, input_ids: ndarray, attention_mask: ndarray) -> ndarray:
+        with torch.inference_mode():
+            out = self.model.get_text_features(
+                torch.from_numpy(input_ids).to(self.device), torch.from_numpy(attention_mask).to(self.device)
+            )
+
+        return out.to("cpu").numpy()
+
+    def encode_image(self, pixel_values: ndarray) -> ndarray:
+        with torch.inference_mode():
+            out = self.model.get_image_features(torch.from_numpy(pixel_values).to(self.device, self.dtype))
+
+        return out.to("cpu").numpy()
+
+
+class TorchBackend(ClipBackend):
+    """Eager CLIP loaded from `model_name` in `dtype` on `device`.
+
+    With `shared_weights_dir`, weights are memory-mapped from a snapshot that every worker process of the host
+    shares (see `load_shared`), instead of being copied into each of them.
+    """
+
+    name = "torch"
+
+    def __init__(self, model_name: str, dtype: torch.dtype, device: str, shared_weights_dir: str | None = None):
+        if shared_weights_dir is not None:
+            self.model = load_shared(CLIPModel, model_name, dtype, shared_weights_dir, device)
+        else:
+            self.model = CLIPModel.from_pretrained(model_name, dtype=dtype).to(device).eval()
+        self.dtype = dtype
+        self.device = device
+        self.cache_tag = f"eager-{dtype}"
+        self.np_dtype = np.float16 if dtype == torch.float16 else np.float32
+
+    def encode_text(self, input_ids: ndarray, attention_mask: ndarray) -> ndarray:
+        with torch.inference_mode():
+            out = self.model.get_text_features(
+                input_ids=torch.from_numpy(input_ids).to(self.device),
+                attention_mask=torch.from_numpy(attention_mask).to(self.device),
+            )
+
+        return _features(out).to("cpu").numpy()
+
+    def encode_image(self, pixel_values: ndarray) -> ndarray:
+        with torch.inference_mode():
+            out = self.model.get_image_features(pixel_values=torch.from_numpy(pixel_values).to(self.device, self.dtype))
+
+        return _features(out).to("cpu").numpy()
+
+
+class TorchInt8Backend(ClipBackend):
+    """Eager CLIP with dynamically int8-quantized linear layers, for CPU.
+
+    Weights of every `nn.Linear` are stored in int8 and activations are quantized on the fly, which roughly
+    quarters the memory of those layers and uses integer GEMM kernels. Tracing drops the module structure that
+    quantization needs, so the model is loaded from `model_name` rather than from the TorchScript file.
+    """
+
+    name = "torch-int8"
+    cache_tag = "int8-dynamic"
+    np_dtype = np.float32
+
+    def __init__(self, model_name: str):
+        model = CLIPModel.from_pretrained(model_name, dtype=torch.float32).eval()
+        self.model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+    def encode_text(self, input_ids: ndarray, attention_mask: ndarray) -> ndarray:
+        with torch.inference_mode():
+            out = self.model.get_text_features(
+                input_ids=torch.from_numpy(input_ids), attention_mask=torch.from_numpy(attention_mask)
+            )
+
+        return _features(out).numpy()
+
+    def encode_image(self, pixel_values: ndarray) -> ndarray:
+        with torch.inference_mode():
+            out = self.model.get_image_features(pixel_values=torch.from_numpy(pixel_values).float())
+
+        return _features(out).numpy()
+
+
+class OnnxBackend(ClipBackend):
+    """ONNX Runtime sessions of the two towers exported by `export_onnx`, on the CPU execution provider.
+
+    Each session runs with `num_threads` intra-op threads (0 lets the runtime use every core) and a single
+    inter-op thread: the towers are sequential graphs and concurrency already comes from micro-batching.
+    """
+
+    name = "onnx"
+    cache_tag = "onnx-fp32"
+    np_dtype = np.float32
+
+    def __init__(self, model_dir: str, num_threads: int = 0):
+        if ort is None:
+            raise ImportError("EMBD_BACKEND=onnx requires the 'onnxruntime' package")
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.intra_op_num_threads = num_threads
+        options.inter_op_num_threads = 1
+
+        path_dir = Path(model_dir)
+        self.text_session = ort.InferenceSession(
+            str(path_dir / "text.onnx"), options, providers=["CPUExecutionProvider"]
+        )
+        self.image_session = ort.InferenceSession(
+            str(path_dir / "image.onnx"), options, providers=["CPUExecutionProvider"]
+        )
+
+    def encode_text(self, input_ids: ndarray, attention_mask: ndarray) -> ndarray:
+        return self.text_session.run(
+            None, {"input_ids": input_ids.astype(np.int64), "attention_mask": attention_mask.astype(np.int64)}
+        )[0]
+
+    def encode_image(self, pixel_values: ndarray) -> ndarray:
+        return self.image_session.run(None, {"pixel_values": pixel_values.astype(np.float32)})[0]
+
+
+def create_backend(name: str, model_name: str, model_path: str | None, dtype: torch.dtype, device: str, **kwargs):
+    match name:
+        case "torchscript":
+            assert model_path is not None, "EMBD_MODEL_PATH is required by the torchscript backend"
+            return TorchScriptBackend(model_path, dtype, device)
+        case "torch":
+            return TorchBackend(model_name, dtype, device, kwargs.get("shared_weights_dir"))
+        case "torch-int8":
+            return TorchInt8Backend(model_name)
+        case "onnx":
+            _ensure_onnx(model_name, kwargs["onnx_dir"])
+            return OnnxBackend(kwargs["onnx_dir"], kwargs.get("num_threads", 0))
+        case _:
+            raise NotImplementedError(f"Unknown CLIP backend: {name}")
+
+
+# =================================================
+# ONNX export
+# =================================================
+
+
+def _ensure_onnx(model_name: str, out_dir: str):
+    # Concurrent workers wait for one exporter instead of loading a half-written file
+    path_dir = Path(out_dir)
+    path_dir.mkdir(exist_ok=True, parents=True)
+    with open(path_dir / "export.lock", "w") as file_lock:
+        fcntl.flock(file_lock, fcntl.LOCK_EX)
+        if not (path_dir / "image.onnx").exists():
+            export_onnx(model_name, out_dir)
+
+
+class _TextTower(torch.nn.Module):
+    def __init__(self, model: CLIPModel):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids: torch.Tensor, attention_mask: torch.Tensor) -> torch.Tensor:
+        return _features(self.model.get_text_features(input_ids=input_ids, attention_mask=attention_mask))
+
+
+class _ImageTower(torch.nn.Module):
+    def __init__(self, model: CLIPModel):
+        super().__init__()
+        self.model = model
+
+    def forward(self, pixel_values: torch.Tensor) -> torch.Tensor:
+        return _features(self.model.get_image_features(pixel_values=pixel_values))
+
+
+def export_onnx(model: CLIPModel | str, out_dir: str, opset: int = 17):
+    """Export the text and image towers of `model` (or of the pretrained model of that name) to `out_dir`.
+
+    Batch size and sequence length are dynamic, so the sessions accept micro-batches of any size. Each file is
+    written under a temporary name and renamed, the image tower last, so an existing `image.onnx` means a complete
+    export.
+    """
+
+    if isinstance(model, str):
+        model = CLIPModel.from_pretrained(model, dtype=torch.float32)
+    model = model.eval()
+
+    path_dir = Path(out_dir)
+    path_dir.mkdir(exist_ok=True, parents=True)
+
+    seq_len = model.config.text_config.max_position_embeddings
+    size = model.config.vision_config.image_size
+    path_text, path_image = path_dir / "text.onnx", path_dir / "image.onnx"
+    path_text_tmp = path_text.with_name(f"{path_text.name}.{os.getpid()}.tmp")
+    path_image_tmp = path_image.with_name(f"{path_image.name}.{os.getpid()}.tmp")
+    with torch.inference_mode():
+        torch.onnx.export(
+            _TextTower(model),
+            (torch.ones(2, seq_len, dtype=torch.int64), torch.ones(2, seq_len, dtype=torch.int64)),
+            str(path_text_tmp),
+            input_names=["input_ids", "attention_mask"],
+            output_names=["embd"],
+            dynamic_axes={"input_ids": {0: "batch", 1: "seq"}, "attention_mask": {0: "batch", 1: "seq"}},
+            opset_version=opset,
+            dynamo=False,
+        )
+        torch.onnx.export(
+            _ImageTower(model),
+            (torch.zeros(2, 3, size, size),),
+            str(path_image_tmp),
+            input_names=["pixel_values"],
+            output_names=["embd"],
+            dynamic_axes={"pixel_values": {0: "batch"}},
+            opset_version=opset,
+            dynamo=False,
+        )
+    os.replace(path_text_tmp, path_text)
+    os.replace(path_image_tmp, path_image)
+
+    logger.info(f"Exported CLIP text and image towers to '{path_dir}'")
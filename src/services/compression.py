@@ -0,0 +1,165 @@
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+from loguru import logger
+from numpy import ndarray
+
+
+@dataclass
+class Projection:
+    """Linear reduction of embeddings applied before they are stored or searched.
+
+    "pca" projects centered vectors on the top principal components fitted on a sample of stored vectors;
+    "truncate" keeps the leading dimensions (only meaningful for Matryoshka-trained encoders). Outputs are
+    re-normalized so that cosine and inner-product searches keep their meaning. `version` names the projection and
+    is recorded with the collection built from it, so a mismatching projection is refused instead of mixing spaces.
+    """
+
+    kind: str
+    version: str
+    mean: ndarray
+    components: ndarray
+
+    @property
+    def dim_in(self) -> int:
+        return self.components.shape[0]
+
+    @property
+    def dim_out(self) -> int:
+        return self.components.shape[1]
+
+    @classmethod
+    def fit_pca(cls, sample: ndarray, dim_out: int) -> "Projection":
+        sample = _normalize(sample.astype(np.float32))
+        mean = sample.mean(0)
+        # Right singular vectors of the centered sample are the principal axes, by decreasing variance
+        _, _, vt = np.linalg.svd(sample - mean, full_matrices=False)
+
+        return cls("pca", _make_version("pca", dim_out), mean, np.ascontiguousarray(vt[:dim_out].T))
+
+    @classmethod
+    def truncate(cls, dim_in: int, dim_out: int) -> "Projection":
+        return cls(
+            "truncate",
+            _make_version("truncate", dim_out),
+            np.zeros(dim_in, dtype=np.float32),
+            np.eye(dim_in, dim_out, dtype=np.float32),
+        )
+
+    def apply(self, embds: ndarray) -> ndarray:
+        embds = _normalize(np.atleast_2d(embds).astype(np.float32))
+
+        return _normalize((embds - self.mean) @ self.components)
+
+    def save(self, path_dir: Path):
+        path_dir.mkdir(exist_ok=True, parents=True)
+        np.savez(path_dir / f"{self.version}.npz", kind=self.kind, mean=self.mean, components=self.components)
+        (path_dir / "current").write_text(self.version)
+
+        logger.info(f"Saved projection '{self.version}' ({self.dim_in} -> {self.dim_out}) to '{path_dir}'")
+
+    @classmethod
+    def load(cls, path_dir: Path) -> "Projection | None":
+        """Return the current projection saved in `path_dir`, or None if the collection is stored uncompressed."""
+
+        path_current = path_dir / "current"
+        if not path_current.exists():
+            return None
+
+        version = path_current.read_text().strip()
+        data = np.load(path_dir / f"{version}.npz")
+
+        return cls(str(data["kind"]), version, data["mean"], data["components"])
+
+    @staticmethod
+    def clear(path_dir: Path):
+        """Store the collection uncompressed from now on; past projection files are kept."""
+
+        (path_dir / "current").unlink(missing_ok=True)
+
+
+def _normalize(embds: ndarray) -> ndarray:
+    return embds / np.maximum(np.linalg.norm(embds, axis=1, keepdims=True), 1e-12)
+
+
+def _make_version(kind: str, dim_out: int) -> str:
+    return f"{kind}{dim_out}-{time.strftime('%Y%m%dT%H%M%S')}"
+
+
+def code_size(dim: int, quantization: str | None) -> int:
+    """Bytes per stored vector code: float16, 8-bit scalar, or PQ with one byte per 4 dimensions."""
+
+    match quantization:
+        case None | "" | "none":
+            return 2 * dim
+        case "SQ8":
+            return dim
+        case "PQ":
+            return pq_num_subvectors(dim)
+        case _:
+            raise NotImplementedError(f"Unknown quantization: {quantization}")
+
+
+def pq_num_subvectors(dim: int) -> int:
+    # Largest divisor of `dim` not above dim / 4, as sub-vectors must split the vector evenly
+    return next(m for m in range(max(dim // 4, 1), 0, -1) if dim % m == 0)
+
+
+def evaluate(
+    base: ndarray,
+    queries: ndarray,
+    dims: list[int],
+    quantizations: list[str],
+    kind: str = "pca",
+    topk: int = 10,
+) -> list[dict]:
+    """Recall@k of every (dimension, quantization) pair relative to exact search over the uncompressed vectors.
+
+    Searches are exhaustive so that only the loss of the compression itself is measured, not that of an ANN index.
+    """
+
+    import faiss
+
+    base, queries = _normalize(base.astype(np.float32)), _normalize(queries.astype(np.float32))
+    exact = faiss.IndexFlatIP(base.shape[1])
+    exact.add(base)
+    _, truth = exact.search(queries, topk)
+
+    rows = []
+    for dim in dims:
+        if dim >= base.shape[1]:
+            projection = None
+        elif kind == "pca":
+            projection = Projection.fit_pca(base, dim)
+        else:
+            projection = Projection.truncate(base.shape[1], dim)
+        base_proj = projection.apply(base) if projection is not None else base
+        queries_proj = projection.apply(queries) if projection is not None else queries
+        dim = base_proj.shape[1]
+
+        for quantization in quantizations:
+            match quantization:
+                case "none":
+                    index = faiss.IndexFlatIP(dim)
+                case "SQ8":
+                    index = faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT)
+                case "PQ":
+                    index = faiss.IndexPQ(dim, pq_num_subvectors(dim), 8, faiss.METRIC_INNER_PRODUCT)
+                case _:
+                    raise NotImplementedError(f"Unknown quantization: {quantization}")
+            index.train(base_proj)
+            index.add(base_proj)
+            _, found = index.search(queries_proj, topk)
+
+            rows.append(
+                {
+                    "dim": dim,
+                    "quantization": quantization,
+                    "bytes_per_vector": code_size(dim, quantization),
+                    "recall": float(np.mean([len(np.intersect1d(f, t)) / topk for f, t in zip(found, truth)])),
+                }
+            )
+
+    return rows
@@ -1,100 +1,661 @@
-from sqlmodel import Session, SQLModel, col, create_engine, select
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from datetime import datetime
+from typing import AsyncIterator, Iterator
+
+from loguru import logger
+from sqlalchemy import Connection, literal_column
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.orm import selectinload
+from sqlalchemy.schema import CreateIndex
+from sqlmodel import Session, SQLModel, col, create_engine, select, text
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 from src import config
 
 from .model import Keyword, KeywordCategory, Resource, ResourceType
 
 db_url = f"postgresql+psycopg://{config.DB_USER}:{config.DB_PWD}@{config.DB_HOST}:{config.DB_PORT}/{config.DB_NAME}"
-engine = create_engine(db_url)
-session = Session(engine)
+pool_kwargs = {
+    "pool_size": config.DB_POOL_SIZE,
+    "max_overflow": config.DB_MAX_OVERFLOW,
+    "pool_timeout": config.DB_POOL_TIMEOUT_S,
+    "pool_pre_ping": True,
+}
+engine = create_engine(db_url, **pool_kwargs)
+async_engine = create_async_engine(db_url, **pool_kwargs)
+
+
+class PoolMonitor:
+    """Track how long callers wait to check a connection out of the pool."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._num_checkouts = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def record(self, wait: float):
+        with self._lock:
+            self._num_checkouts += 1
+            self._wait_total += wait
+            self._wait_max = max(self._wait_max, wait)
+
+    def stats(self) -> dict:
+        with self._lock:
+            wait = {
+                "num_checkouts": self._num_checkouts,
+                "wait_avg_ms": self._wait_total / self._num_checkouts * 1000 if self._num_checkouts > 0 else 0.0,
+                "wait_max_ms": self._wait_max * 1000,
+            }
+
+        pools = {}
+        for name, pool in [("sync", engine.pool), ("async", async_engine.pool)]:
+            pools[name] = {
+                "size": pool.size(),
+                "checked_out": pool.checkedout(),
+                "overflow": pool.overflow(),
+                "checked_in": pool.checkedin(),
+            }
+
+        return {**wait, "pools": pools}
+
+
+pool_monitor = PoolMonitor()
+
+
+def pool_stats() -> dict:
+    return pool_monitor.stats()
+
+
+@contextmanager
+def get_session(session: Session | None = None) -> Iterator[Session]:
+    """Yield `session` if given (to share one transaction between helpers), otherwise a new pooled session."""
+
+    if session is not None:
+        yield session
+        return
+
+    with Session(engine, expire_on_commit=False) as new_session:
+        # Check the connection out eagerly so that pool wait time is measured
+        start = time.perf_counter()
+        new_session.connection()
+        pool_monitor.record(time.perf_counter() - start)
+
+        yield new_session
+
+
+@asynccontextmanager
+async def get_async_session(session: AsyncSession | None = None) -> AsyncIterator[AsyncSession]:
+    if session is not None:
+        yield session
+        return
+
+    async with AsyncSession(async_engine, expire_on_commit=False) as new_session:
+        start = time.perf_counter()
+        await new_session.connection()
+        pool_monitor.record(time.perf_counter() - start)
+
+        yield new_session
+
+
+@contextmanager
+def try_advisory_lock(key: str) -> Iterator[bool]:
+    """Hold the Postgres advisory lock named `key` unless another process does; yield whether it was acquired.
+
+    The lock belongs to the connection, which stays checked out meanwhile, so a crashed holder releases it.
+    """
+
+    with engine.connect() as conn:
+        acquired = conn.execute(text("SELECT pg_try_advisory_lock(hashtext(:key))"), {"key": key}).scalar()
+        try:
+            yield bool(acquired)
+        finally:
+            if acquired:
+                conn.execute(text("SELECT pg_advisory_unlock(hashtext(:key))"), {"key": key})
+
+
+class Dictionary:
+    """Write-through cache of the small lookup tables (resource types, keyword categories, keywords), name -> id.
+
+    Loaded once at startup and updated by the insert helpers, so resolving names on the write path needs no round
+    trip. Names missing from the cache (e.g. written by another process) are fetched from the DB and cached.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._res_types: dict[str, int] = {}
+        self._keyword_cats: dict[str, int] = {}
+        self._keywords: dict[str, int] = {}
+
+    def load(self, session: Session | None = None):
+        with get_session(session) as session:
+            res_types = {row.type: row.id for row in session.exec(select(ResourceType)).all()}
+            keyword_cats = {row.category_name: row.id for row in session.exec(select(KeywordCategory)).all()}
+            keywords = {row[0]: row[1] for row in session.exec(select(Keyword.word, Keyword.id)).all()}
+
+        with self._lock:
+            self._res_types, self._keyword_cats, self._keywords = res_types, keyword_cats, keywords
+
+        logger.info(f"Loaded dictionary: {self.stats()}")
+
+    # =================================================
+    # Cache-only lookups and updates
+    # =================================================
+
+    def lookup_res_type(self, resource_type: str) -> int | None:
+        with self._lock:
+            return self._res_types.get(resource_type)
+
+    def lookup_keyword_cat(self, category: str) -> int | None:
+        with self._lock:
+            return self._keyword_cats.get(category)
+
+    def lookup_keywords(self, words: list[str]) -> dict[str, int]:
+        with self._lock:
+            return {word: self._keywords[word] for word in words if word in self._keywords}
+
+    def add_res_type(self, resource_type: str, res_type_id: int):
+        with self._lock:
+            self._res_types[resource_type] = res_type_id
+
+    def add_keyword_cat(self, category: str, cat_id: int):
+        with self._lock:
+            self._keyword_cats[category] = cat_id
+
+    def add_keywords(self, word2id: dict[str, int]):
+        with self._lock:
+            self._keywords.update(word2id)
+
+    # =================================================
+    # Lookups falling back to the DB on miss
+    # =================================================
+
+    def res_type_id(self, resource_type: str, session: Session | None = None) -> int:
+        res_type_id = self.lookup_res_type(resource_type)
+        if res_type_id is None:
+            res_type_id = fetch_resource_type(resource_type, session).id
+            self.add_res_type(resource_type, res_type_id)
+
+        return res_type_id
+
+    def keyword_cat_id(self, category: str, session: Session | None = None) -> int:
+        cat_id = self.lookup_keyword_cat(category)
+        if cat_id is None:
+            cat_id = fetch_keyword_cat(category, session).id
+            self.add_keyword_cat(category, cat_id)
+
+        return cat_id
+
+    def keyword_ids(self, words: list[str], session: Session | None = None) -> dict[str, int]:
+        """Map words to keyword ids; words not stored at all are left out."""
+
+        out = self.lookup_keywords(words)
+        missing = [word for word in words if word not in out]
+        if len(missing) > 0:
+            fetched = {keyword.word: keyword.id for keyword in fetch_keyword(missing, session)}
+            self.add_keywords(fetched)
+            out.update(fetched)
+
+        return out
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "num_res_types": len(self._res_types),
+                "num_keyword_cats": len(self._keyword_cats),
+                "num_keywords": len(self._keywords),
+            }
+
+
+dictionary = Dictionary()
 
 
 def create_db():
     SQLModel.metadata.create_all(engine)
 
+    # `create_all` does not alter existing tables; add columns introduced after the table was first created
+    with engine.begin() as conn:
+        # Workers start concurrently: one of them migrates, the others wait for it
+        conn.execute(text("SELECT pg_advisory_xact_lock(hashtext('create_db'))"))
+        conn.execute(text("ALTER TABLE resource ADD COLUMN IF NOT EXISTS content_hash VARCHAR"))
+        conn.execute(text("ALTER TABLE resource ADD COLUMN IF NOT EXISTS phash BIGINT"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_resource_content_hash ON resource (content_hash)"))
+        # Words were not unique at first: merge duplicates before the unique index of the model can be created
+        if conn.execute(text("SELECT to_regclass('ix_keyword_word')")).scalar() is None:
+            _dedupe_keywords(conn)
+        for index in Keyword.__table__.indexes:
+            conn.execute(CreateIndex(index, if_not_exists=True))
+        # Serves keyword retrieval until the in-memory keyword index is loaded
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_resource_keywords ON resource USING GIN (keywords)"))
+
+
+def _dedupe_keywords(conn: Connection):
+    """Merge keywords stored more than once (possible before words were unique) into their oldest row."""
+
+    conn.execute(
+        text(
+            """
+            CREATE TEMP TABLE keyword_dup ON COMMIT DROP AS
+            SELECT id, keep_id FROM (SELECT id, min(id) OVER (PARTITION BY word) AS keep_id FROM keyword) AS ranked
+            WHERE id != keep_id
+            """
+        )
+    )
+    num_dups = conn.execute(text("SELECT count(*) FROM keyword_dup")).scalar()
+    if num_dups == 0:
+        return
+
+    conn.execute(
+        text(
+            """
+            UPDATE resource SET keywords = ARRAY(
+                SELECT COALESCE(keyword_dup.keep_id, word_id)
+                FROM unnest(resource.keywords) WITH ORDINALITY AS kw (word_id, pos)
+                LEFT JOIN keyword_dup ON keyword_dup.id = kw.word_id
+                ORDER BY pos
+            )
+            WHERE keywords && ARRAY(SELECT id FROM keyword_dup)
+            """
+        )
+    )
+    conn.execute(text("DELETE FROM keyword WHERE id IN (SELECT id FROM keyword_dup)"))
+
+    # The keyword collection still holds vectors under the merged ids
+    logger.warning(
+        f"Merged {num_dups} duplicated keywords; run `python -m src.maintenance rebuild-embd-store` to re-index them"
+    )
+
 
 # =================================================
 # Fetch
 # =================================================
 
 
-def fetch_resource_type(resource_type: str) -> ResourceType:
+def fetch_resource_type(resource_type: str, session: Session | None = None) -> ResourceType:
     stmt = select(ResourceType).where(ResourceType.type == resource_type)
 
-    result = session.exec(stmt).first()
+    with get_session(session) as session:
+        result = session.exec(stmt).first()
 
     assert result is not None
 
     return result
 
 
-def fetch_keyword(keywords: str | list[str]) -> list[Keyword]:
+def fetch_keyword(keywords: str | list[str], session: Session | None = None) -> list[Keyword]:
     if isinstance(keywords, str):
         keywords = [keywords]
     stmt = select(Keyword).where(col(Keyword.word).in_(keywords))
 
-    result = list(session.exec(stmt).all())
+    with get_session(session) as session:
+        result = list(session.exec(stmt).all())
 
     return result
 
 
-def fetch_keyword_cat(category: str) -> KeywordCategory:
+def fetch_keyword_cat(category: str, session: Session | None = None) -> KeywordCategory:
     stmt = select(KeywordCategory).where(KeywordCategory.category_name == category)
 
-    out = session.exec(stmt).first()
+    with get_session(session) as session:
+        out = session.exec(stmt).first()
     assert out is not None
 
     return out
 
 
-def fetch_resource(resource_id: int) -> Resource | None:
-    stmt = select(Resource).where(Resource.id == resource_id)
+def fetch_resource(resource_id: int, session: Session | None = None) -> Resource | None:
+    # Resource type is loaded eagerly as the instance outlives its session
+    stmt = select(Resource).where(Resource.id == resource_id).options(selectinload(Resource.res_type))
 
-    out = session.exec(stmt).first()
+    with get_session(session) as session:
+        out = session.exec(stmt).first()
 
     return out
 
 
+def fetch_resource_by_hash(content_hash: str | list[str], session: Session | None = None) -> dict[str, int]:
+    """Map content hashes to ids of resources already stored with them."""
+
+    if isinstance(content_hash, str):
+        content_hash = [content_hash]
+    stmt = select(Resource.content_hash, Resource.id).where(col(Resource.content_hash).in_(content_hash))
+
+    with get_session(session) as session:
+        return {row[0]: row[1] for row in session.exec(stmt).all()}
+
+
+def fetch_resources_after(after_id: int, limit: int, session: Session | None = None) -> list[Resource]:
+    """Page through resources ordered by id (keyset pagination)."""
+
+    stmt = select(Resource).where(Resource.id > after_id).order_by(col(Resource.id)).limit(limit)
+
+    with get_session(session) as session:
+        return list(session.exec(stmt).all())
+
+
+def fetch_resource_keywords_after(
+    after_id: int, limit: int, session: Session | None = None
+) -> list[tuple[int, list[int]]]:
+    """Page through (resource id, keyword ids) ordered by id, to build the keyword index."""
+
+    stmt = select(Resource.id, Resource.keywords).where(Resource.id > after_id).order_by(col(Resource.id)).limit(limit)
+
+    with get_session(session) as session:
+        return [(row[0], row[1] or []) for row in session.exec(stmt).all()]
+
+
+# Ranks by the summed IDF of the matched keywords, most recent first among equals, like `KeywordIndex.search`.
+# Optional resource type and date bounds are applied in the same query. The array operator is spelled out in one
+# statement per mode, as the GIN index on `keywords` cannot serve an operator chosen at execution time.
+_sql_search_keywords = """
+    WITH query AS (SELECT DISTINCT unnest(CAST(:ids AS INTEGER[])) AS word_id),
+    total AS (SELECT count(*) AS num_resources FROM resource),
+    weight AS (
+        SELECT word_id, ln((num_resources + 1.0) / (
+            (SELECT count(*) FROM resource WHERE keywords @> ARRAY[word_id]) + 1
+        )) + 1 AS idf
+        FROM query, total
+    )
+    SELECT id, (SELECT sum(idf) FROM weight WHERE word_id = ANY(keywords)) AS score
+    FROM resource
+    WHERE keywords {op} CAST(:ids AS INTEGER[])
+        AND (CAST(:res_type AS INTEGER) IS NULL OR resource_type = :res_type)
+        AND (CAST(:added_after AS TIMESTAMP) IS NULL OR date_added >= :added_after)
+        AND (CAST(:added_before AS TIMESTAMP) IS NULL OR date_added < :added_before)
+    ORDER BY score DESC, id DESC
+    LIMIT :limit
+"""
+stmt_search_keywords_any = text(_sql_search_keywords.format(op="&&"))
+stmt_search_keywords_all = text(_sql_search_keywords.format(op="@>"))
+
+
+def _search_keywords_params(
+    keyword_ids: list[int],
+    limit: int,
+    res_type: int | None,
+    added_after: datetime | None,
+    added_before: datetime | None,
+) -> dict:
+    return {
+        "ids": keyword_ids,
+        "limit": limit,
+        "res_type": res_type,
+        "added_after": added_after,
+        "added_before": added_before,
+    }
+
+
+def fetch_resources_by_keywords(
+    keyword_ids: list[int],
+    match_all: bool,
+    limit: int,
+    res_type: int | None = None,
+    added_after: datetime | None = None,
+    added_before: datetime | None = None,
+    session: Session | None = None,
+) -> list[tuple[int, float]]:
+    params = _search_keywords_params(keyword_ids, limit, res_type, added_after, added_before)
+
+    with get_session(session) as session:
+        stmt = stmt_search_keywords_all if match_all else stmt_search_keywords_any
+        return [(row[0], float(row[1])) for row in session.execute(stmt, params).all()]
+
+
+def fetch_all_keywords(session: Session | None = None) -> list[Keyword]:
+    with get_session(session) as session:
+        return list(session.exec(select(Keyword)).all())
+
+
+def fetch_write_marks(session: Session | None = None) -> tuple[int, int]:
+    """Largest resource and keyword ids, which grow with every insert whichever process makes it."""
+
+    stmt = text("SELECT (SELECT max(id) FROM resource), (SELECT max(id) FROM keyword)")
+
+    with get_session(session) as session:
+        row = session.execute(stmt).one()
+        return row[0] or 0, row[1] or 0
+
+
+def fetch_phashes(session: Session | None = None) -> list[tuple[int, int]]:
+    stmt = select(Resource.id, Resource.phash).where(col(Resource.phash).is_not(None))
+
+    with get_session(session) as session:
+        return [(row[0], row[1]) for row in session.exec(stmt).all()]
+
+
 # =================================================
 # Insert
 # =================================================
 
 
-def insert_keyword(category: str, word: str) -> Keyword:
-    kw_cat_instance = fetch_keyword_cat(category)
+def insert_keyword(category: str, word: str, session: Session | None = None) -> int:
+    return insert_keywords([(category, word)], session)[0][0]
+
+
+def insert_resource(
+    resource_type: str,
+    name: str,
+    keywords: list[str],
+    content_hash: str | None = None,
+    phash: int | None = None,
+    session: Session | None = None,
+) -> Resource:
+    with get_session(session) as session:
+        word2id = dictionary.keyword_ids(keywords, session)
+
+        resource = Resource(
+            name=name,
+            keywords=[word2id[word] for word in keywords if word in word2id],
+            resource_type=dictionary.res_type_id(resource_type, session),
+            content_hash=content_hash,
+            phash=phash,
+        )
+        session.add(resource)
+        session.commit()
+        session.refresh(resource)
 
-    keyword = Keyword(word=word, category=kw_cat_instance)
-    session.add(keyword)
-    session.commit()
-    session.refresh(keyword)
+    return resource
 
-    return keyword
 
+def insert_keywords(keywords: list[tuple[str, str]], session: Session | None = None) -> list[tuple[int, bool]]:
+    """Upsert many (category, word) pairs with a single statement; return (id, inserted) in input order.
 
-def insert_resource(resource_type: str, name: str, keywords: list[str]) -> Resource:
-    # Convert 'resource' to 'resource_type' in id
-    resource_type_instance = fetch_resource_type(resource_type)
+    Words already stored (possibly by a concurrent worker) keep their row and id and are not `inserted`, so that
+    callers only index the vectors of new rows. A word repeated in `keywords` counts as inserted once.
+    """
 
-    # Convert keywords to list of ids of corresponding keywords
-    keyword_instances = fetch_keyword(keywords)
+    if len(keywords) == 0:
+        return []
 
-    resource = Resource(
-        name=name,
-        keywords=[keyword.id for keyword in keyword_instances],
-        res_type=resource_type_instance,
-    )
-    session.add(resource)
-    session.commit()
-    session.refresh(resource)
+    with get_session(session) as session:
+        # A word may appear only once per statement for ON CONFLICT to apply
+        values = {word: dictionary.keyword_cat_id(category, session) for category, word in keywords}
 
-    return resource
+        stmt = pg_insert(Keyword).values([{"word": word, "category_id": cat_id} for word, cat_id in values.items()])
+        # No-op update instead of DO NOTHING, so that RETURNING also yields rows which already existed; `xmax` is
+        # only 0 for rows inserted by the statement
+        stmt = stmt.on_conflict_do_update(index_elements=["word"], set_={"word": stmt.excluded.word}).returning(
+            col(Keyword.word), col(Keyword.id), literal_column("xmax = 0")
+        )
+        rows = session.exec(stmt).all()
+        session.commit()
+
+    dictionary.add_keywords({row[0]: row[1] for row in rows})
+
+    fresh = {row[0]: (row[1], row[2]) for row in rows}
+    out = []
+    for _, word in keywords:
+        out.append(fresh[word])
+        fresh[word] = (fresh[word][0], False)
+
+    return out
+
+
+def insert_resources(
+    resources: list[tuple[str, str, list[str], str | None, int | None]], session: Session | None = None
+) -> list[Resource]:
+    """Insert many (resource_type, name, keywords, content_hash, phash) entries in a single transaction."""
+
+    with get_session(session) as session:
+        words = list({word for _, _, keywords, _, _ in resources for word in keywords})
+        word2id = dictionary.keyword_ids(words, session)
+
+        instances = [
+            Resource(
+                name=name,
+                keywords=[word2id[word] for word in keywords if word in word2id],
+                resource_type=dictionary.res_type_id(res_type, session),
+                content_hash=content_hash,
+                phash=phash,
+            )
+            for res_type, name, keywords, content_hash, phash in resources
+        ]
+        session.add_all(instances)
+        session.commit()
+
+    return instances
 
 
-def insert_resource_type(resource_type: str):
-    session.add(ResourceType(type=resource_type))
-    session.commit()
+def insert_resource_type(resource_type: str, session: Session | None = None):
+    with get_session(session) as session:
+        instance = ResourceType(type=resource_type)
+        session.add(instance)
+        session.commit()
+        session.refresh(instance)
 
+    dictionary.add_res_type(resource_type, instance.id)
 
-def insert_keyword_cat(category: str):
-    session.add(KeywordCategory(category_name=category))
-    session.commit()
+
+def insert_keyword_cat(category: str, session: Session | None = None):
+    with get_session(session) as session:
+        instance = KeywordCategory(category_name=category)
+        session.add(instance)
+        session.commit()
+        session.refresh(instance)
+
+    dictionary.add_keyword_cat(category, instance.id)
+
+
+# =================================================
+# Async variants, for use from async routers without blocking the event loop
+# =================================================
+
+
+async def afetch_resource_type(resource_type: str, session: AsyncSession | None = None) -> ResourceType:
+    stmt = select(ResourceType).where(ResourceType.type == resource_type)
+
+    async with get_async_session(session) as session:
+        result = (await session.exec(stmt)).first()
+
+    assert result is not None
+
+    return result
+
+
+async def afetch_keyword(keywords: str | list[str], session: AsyncSession | None = None) -> list[Keyword]:
+    if isinstance(keywords, str):
+        keywords = [keywords]
+    stmt = select(Keyword).where(col(Keyword.word).in_(keywords))
+
+    async with get_async_session(session) as session:
+        return list((await session.exec(stmt)).all())
+
+
+async def afetch_keyword_cat(category: str, session: AsyncSession | None = None) -> KeywordCategory:
+    stmt = select(KeywordCategory).where(KeywordCategory.category_name == category)
+
+    async with get_async_session(session) as session:
+        out = (await session.exec(stmt)).first()
+    assert out is not None
+
+    return out
+
+
+async def afetch_resource(resource_id: int, session: AsyncSession | None = None) -> Resource | None:
+    stmt = select(Resource).where(Resource.id == resource_id).options(selectinload(Resource.res_type))
+
+    async with get_async_session(session) as session:
+        return (await session.exec(stmt)).first()
+
+
+async def afetch_resource_by_hash(content_hash: str | list[str], session: AsyncSession | None = None) -> dict[str, int]:
+    if isinstance(content_hash, str):
+        content_hash = [content_hash]
+    stmt = select(Resource.content_hash, Resource.id).where(col(Resource.content_hash).in_(content_hash))
+
+    async with get_async_session(session) as session:
+        return {row[0]: row[1] for row in (await session.exec(stmt)).all()}
+
+
+async def afetch_resources_by_keywords(
+    keyword_ids: list[int],
+    match_all: bool,
+    limit: int,
+    res_type: int | None = None,
+    added_after: datetime | None = None,
+    added_before: datetime | None = None,
+    session: AsyncSession | None = None,
+) -> list[tuple[int, float]]:
+    params = _search_keywords_params(keyword_ids, limit, res_type, added_after, added_before)
+
+    async with get_async_session(session) as session:
+        stmt = stmt_search_keywords_all if match_all else stmt_search_keywords_any
+        return [(row[0], float(row[1])) for row in (await session.execute(stmt, params)).all()]
+
+
+async def ainsert_keyword(category: str, word: str, session: AsyncSession | None = None) -> int:
+    async with get_async_session(session) as session:
+        cat_id = dictionary.lookup_keyword_cat(category)
+        if cat_id is None:
+            cat_id = (await afetch_keyword_cat(category, session)).id
+            dictionary.add_keyword_cat(category, cat_id)
+
+        stmt = pg_insert(Keyword).values(word=word, category_id=cat_id)
+        stmt = stmt.on_conflict_do_update(index_elements=["word"], set_={"word": stmt.excluded.word}).returning(
+            col(Keyword.id)
+        )
+        keyword_id = (await session.exec(stmt)).one()[0]
+        await session.commit()
+
+    dictionary.add_keywords({word: keyword_id})
+
+    return keyword_id
+
+
+async def ainsert_resource(
+    resource_type: str,
+    name: str,
+    keywords: list[str],
+    content_hash: str | None = None,
+    phash: int | None = None,
+    session: AsyncSession | None = None,
+) -> Resource:
+    async with get_async_session(session) as session:
+        # Names resolve from the in-memory dictionary; only names it does not know yet cost a query
+        word2id = dictionary.lookup_keywords(keywords)
+        missing = [word for word in keywords if word not in word2id]
+        if len(missing) > 0:
+            fetched = {keyword.word: keyword.id for keyword in await afetch_keyword(missing, session)}
+            dictionary.add_keywords(fetched)
+            word2id.update(fetched)
+
+        res_type_id = dictionary.lookup_res_type(resource_type)
+        if res_type_id is None:
+            res_type_id = (await afetch_resource_type(resource_type, session)).id
+            dictionary.add_res_type(resource_type, res_type_id)
+
+        resource = Resource(
+            name=name,
+            keywords=[word2id[word] for word in keywords if word in word2id],
+            resource_type=res_type_id,
+            content_hash=content_hash,
+            phash=phash,
+        )
+        session.add(resource)
+        await session.commit()
+        await session.refresh(resource)
+
+    return resource
@@ -6,7 +6,7 @@ from datetime import datetime
 from enum import Enum
 from typing import List
 
-from sqlmodel import ARRAY, Column, Field, Integer, Relationship, SQLModel
+from sqlmodel import ARRAY, BigInteger, Column, Field, Integer, Relationship, SQLModel
 
 
 class RESOURCE_TYPE(Enum):
@@ -37,7 +37,8 @@ class Keyword(SQLModel, table=True):
 
     id: int = Field(default=None, primary_key=True)
     category_id: int = Field(foreign_key="keyword_category.id")
-    word: str
+    # Unique index `ix_keyword_word`, also created on tables predating it by `create_db`; the keyword upsert needs it
+    word: str = Field(index=True, unique=True)
 
     category: KeywordCategory = Relationship()
 
@@ -48,6 +49,9 @@ class Resource(SQLModel, table=True):
     name: str
     date_added: datetime = Field(default_factory=datetime.now)
     keywords: List[int] = Field(sa_column=Column(ARRAY(Integer)))
+    # SHA-256 of the uploaded bytes and 64-bit perceptual hash (stored signed), used to skip duplicates early
+    content_hash: str | None = Field(default=None, index=True)
+    phash: int | None = Field(default=None, sa_column=Column(BigInteger))
 
     res_type: ResourceType = Relationship()
 
@@ -0,0 +1,117 @@
+import hashlib
+import threading
+
+from PIL import Image
+
+HASH_BITS = 64
+
+
+def content_hash(raw: bytes) -> str:
+    return hashlib.sha256(raw).hexdigest()
+
+
+def dhash(image: Image.Image, size: int = 8) -> int:
+    """64-bit difference hash: sign of the horizontal gradient over a 9x8 grayscale thumbnail."""
+
+    gray = image.convert("L").resize((size + 1, size), Image.Resampling.LANCZOS)
+    pixels = list(gray.getdata())
+
+    value = 0
+    for row in range(size):
+        for col in range(size):
+            left = pixels[row * (size + 1) + col]
+            right = pixels[row * (size + 1) + col + 1]
+            value = (value << 1) | int(left > right)
+
+    return value
+
+
+def to_signed(value: int) -> int:
+    """Map an unsigned 64-bit hash into Postgres' signed BIGINT range."""
+
+    return value - (1 << HASH_BITS) if value >= 1 << (HASH_BITS - 1) else value
+
+
+def to_unsigned(value: int) -> int:
+    return value + (1 << HASH_BITS) if value < 0 else value
+
+
+class BKTree:
+    """Burkhard-Keller tree over Hamming distance, answering "all hashes within distance d" queries."""
+
+    def __init__(self):
+        # Each node: [hash, values, {distance: child node}]
+        self._root: list | None = None
+        self.size = 0
+
+    def add(self, value_hash: int, value: int):
+        self.size += 1
+        if self._root is None:
+            self._root = [value_hash, [value], {}]
+            return
+
+        node = self._root
+        while True:
+            dist = (node[0] ^ value_hash).bit_count()
+            if dist == 0:
+                node[1].append(value)
+                return
+            child = node[2].get(dist)
+            if child is None:
+                node[2][dist] = [value_hash, [value], {}]
+                return
+            node = child
+
+    def search(self, value_hash: int, max_dist: int) -> list[tuple[int, int]]:
+        """Return (distance, value) of every entry within `max_dist`, closest first."""
+
+        if self._root is None:
+            return []
+
+        out = []
+        stack = [self._root]
+        while len(stack) > 0:
+            node = stack.pop()
+            dist = (node[0] ^ value_hash).bit_count()
+            if dist <= max_dist:
+                out.extend((dist, value) for value in node[1])
+
+            # Triangle inequality: only children whose edge lies in [dist - d, dist + d] can hold matches
+            for edge, child in node[2].items():
+                if dist - max_dist <= edge <= dist + max_dist:
+                    stack.append(child)
+
+        return sorted(out)
+
+
+class PerceptualHashIndex:
+    """Thread-safe perceptual-hash index mapping near-identical images to the resource already stored."""
+
+    def __init__(self, max_dist: int):
+        self.max_dist = max_dist
+
+        self._tree = BKTree()
+        self._lock = threading.Lock()
+
+    def load(self, entries: list[tuple[int, int]]):
+        """Load (resource_id, signed phash) pairs, as stored in the attribute DB."""
+
+        with self._lock:
+            self._tree = BKTree()
+            for resource_id, phash in entries:
+                self._tree.add(to_unsigned(phash), resource_id)
+
+    def add(self, phash: int, resource_id: int):
+        with self._lock:
+            self._tree.add(phash, resource_id)
+
+    def find(self, phash: int) -> int | None:
+        """Return the id of the closest resource within `max_dist`, if any."""
+
+        with self._lock:
+            matches = self._tree.search(phash, self.max_dist)
+
+        return matches[0][1] if len(matches) > 0 else None
+
+    def __len__(self) -> int:
+        return self._tree.size
@@ -1,13 +1,26 @@
-import sys
-from typing import List
+import json
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable, List
 
+import numpy as np
 from loguru import logger
 from numpy import ndarray
 from pydantic import BaseModel
-from pymilvus import Collection, CollectionSchema, DataType, FieldSchema, connections, utility
+from pymilvus import Collection, CollectionSchema, DataType, FieldSchema, MilvusException, connections, utility
 
 from src import config
 
+from .compression import Projection
+from .index_manager import IndexManager, IndexSpec, choose_index
+from .inference import QueueFullError
+
+if TYPE_CHECKING:
+    from .exact_store import ExactEmbdStore
+    from .local_index import LocalEmbdStoreController
+
 
 class EmbdObj(BaseModel):
     obj_id: int
@@ -15,7 +28,85 @@ class EmbdObj(BaseModel):
     resource_id: int
 
 
+# Scalar INT64 fields stored next to resource embeddings so that searches can be pre-filtered
+FIELDNAME_RES_TYPE = "res_type"
+FIELDNAME_DATE_ADDED = "date_added"
+
+
+class EmbdFilter(BaseModel):
+    """Pre-filter of a resource search, on the scalar fields stored with each embedding."""
+
+    res_type: int | None = None
+    added_after: datetime | None = None
+    added_before: datetime | None = None
+
+    def is_empty(self) -> bool:
+        return self.res_type is None and self.added_after is None and self.added_before is None
+
+    def to_expr(self) -> str | None:
+        """Boolean expression evaluated by Milvus before the vector search."""
+
+        conds = []
+        if self.res_type is not None:
+            conds.append(f"{FIELDNAME_RES_TYPE} == {self.res_type}")
+        if self.added_after is not None:
+            conds.append(f"{FIELDNAME_DATE_ADDED} >= {int(self.added_after.timestamp())}")
+        if self.added_before is not None:
+            conds.append(f"{FIELDNAME_DATE_ADDED} < {int(self.added_before.timestamp())}")
+
+        return " and ".join(conds) if len(conds) > 0 else None
+
+    def mask(self, scalars: dict[str, ndarray]) -> ndarray:
+        """Rows satisfying the filter, given the scalar field columns."""
+
+        mask = np.ones(len(next(iter(scalars.values()))), dtype=bool)
+        if self.res_type is not None:
+            mask &= scalars[FIELDNAME_RES_TYPE] == self.res_type
+        if self.added_after is not None:
+            mask &= scalars[FIELDNAME_DATE_ADDED] >= int(self.added_after.timestamp())
+        if self.added_before is not None:
+            mask &= scalars[FIELDNAME_DATE_ADDED] < int(self.added_before.timestamp())
+
+        return mask
+
+
+def _to_float16(value) -> ndarray:
+    # Queried FLOAT16_VECTOR values come back as raw bytes (possibly wrapped in a list) or as float arrays
+    if isinstance(value, list) and len(value) == 1 and isinstance(value[0], bytes):
+        value = value[0]
+    if isinstance(value, bytes):
+        return np.frombuffer(value, dtype=np.float16)
+
+    return np.asarray(value, dtype=np.float16)
+
+
+def _project(projection: Projection | None, embds: ndarray | List[ndarray]) -> ndarray | List[ndarray]:
+    if projection is None:
+        return embds
+
+    return list(projection.apply(np.stack(embds) if isinstance(embds, list) else embds))
+
+
+def _describe_fields(schema: CollectionSchema) -> dict[str, str]:
+    return {
+        field.name: f"{field.dtype.name}({field.params['dim']})" if "dim" in field.params else field.dtype.name
+        for field in schema.fields
+    }
+
+
 class EmbdStoreController:
+    """Milvus collection accessed through an alias.
+
+    The alias (`coll_name`) points at a physical collection `<coll_name>_v<generation>`, so that the index can be
+    rebuilt into a shadow collection and swapped in atomically (see `rebuild`).
+
+    With an `exact_store`, searches fetch `rerank_factor` times more candidates than asked and re-score them
+    against the float32 vectors of the store, recovering the recall lost to float16 storage and ANN search.
+
+    `schema_tag` (the version of the projection applied to stored vectors, empty when uncompressed) is kept as the
+    collection description and checked on startup, with the fields, unless `check_schema` is False (to drop it).
+    """
+
     def __init__(
         self,
         fieldname_id: str,
@@ -25,6 +116,15 @@ class EmbdStoreController:
         metric_type: str,
         coll_name: str,
         embd_dim: int,
+        flush_size: int = 512,
+        flush_age: float = 2.0,
+        max_buffer: int = 8192,
+        scalar_fields: list[str] | None = None,
+        exact_store: "ExactEmbdStore | None" = None,
+        rerank_factor: int = 4,
+        quantization: str | None = None,
+        schema_tag: str = "",
+        check_schema: bool = True,
     ):
         self.fieldname_id = fieldname_id
         self.fieldname_res_id = fieldname_res_id
@@ -33,11 +133,52 @@ class EmbdStoreController:
         self.metric_type = metric_type
         self.coll_name = coll_name
         self.embd_dim = embd_dim
+        self.flush_size = flush_size
+        self.flush_age = flush_age
+        self.max_buffer = max_buffer
+        self.scalar_fields = scalar_fields or []
+        self.exact_store = exact_store
+        self.rerank_factor = rerank_factor
+        self.quantization = quantization
+        self.schema_tag = schema_tag
+
+        self.collection = self._initialize(check_schema)
+        self._loaded = False
+        self._load_lock = threading.Lock()
+        self.index_spec: IndexSpec | None = None
+        # An unchecked collection is only opened to be dropped: do not build an index for it
+        if check_schema:
+            self.create_index(self.target_index_spec(self.collection.num_entities))
+
+        # Inserted entities are buffered and written to Milvus by size, by age or on `sync()`. Callbacks registered
+        # with `when_written` run once the entities buffered before them are written
+        self._buffer_ids: list[int] = []
+        self._buffer_embds: list[ndarray] = []
+        self._buffer_scalars: list[list[int]] = [[] for _ in self.scalar_fields]
+        self._buffer_callbacks: list[Callable[[], None]] = []
+        self._buffer_since: float | None = None
+        self._buffer_lock = threading.RLock()
+        self._num_failures = 0
+        self._last_error: str | None = None
+        self._closed = False
+
+        # Bumped by every write so that cached search results can tell they are stale
+        self.epoch = 0
+
+        self._flusher = threading.Thread(target=self._flush_periodically, name=f"flusher-{coll_name}", daemon=True)
+        self._flusher.start()
+
+    def _schema(self) -> CollectionSchema:
+        fields = [
+            FieldSchema(name=self.fieldname_id, dtype=DataType.INT64, is_primary=True, auto_id=True),
+            FieldSchema(name=self.fieldname_res_id, dtype=DataType.INT64),
+            FieldSchema(name=self.fieldname_embd, dtype=DataType.FLOAT16_VECTOR, dim=self.embd_dim),
+            *[FieldSchema(name=name, dtype=DataType.INT64) for name in self.scalar_fields],
+        ]
 
-        self.collection = self._initialize()
-        self.create_index()
+        return CollectionSchema(fields, description=self.schema_tag)
 
-    def _initialize(self) -> Collection:
+    def _initialize(self, check_schema: bool = True) -> Collection:
         # Connect to embedding store
         try:
             connections.connect(host=config.EMBDSTORE_HOST, port=config.EMBDSTORE_PORT)
@@ -45,49 +186,451 @@ class EmbdStoreController:
         except Exception as e:
             logger.error(f"Failed to connect to Milvus embedding store: {e}")
 
-            sys.exit(1)
+            raise
 
-        # Create collection
-        fields = [
-            FieldSchema(name=self.fieldname_id, dtype=DataType.INT64, is_primary=True, auto_id=True),
-            FieldSchema(name=self.fieldname_res_id, dtype=DataType.INT64),
-            FieldSchema(name=self.fieldname_embd, dtype=DataType.FLOAT16_VECTOR, dim=self.embd_dim),
-        ]
+        # Create the first generation and its alias
+        if not utility.has_collection(self.coll_name):
+            Collection(f"{self.coll_name}_v0", self._schema(), consistency_level="Strong")
+            utility.create_alias(f"{self.coll_name}_v0", self.coll_name)
+
+        collection = Collection(self.coll_name, consistency_level="Strong")
+        if not check_schema:
+            return collection
+
+        if collection.description != self.schema_tag:
+            raise ValueError(
+                f"Collection '{self.coll_name}' holds vectors of projection '{collection.description or 'none'}' "
+                f"but '{self.schema_tag or 'none'}' is configured; run `python -m src.maintenance rebuild-embd-store`"
+            )
+
+        # Collections created by older versions may lack fields (e.g. the filter scalars) or store other vectors
+        fields, expected = _describe_fields(collection.schema), _describe_fields(self._schema())
+        if fields != expected:
+            raise ValueError(
+                f"Collection '{self.coll_name}' has fields {fields} but {expected} are expected; "
+                "run `python -m src.maintenance rebuild-embd-store`"
+            )
 
-        schema = CollectionSchema(fields)
-        collection = Collection(self.coll_name, schema, consistency_level="Strong")
         return collection
 
+    def _physical_name(self) -> str:
+        """Name of the collection behind the alias; equals `coll_name` for collections created before aliases."""
+
+        return self.collection.describe()["collection_name"]
+
     def drop_collection(self):
-        utility.drop_collection(self.coll_name)
+        physical = self._physical_name()
+        if physical != self.coll_name:
+            utility.drop_alias(self.coll_name)
+        utility.drop_collection(physical)
+        if self.exact_store is not None:
+            self.exact_store.clear()
+        self._loaded = False
+        self.epoch += 1
+
         logger.info(f"Dropped collection '{self.coll_name}'.")
 
+    def load(self):
+        """Load the collection into query nodes once; later searches reuse it until `release`."""
+
+        if self._loaded:
+            return
+
+        with self._load_lock:
+            if not self._loaded:
+                self.collection.load()
+                self._loaded = True
+                logger.info(f"Loaded collection '{self.coll_name}'.")
+
+    def release(self):
+        with self._load_lock:
+            self.collection.release()
+            self._loaded = False
+
+    def num_entities(self) -> int:
+        with self._buffer_lock:
+            num_buffered = len(self._buffer_ids)
+
+        return self.collection.num_entities + num_buffered
+
+    def check_room(self):
+        """Raise `QueueFullError` if the buffer is full and cannot be written, e.g. while Milvus is unreachable.
+
+        Writers call it before committing anything that the vectors complete (e.g. the resource row), so that the
+        buffer stays bounded without dropping vectors of rows already committed.
+        """
+
+        with self._buffer_lock:
+            if len(self._buffer_ids) >= self.max_buffer and not self.sync():
+                raise QueueFullError(f"embd-buffer-{self.coll_name}")
+
+    def find_ids(self, ids: list[int]) -> set[int]:
+        """Return which of the `ids` (the `fieldname_res_id` field) have a stored or buffered vector."""
+
+        if len(ids) == 0:
+            return set()
+
+        with self._buffer_lock:
+            found = set(ids) & set(self._buffer_ids)
+        rows = self.collection.query(f"{self.fieldname_res_id} in {list(ids)}", output_fields=[self.fieldname_res_id])
+
+        return found | {row[self.fieldname_res_id] for row in rows}
+
+    def when_written(self, callback: Callable[[], None]):
+        """Run `callback` once every entity inserted so far is written to Milvus; right away if none is buffered."""
+
+        with self._buffer_lock:
+            if len(self._buffer_ids) > 0:
+                self._buffer_callbacks.append(callback)
+                return
+
+        callback()
+
     def insert(self, entities: list):
-        self.collection.insert(entities)
+        """Buffer `[ids, embds, *scalar columns]`, scalar columns following `scalar_fields`."""
+
+        ids, embds, *scalars = entities
+        assert len(scalars) == len(self.scalar_fields)
+
+        if self.exact_store is not None:
+            self.exact_store.put(ids, embds)
+
+        with self._buffer_lock:
+            self._buffer_ids.extend(ids)
+            self._buffer_embds.extend(embds)
+            for buffer, column in zip(self._buffer_scalars, scalars):
+                buffer.extend(column)
+            self.epoch += 1
+            if self._buffer_since is None:
+                self._buffer_since = time.monotonic()
+
+            if len(self._buffer_ids) >= self.flush_size:
+                self.sync()
+
+    def sync(self) -> bool:
+        """Write buffered entities to Milvus; return whether the buffer is empty afterwards."""
+
+        with self._buffer_lock:
+            if len(self._buffer_ids) == 0:
+                return True
+
+            try:
+                self.collection.insert([self._buffer_ids, self._buffer_embds, *self._buffer_scalars])
+            except Exception as e:
+                # Entities stay buffered (and searchable) so the next sync retries them
+                self._num_failures += 1
+                self._last_error = str(e)
+                logger.error(
+                    f"Failed to write {len(self._buffer_ids)} entities into '{self.coll_name}' "
+                    f"({self._num_failures} failures in a row): {e}"
+                )
+                return False
+
+            logger.info(f"Inserted {len(self._buffer_ids)} entities into '{self.coll_name}'")
+            callbacks = self._buffer_callbacks
+            self._buffer_ids = []
+            self._buffer_embds = []
+            self._buffer_scalars = [[] for _ in self.scalar_fields]
+            self._buffer_callbacks = []
+            self._buffer_since = None
+            self._num_failures = 0
+            self._last_error = None
+
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                logger.exception(f"Callback waiting for writes into '{self.coll_name}' failed")
+
+        return True
+
+    def buffer_stats(self) -> dict:
+        with self._buffer_lock:
+            return {
+                "num_buffered": len(self._buffer_ids),
+                "max_buffer": self.max_buffer,
+                "num_waiting": len(self._buffer_callbacks),
+                "num_failures": self._num_failures,
+                "last_error": self._last_error,
+            }
+
+    def close(self):
+        # A rebuild still running is abandoned before its swap
+        with self._buffer_lock:
+            self._closed = True
+            self.sync()
         self.collection.flush()
-        logger.info(f"Inserted data into '{self.coll_name}'")
 
-    def create_index(self, nlist: int = 128):
-        self.collection.create_index(
-            self.fieldname_embd,
-            {"index_type": self.index_type, "metric_type": self.metric_type, "params": {"nlist": nlist}},
+    # =================================================
+    # Index
+    # =================================================
+
+    def target_index_spec(self, num_rows: int | None = None) -> IndexSpec:
+        """Index suited to the collection size; a fixed `index_type` (other than "AUTO") only forces the family."""
+
+        spec = choose_index(num_rows if num_rows is not None else self.num_entities(), self.quantization, self.embd_dim)
+        if self.index_type == "AUTO" or self.quantization is not None or spec.index_type == self.index_type:
+            return spec
+
+        match self.index_type:
+            case "FLAT":
+                return IndexSpec("FLAT")
+            case "HNSW":
+                return IndexSpec("HNSW", {"M": 16, "efConstruction": 200})
+            case _:
+                return IndexSpec(self.index_type, {"nlist": spec.params.get("nlist", 128)})
+
+    def _current_index_spec(self) -> IndexSpec | None:
+        if not self.collection.has_index():
+            return None
+
+        index = self.collection.index().params
+        # Depending on the server version, index parameters are nested under "params" (possibly as JSON) or
+        # flattened, and numbers may come back as strings
+        params = index.get("params", index)
+        params = json.loads(params) if isinstance(params, str) else params
+
+        return IndexSpec(
+            index.get("index_type", ""),
+            {
+                name: int(value) if str(value).isdigit() else value
+                for name, value in params.items()
+                if name not in ("index_type", "metric_type")
+            },
         )
 
-        logger.info(f"Index '{self.index_type}' created for field '{self.fieldname_embd}'.")
+    def refresh_index_spec(self) -> IndexSpec | None:
+        """Read the index of the collection behind the alias, which another process may have rebuilt."""
 
-    def search(self, query: ndarray | List[ndarray], limit: int = 10, nprobe: int = 10) -> list[list[EmbdObj]]:
-        if isinstance(query, ndarray):
-            query = [query]
+        self.index_spec = self._current_index_spec() or self.index_spec
+
+        return self.index_spec
+
+    def create_index(self, spec: IndexSpec):
+        """Build the vector index unless one with the same parameters already exists."""
+
+        current = self._current_index_spec()
+        if current is not None:
+            if spec.matches(current.index_type, current.params):
+                self.index_spec = spec
+                return
+            if self.collection.num_entities > 0:
+                # Keep serving from the existing index; the index manager rebuilds it in the background
+                self.index_spec = current
+                return
+
+            # An index cannot be replaced while the collection is loaded
+            self.release()
+            self.collection.drop_index()
+
+        self.collection.create_index(self.fieldname_embd, spec.build_params(self.metric_type))
+        self.index_spec = spec
 
-        self.collection.load()
-        results = self.collection.search(
+        logger.info(f"Index '{spec.index_type}' {spec.params} created for field '{self.fieldname_embd}'.")
+
+    def rebuild(self, spec: IndexSpec, batch_size: int = 4096, grace_s: float = 5.0):
+        """Copy the collection into a shadow collection indexed with `spec`, then point the alias at it.
+
+        Searches keep using the current collection during the copy, and writes of every process keep going to it
+        through the alias. Rows the copy missed are caught up right before the swap and again `grace_s` after it,
+        once writes in flight towards the old collection have landed, so none is lost when it is dropped. Only one
+        process may rebuild a collection at a time (see `IndexManager`).
+        """
+
+        old_name = self._physical_name()
+        generation = int(old_name.rsplit("_v", 1)[1]) + 1 if old_name != self.coll_name else 1
+        new_name = f"{self.coll_name}_v{generation}"
+
+        # Leftover of a rebuild that crashed; no other process rebuilds meanwhile
+        if utility.has_collection(new_name):
+            utility.drop_collection(new_name)
+        shadow = Collection(new_name, self._schema(), consistency_level="Strong")
+        old = Collection(old_name, consistency_level="Strong")
+        copied: list[ndarray] = []
+
+        try:
+            self._copy_rows(old, shadow, None, batch_size, copied)
+            shadow.create_index(self.fieldname_embd, spec.build_params(self.metric_type))
+            shadow.load()
+
+            with self._buffer_lock:
+                if self._closed:
+                    raise RuntimeError("Controller closed during rebuild")
+
+                self.sync()
+                self._catch_up(old, shadow, batch_size, copied)
+                shadow.flush()
+
+                if old_name == self.coll_name:
+                    # Collection created before aliases were used: its name has to be freed for the alias
+                    utility.drop_collection(old_name)
+                    utility.create_alias(new_name, self.coll_name)
+                else:
+                    utility.alter_alias(new_name, self.coll_name)
+
+                self.collection = Collection(self.coll_name, consistency_level="Strong")
+                self._loaded = True
+                self.index_spec = spec
+                self.epoch += 1
+        except Exception:
+            utility.drop_collection(new_name)
+            raise
+
+        if old_name != self.coll_name:
+            time.sleep(grace_s)
+            num_late = self._catch_up(old, shadow, batch_size, copied)
+            if num_late > 0:
+                logger.info(f"Copied {num_late} entities written to '{old_name}' during the swap")
+                self.epoch += 1
+            utility.drop_collection(old_name)
+
+        num_copied = sum(len(pks) for pks in copied)
+        logger.info(f"Rebuilt '{self.coll_name}' into '{new_name}' ({num_copied} entities) with {spec}.")
+
+    def _copy_rows(
+        self, source: Collection, target: Collection, expr: str | None, batch_size: int, copied: list[ndarray]
+    ) -> int:
+        """Copy the rows of `source` matching `expr` into `target`, appending their primary keys to `copied`."""
+
+        fields = [self.fieldname_id, self.fieldname_res_id, self.fieldname_embd, *self.scalar_fields]
+        iterator = source.query_iterator(batch_size=batch_size, expr=expr, output_fields=fields)
+        num_rows = 0
+        while len(rows := iterator.next()) > 0:
+            columns = [[row[name] for row in rows] for name in fields[1:]]
+            columns[1] = [_to_float16(value) for value in columns[1]]
+            target.insert(columns)
+            copied.append(np.asarray([row[self.fieldname_id] for row in rows], dtype=np.int64))
+            num_rows += len(rows)
+        iterator.close()
+
+        return num_rows
+
+    def _catch_up(self, source: Collection, target: Collection, batch_size: int, copied: list[ndarray]) -> int:
+        """Copy the rows of `source` not copied yet, found by primary key so that only their vectors are read."""
+
+        iterator = source.query_iterator(batch_size=batch_size, output_fields=[self.fieldname_id])
+        pks = []
+        while len(rows := iterator.next()) > 0:
+            pks.extend(row[self.fieldname_id] for row in rows)
+        iterator.close()
+
+        done = np.concatenate(copied) if len(copied) > 0 else np.empty(0, dtype=np.int64)
+        missing = np.asarray(pks, dtype=np.int64)
+        missing = missing[~np.isin(missing, done)].tolist()
+
+        return sum(
+            self._copy_rows(source, target, f"{self.fieldname_id} in {missing[i : i + batch_size]}", batch_size, copied)
+            for i in range(0, len(missing), batch_size)
+        )
+
+    def sample_vectors(self, num_rows: int, batch_size: int = 4096) -> ndarray:
+        """Read up to `num_rows` stored vectors, in the order Milvus iterates them, as float32."""
+
+        iterator = self.collection.query_iterator(batch_size=batch_size, output_fields=[self.fieldname_embd])
+        out = []
+        while len(out) < num_rows and len(rows := iterator.next()) > 0:
+            out.extend(_to_float16(row[self.fieldname_embd]) for row in rows)
+        iterator.close()
+
+        if len(out) == 0:
+            return np.empty((0, self.embd_dim), dtype=np.float32)
+
+        return np.stack(out[:num_rows]).astype(np.float32)
+
+    def _flush_periodically(self):
+        while True:
+            time.sleep(self.flush_age / 2)
+
+            with self._buffer_lock:
+                expired = self._buffer_since is not None and time.monotonic() - self._buffer_since >= self.flush_age
+            if expired:
+                self.sync()
+
+    def _search_buffer(
+        self, query: List[ndarray], limit: int, filters: EmbdFilter | None = None
+    ) -> list[list[EmbdObj]]:
+        """Brute-force search over entities not yet written to Milvus so that reads see recent writes."""
+
+        with self._buffer_lock:
+            if len(self._buffer_ids) == 0:
+                return [[] for _ in query]
+            ids = np.asarray(self._buffer_ids)
+            embds = np.stack(self._buffer_embds).astype(np.float32)
+
+            if filters is not None and not filters.is_empty():
+                mask = filters.mask(
+                    {name: np.asarray(column) for name, column in zip(self.scalar_fields, self._buffer_scalars)}
+                )
+                ids, embds = ids[mask], embds[mask]
+                if len(ids) == 0:
+                    return [[] for _ in query]
+
+        queries = np.stack(query).astype(np.float32)
+        match self.metric_type:
+            case "COSINE":
+                embds = embds / np.maximum(np.linalg.norm(embds, axis=1, keepdims=True), 1e-12)
+                queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+                scores = queries @ embds.T
+            case "IP":
+                scores = queries @ embds.T
+            case "L2":
+                scores = -(((queries[:, None, :] - embds[None, :, :]) ** 2).sum(-1))
+            case _:
+                raise NotImplementedError()
+
+        output = []
+        for row in scores:
+            top = np.argsort(-row)[:limit]
+            similarity = row[top] if self.metric_type != "L2" else -row[top]
+            output.append(
+                [EmbdObj(obj_id=-1, similarity=float(sim), resource_id=int(ids[i])) for i, sim in zip(top, similarity)]
+            )
+
+        return output
+
+    def _search_collection(
+        self, query: List[ndarray], num_fetch: int, nprobe: int | None, ef: int | None, filters: EmbdFilter | None
+    ):
+        spec = self.index_spec or IndexSpec("FLAT")
+
+        return self.collection.search(
             query,
             self.fieldname_embd,
-            {"metric_type": self.metric_type, "params": {"nprobe": nprobe}},
-            limit=limit,
+            {"metric_type": self.metric_type, "params": spec.search_params(num_fetch, nprobe, ef)},
+            limit=num_fetch,
+            expr=filters.to_expr() if filters is not None else None,
             output_fields=[self.fieldname_res_id],
         )
 
+    def search(
+        self,
+        query: ndarray | List[ndarray],
+        limit: int = 10,
+        nprobe: int | None = None,
+        ef: int | None = None,
+        filters: EmbdFilter | None = None,
+    ) -> list[list[EmbdObj]]:
+        """Search the `limit` nearest entities of each query.
+
+        `nprobe` (IVF indexes) and `ef` (HNSW) trade latency for recall; unset, the index defaults apply.
+        """
+
+        if isinstance(query, ndarray):
+            query = [query]
+        num_fetch = limit * self.rerank_factor if self.exact_store is not None else limit
+
+        # Buffer is searched first: an entity synced in between shows up in both and is de-duplicated below
+        buffered = self._search_buffer(query, num_fetch, filters)
+
+        self.load()
+        try:
+            results = self._search_collection(query, num_fetch, nprobe, ef, filters)
+        except MilvusException:
+            # Another process may have rebuilt the collection with another index type since the last check
+            if self.index_spec == self.refresh_index_spec():
+                raise
+            results = self._search_collection(query, num_fetch, nprobe, ef, filters)
+
         output = []
         for result in results:
             arr = [
@@ -100,40 +643,190 @@ class EmbdStoreController:
             ]
             output.append(arr)
 
+        # Merge buffered entities, which carry obj_id = -1 as Milvus has not assigned their ids yet
+        reverse = self.metric_type != "L2"
+        for arr, arr_buffered in zip(output, buffered):
+            if len(arr_buffered) == 0:
+                continue
+            seen = {entry.resource_id for entry in arr}
+            arr.extend(entry for entry in arr_buffered if entry.resource_id not in seen)
+            arr.sort(key=lambda entry: entry.similarity, reverse=reverse)
+            del arr[num_fetch:]
+
+        if self.exact_store is not None:
+            output = self.exact_store.rerank(query, output, limit)
+
         return output
 
 
 class EmbdStoreUtils:
     def __init__(
         self,
-        index_type: str = "IVF_FLAT",
+        index_type: str = config.EMBDSTORE_INDEX_TYPE,
         metric_type: str = "COSINE",
         coll_name_res: str = "resource_embd",
         coll_name_keyword: str = "keyword_embd",
         embd_dim: int = 512,
+        check_schema: bool = True,
     ):
-        self.resource_embd = EmbdStoreController(
-            fieldname_id="id",
-            fieldname_res_id="resource_id",
-            fieldname_embd="embd",
-            index_type=index_type,
-            metric_type=metric_type,
-            coll_name=coll_name_res,
-            embd_dim=embd_dim,
+        self.backend = config.EMBDSTORE_BACKEND
+        self.check_schema = check_schema
+        self.embd_dim = embd_dim
+
+        # Optional compression: vectors are projected to fewer dimensions before being stored or searched
+        self.res_projection = Projection.load(Path(config.EMBDSTORE_PROJECTION_DIR) / coll_name_res)
+        self.keyword_projection = Projection.load(Path(config.EMBDSTORE_PROJECTION_DIR) / coll_name_keyword)
+
+        self.resource_embd = self._create_controller(
+            "resource_id",
+            coll_name_res,
+            index_type,
+            metric_type,
+            self.res_projection,
+            [FIELDNAME_RES_TYPE, FIELDNAME_DATE_ADDED],
+        )
+        self.keyword_embd = self._create_controller(
+            "keyword_id", coll_name_keyword, index_type, metric_type, self.keyword_projection
         )
 
-        self.keyword_embd = EmbdStoreController(
-            fieldname_id="id",
-            fieldname_res_id="keyword_id",
-            fieldname_embd="embd",
-            index_type=index_type,
-            metric_type=metric_type,
-            coll_name=coll_name_keyword,
-            embd_dim=embd_dim,
+        # The local backend picks its faiss index when rebuilding on load; Milvus collections are managed live
+        self.index_managers = (
+            [
+                IndexManager(self.resource_embd, config.EMBDSTORE_INDEX_CHECK_S),
+                IndexManager(self.keyword_embd, config.EMBDSTORE_INDEX_CHECK_S),
+            ]
+            if self.backend == "milvus"
+            else []
         )
 
-    def insert_res_embd(self, embd: ndarray, res_id: int):
-        entities = [[res_id], [embd]]
+    def _create_controller(
+        self,
+        fieldname_res_id: str,
+        coll_name: str,
+        index_type: str,
+        metric_type: str,
+        projection: Projection | None,
+        scalar_fields: list[str] | None = None,
+    ) -> "EmbdStoreController | LocalEmbdStoreController":
+        embd_dim = projection.dim_out if projection is not None else self.embd_dim
+        schema_tag = projection.version if projection is not None else ""
+
+        exact_store = None
+        if config.EMBDSTORE_RERANK_FACTOR > 0:
+            # Imported here since `exact_store` depends on this module for `EmbdObj`
+            from .exact_store import ExactEmbdStore
+
+            # Full-precision copies live in the projected space, so every projection gets its own store
+            path_exact = Path(config.EMBDSTORE_EXACT_DIR) / coll_name / schema_tag
+            exact_store = ExactEmbdStore(str(path_exact), embd_dim, metric_type)
+
+        match self.backend:
+            case "milvus":
+                return EmbdStoreController(
+                    fieldname_id="id",
+                    fieldname_res_id=fieldname_res_id,
+                    fieldname_embd="embd",
+                    index_type=index_type,
+                    metric_type=metric_type,
+                    coll_name=coll_name,
+                    embd_dim=embd_dim,
+                    flush_size=config.EMBDSTORE_FLUSH_SIZE,
+                    flush_age=config.EMBDSTORE_FLUSH_AGE_S,
+                    max_buffer=config.EMBDSTORE_MAX_BUFFER,
+                    scalar_fields=scalar_fields,
+                    exact_store=exact_store,
+                    rerank_factor=config.EMBDSTORE_RERANK_FACTOR,
+                    quantization=config.EMBDSTORE_QUANTIZATION,
+                    schema_tag=schema_tag,
+                    check_schema=self.check_schema,
+                )
+            case "local":
+                # Imported here since `local_index` depends on this module for `EmbdObj`
+                from .local_index import LocalEmbdStoreController
+
+                return LocalEmbdStoreController(
+                    fieldname_id="id",
+                    fieldname_res_id=fieldname_res_id,
+                    fieldname_embd="embd",
+                    index_type=index_type,
+                    metric_type=metric_type,
+                    coll_name=coll_name,
+                    embd_dim=embd_dim,
+                    root_dir=config.EMBDSTORE_LOCAL_DIR,
+                    scalar_fields=scalar_fields,
+                    exact_store=exact_store,
+                    rerank_factor=config.EMBDSTORE_RERANK_FACTOR,
+                    quantization=config.EMBDSTORE_QUANTIZATION,
+                    schema_tag=schema_tag,
+                    check_schema=self.check_schema,
+                )
+            case _:
+                raise NotImplementedError(f"Unknown embedding store backend: {self.backend}")
+
+    @property
+    def epoch(self) -> tuple[int, int]:
+        """Write epoch of the whole store; changes whenever either collection is written."""
+
+        return self.resource_embd.epoch, self.keyword_embd.epoch
+
+    def start_index_managers(self):
+        for manager in self.index_managers:
+            manager.start()
+
+    def index_stats(self) -> dict:
+        return {manager.controller.coll_name: manager.stats() for manager in self.index_managers}
+
+    def warm_up(self):
+        """Search both collections once, so that they are loaded in memory before the first request."""
+
+        probe = np.full(self.embd_dim, 1 / np.sqrt(self.embd_dim), dtype=np.float32)
+        self.search_similar_res(probe, limit=1)
+        self.search_similar_keyword(probe, limit=1)
+
+    def buffer_stats(self) -> dict:
+        return {
+            controller.coll_name: controller.buffer_stats() for controller in [self.resource_embd, self.keyword_embd]
+        }
+
+    def check_room(self):
+        self.resource_embd.check_room()
+        self.keyword_embd.check_room()
+
+    def missing_res_embd(self, res_ids: list[int]) -> set[int]:
+        """Return which resources have no vector, e.g. as a crash lost them before they were written."""
+
+        return set(res_ids) - self.resource_embd.find_ids(res_ids)
+
+    def when_written(self, callback: Callable[[], None]):
+        """Run `callback` once every vector inserted so far, keywords and resources, is written."""
+
+        self.keyword_embd.when_written(lambda: self.resource_embd.when_written(callback))
+
+    def sync(self) -> bool:
+        return self.resource_embd.sync() & self.keyword_embd.sync()
+
+    def close(self):
+        self.resource_embd.close()
+        self.keyword_embd.close()
+
+    def insert_res_embd(
+        self,
+        embd: ndarray | List[ndarray],
+        res_id: int | List[int],
+        res_type: int | List[int],
+        date_added: datetime | List[datetime],
+    ):
+        if isinstance(embd, ndarray):
+            embd = [embd]
+        if isinstance(res_id, int):
+            res_id = [res_id]
+        if isinstance(res_type, int):
+            res_type = [res_type]
+        if isinstance(date_added, datetime):
+            date_added = [date_added]
+
+        embd = _project(self.res_projection, embd)
+        entities = [res_id, embd, res_type, [int(date.timestamp()) for date in date_added]]
         self.resource_embd.insert(entities)
 
     def insert_keyword_embd(self, embd: ndarray | List[ndarray], keyword_id: int | List[int]):
@@ -142,11 +835,32 @@ class EmbdStoreUtils:
         if isinstance(keyword_id, int):
             keyword_id = [keyword_id]
 
-        entities = [keyword_id, embd]
+        entities = [keyword_id, _project(self.keyword_projection, embd)]
         self.keyword_embd.insert(entities)
 
-    def search_similar_res(self, embd_res: ndarray, limit: int = 10) -> list[EmbdObj]:
-        return self.resource_embd.search(embd_res, limit=limit)[0]
+    def search_similar_res(
+        self,
+        embd_res: ndarray,
+        limit: int = 10,
+        filters: EmbdFilter | None = None,
+        nprobe: int | None = None,
+        ef: int | None = None,
+    ) -> list[EmbdObj]:
+        return self.resource_embd.search(
+            _project(self.res_projection, embd_res), limit=limit, nprobe=nprobe, ef=ef, filters=filters
+        )[0]
+
+    def search_similar_res_many(
+        self,
+        embd_res: list[ndarray],
+        limit: int = 10,
+        filters: EmbdFilter | None = None,
+        nprobe: int | None = None,
+        ef: int | None = None,
+    ) -> list[list[EmbdObj]]:
+        return self.resource_embd.search(
+            _project(self.res_projection, embd_res), limit=limit, nprobe=nprobe, ef=ef, filters=filters
+        )
 
     def search_similar_keyword(self, embd_res: ndarray | list[ndarray], limit: int = 10) -> list[list[EmbdObj]]:
-        return self.keyword_embd.search(embd_res, limit=limit)
+        return self.keyword_embd.search(_project(self.keyword_projection, embd_res), limit=limit)
@@ -0,0 +1,166 @@
+import os
+import sqlite3
+import threading
+from pathlib import Path
+
+import numpy as np
+from loguru import logger
+from numpy import ndarray
+
+
+class EmbdDiskCache:
+    """Persistent embedding cache: rows in a memory-mapped file plus a key -> row index in SQLite.
+
+    Keys combine the content hash with the model name and dtype, so switching models never returns stale vectors.
+    Rows are stored in `dtype`, the output dtype of the backend, so that a hit returns the vector a fresh compute
+    would; float16 caches live in `root_dir` itself, others in a subdirectory named after their dtype.
+    SQLite serializes writers across processes (appends happen inside an IMMEDIATE transaction) while readers in any
+    number of processes look rows up concurrently. `compact` rewrites live rows into a new generation of the data
+    file; readers notice the generation change and remap.
+    """
+
+    def __init__(self, root_dir: str, embd_dim: int, dtype: type = np.float16):
+        self.dtype = np.dtype(dtype)
+        self.path_dir = Path(root_dir) if self.dtype == np.float16 else Path(root_dir) / self.dtype.name
+        self.path_dir.mkdir(exist_ok=True, parents=True)
+        self.embd_dim = embd_dim
+        self.row_bytes = self.dtype.itemsize * embd_dim
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path_dir / "index.sqlite3", check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA busy_timeout=10000")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS entry (key TEXT PRIMARY KEY, row INTEGER NOT NULL)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        self._conn.execute("INSERT OR IGNORE INTO meta VALUES ('generation', 0), ('num_rows', 0)")
+
+        self._generation = -1
+        self._mmap: np.memmap | None = None
+        self._mmap_rows = 0
+
+    @staticmethod
+    def make_key(content_hash: str, model_name: str, dtype: str) -> str:
+        return f"{model_name}|{dtype}|{content_hash}"
+
+    def _path_data(self, generation: int) -> Path:
+        return self.path_dir / f"embds.{generation}.f{8 * self.dtype.itemsize}"
+
+    def _meta(self) -> tuple[int, int]:
+        rows = dict(self._conn.execute("SELECT name, value FROM meta").fetchall())
+        return rows["generation"], rows["num_rows"]
+
+    def _view(self, generation: int, num_rows: int) -> np.memmap | None:
+        # Remap when the file was compacted by anyone or has grown past the current mapping
+        if generation != self._generation or num_rows > self._mmap_rows:
+            path = self._path_data(generation)
+            if num_rows == 0 or not path.exists():
+                return None
+            self._mmap = np.memmap(path, dtype=self.dtype, mode="r", shape=(num_rows, self.embd_dim))
+            self._generation, self._mmap_rows = generation, num_rows
+
+        return self._mmap
+
+    def get(self, keys: list[str]) -> dict[str, ndarray]:
+        if len(keys) == 0:
+            return {}
+
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                generation, num_rows = self._meta()
+                placeholders = ",".join("?" * len(keys))
+                found = self._conn.execute(f"SELECT key, row FROM entry WHERE key IN ({placeholders})", keys).fetchall()
+            finally:
+                self._conn.execute("COMMIT")
+
+            view = self._view(generation, num_rows)
+            if view is None:
+                return {}
+
+            return {key: np.array(view[row]) for key, row in found}
+
+    def put(self, entries: dict[str, ndarray]):
+        if len(entries) == 0:
+            return
+
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                generation, num_rows = self._meta()
+
+                placeholders = ",".join("?" * len(entries))
+                existing = {
+                    row[0]
+                    for row in self._conn.execute(
+                        f"SELECT key FROM entry WHERE key IN ({placeholders})", list(entries)
+                    ).fetchall()
+                }
+                new = [(key, embd) for key, embd in entries.items() if key not in existing]
+                if len(new) == 0:
+                    self._conn.execute("COMMIT")
+                    return
+
+                data = np.stack([embd for _, embd in new]).astype(self.dtype)
+                fd = os.open(self._path_data(generation), os.O_WRONLY | os.O_CREAT, 0o644)
+                try:
+                    os.pwrite(fd, data.tobytes(), num_rows * self.row_bytes)
+                    # Rows must be on disk before the index pointing at them is committed
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+
+                self._conn.executemany(
+                    "INSERT INTO entry (key, row) VALUES (?, ?)",
+                    [(key, num_rows + i) for i, (key, _) in enumerate(new)],
+                )
+                self._conn.execute("UPDATE meta SET value = ? WHERE name = 'num_rows'", (num_rows + len(new),))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def compact(self, keep_prefix: str | None = None):
+        """Rewrite the data file with only indexed rows; optionally drop keys not starting with `keep_prefix`
+        (e.g. entries of previous models)."""
+
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                generation, num_rows = self._meta()
+                if keep_prefix is not None:
+                    self._conn.execute(
+                        "DELETE FROM entry WHERE substr(key, 1, ?) != ?", (len(keep_prefix), keep_prefix)
+                    )
+
+                entries = self._conn.execute("SELECT key, row FROM entry ORDER BY row").fetchall()
+                old = self._view(generation, num_rows)
+
+                new_generation = generation + 1
+                with open(self._path_data(new_generation), "wb") as file:
+                    for i in range(0, len(entries), 65536):
+                        assert old is not None
+                        rows = [row for _, row in entries[i : i + 65536]]
+                        file.write(np.ascontiguousarray(old[rows]).tobytes())
+                    file.flush()
+                    os.fsync(file.fileno())
+
+                self._conn.executemany(
+                    "UPDATE entry SET row = ? WHERE key = ?", [(i, key) for i, (key, _) in enumerate(entries)]
+                )
+                self._conn.execute("UPDATE meta SET value = ? WHERE name = 'num_rows'", (len(entries),))
+                self._conn.execute("UPDATE meta SET value = ? WHERE name = 'generation'", (new_generation,))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+        # Readers that still map the old file keep their inode alive until they remap
+        self._path_data(generation).unlink(missing_ok=True)
+        logger.info(f"Compacted embedding cache from {num_rows} to {len(entries)} rows")
+
+    def stats(self) -> dict:
+        with self._lock:
+            generation, num_rows = self._meta()
+            (num_keys,) = self._conn.execute("SELECT COUNT(*) FROM entry").fetchone()
+
+        return {"generation": generation, "num_rows": num_rows, "num_keys": num_keys}
@@ -1,5 +1,7 @@
+import hashlib
 from io import BytesIO
 
+import numpy as np
 import torch
 from loguru import logger
 from numpy import ndarray
@@ -8,60 +10,217 @@ from transformers import CLIPProcessor, CLIPTokenizerFast
 
 from src import config
 
+from .batching import MicroBatcher
+from .cache import LRUCache
+from .clip_backend import create_backend
+from .embd_cache import EmbdDiskCache
+from .image import DecodedImage
+
 
 class EmbdExtractionUtils:
     def __init__(self):
         # Load model and other processing utilities
-        logger.info("Load jit model and associated utilities")
+        logger.info(f"Load CLIP with backend '{config.EMBD_BACKEND}' and associated utilities")
 
-        self.loaded_model = torch.jit.load(config.EMBD_MODEL_PATH, map_location="cpu").to(
-            dtype=config.DTYPE, device=config.DEVICE
+        if config.EMBD_NUM_THREADS > 0:
+            torch.set_num_threads(config.EMBD_NUM_THREADS)
+        self.backend = create_backend(
+            config.EMBD_BACKEND,
+            config.EMBD_MODEL_NAME,
+            config.EMBD_MODEL_PATH,
+            config.DTYPE,
+            config.DEVICE,
+            onnx_dir=config.EMBD_ONNX_DIR,
+            num_threads=config.EMBD_NUM_THREADS,
+            shared_weights_dir=config.SHARED_WEIGHTS_DIR,
         )
-        self.loaded_model.eval()
 
         self.processor = CLIPProcessor.from_pretrained(config.EMBD_MODEL_NAME)
         self.tokenizer = CLIPTokenizerFast.from_pretrained(config.EMBD_MODEL_NAME)
 
+        self.text_cache = LRUCache(config.EMBD_TEXT_CACHE_SIZE, ttl=config.EMBD_TEXT_CACHE_TTL_S)
+        self.np_dtype = self.backend.np_dtype
+        self.disk_cache = (
+            EmbdDiskCache(config.EMBD_CACHE_DIR, config.EMBD_DIM, self.np_dtype) if config.EMBD_CACHE_DIR else None
+        )
+
+        # Texts are padded per length bucket rather than to the model maximum, if the backend gives the same output
+        self._num_text_tokens = 0
+        self._num_text_padded = 0
+        self.text_buckets = sorted(config.EMBD_TEXT_BUCKETS)
+        self.text_dynamic_length = len(self.text_buckets) > 0 and self._check_dynamic_length()
+
+        # Concurrent callers are grouped into batches before hitting the model
+        self.text_batcher = MicroBatcher(
+            self._forward_text, config.EMBD_BATCH_MAX_SIZE, config.EMBD_BATCH_MAX_WAIT_MS, name="clip-text"
+        )
+        self.image_batcher = MicroBatcher(
+            self._forward_image, config.EMBD_BATCH_MAX_SIZE, config.EMBD_BATCH_MAX_WAIT_MS, name="clip-image"
+        )
+
+    def _forward_text(self, texts: list[str]) -> list[ndarray]:
+        if self.text_dynamic_length:
+            return self._forward_text_bucketed(texts)
+
+        return self._forward_text_padded(texts)
+
+    def _forward_text_padded(self, texts: list[str]) -> list[ndarray]:
+        token_ids = self.tokenizer(texts, return_tensors="np", padding="max_length", truncation=True)
+        embd = self.backend.encode_text(token_ids["input_ids"], token_ids["attention_mask"])
+
+        self._num_text_tokens += int(token_ids["attention_mask"].sum())
+        self._num_text_padded += token_ids["input_ids"].size
+
+        return [v for v in embd]
+
+    def _forward_text_bucketed(self, texts: list[str]) -> list[ndarray]:
+        """Encode texts grouped by token length, each group padded only to its longest text.
+
+        CLIP pools the features at the end-of-text token under a causal mask, so padding after it does not change
+        the embedding; a short keyword then costs a few positions of attention instead of 77.
+        """
+
+        encoded = self.tokenizer(texts, truncation=True)["input_ids"]
+        lengths = np.array([len(ids) for ids in encoded])
+        buckets = np.searchsorted(self.text_buckets, lengths)
+
+        out: dict[int, ndarray] = {}
+        for bucket in np.unique(buckets):
+            idx = np.flatnonzero(buckets == bucket)
+            token_ids = self.tokenizer.pad(
+                {"input_ids": [encoded[i] for i in idx]}, padding="longest", return_tensors="np"
+            )
+            embd = self.backend.encode_text(token_ids["input_ids"], token_ids["attention_mask"])
+            for i, v in zip(idx, embd):
+                out[i] = v
+
+            self._num_text_tokens += int(lengths[idx].sum())
+            self._num_text_padded += token_ids["input_ids"].size
+
+        return [out[i] for i in range(len(texts))]
+
+    def _check_dynamic_length(self) -> bool:
+        """Whether the backend gives the same embedding for short and max-length padding.
+
+        Traced models may have the sequence length of the tracing inputs baked in; those keep max-length padding.
+        """
+
+        probe = ["red-color", "a photo of a cat sleeping on the sofa"]
+        try:
+            padded = self._forward_text_padded(probe)
+            bucketed = self._forward_text_bucketed(probe)
+        except Exception as e:
+            logger.warning(f"CLIP backend '{self.backend.name}' rejects dynamic text length: {e}")
+            return False
+        finally:
+            self._num_text_tokens = self._num_text_padded = 0
+
+        sims = [
+            float(np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b)))
+            for a, b in zip(np.asarray(padded, dtype=np.float32), np.asarray(bucketed, dtype=np.float32))
+        ]
+        if min(sims) < 0.9999:
+            logger.warning(f"CLIP backend '{self.backend.name}' differs under dynamic text length: {sims}")
+            return False
+
+        return True
+
+    def warm_up(self):
+        """Encode a synthetic text of every bucket length and a blank image, bypassing the caches.
+
+        First calls allocate buffers and select kernels (ONNX Runtime also finishes optimizing its graphs); running
+        them at startup keeps that cost off the first requests.
+        """
+
+        lengths = [*self.text_buckets, self.tokenizer.model_max_length]
+        try:
+            self._forward_text([" ".join(["photo"] * max(length - 2, 1)) for length in lengths])
+        finally:
+            self._num_text_tokens = self._num_text_padded = 0
+        self._forward_image([Image.new("RGB", (224, 224), (128, 128, 128))])
+
+    def _forward_image(self, images: list[Image.Image]) -> list[ndarray]:
+        out_sample_image = self.processor(images=images, return_tensors="np")
+        embd = self.backend.encode_image(out_sample_image["pixel_values"])
+
+        return [v for v in embd]
+
+    def _text_cache_key(self, text: str) -> tuple[str, str, str]:
+        # CLIP tokenizer collapses whitespace and lowercases, so this normalization does not change the embedding
+        return " ".join(text.split()).lower(), config.EMBD_MODEL_NAME, self.backend.cache_tag
+
     def get_embd_text(self, text: str | list[str]) -> list[ndarray]:
-        token_ids = self.tokenizer(text, return_tensors="pt", padding="max_length", truncation=True)
-        embd = (
-            self.loaded_model
-            .get_text_features(token_ids["input_ids"].to("mps"), token_ids["attention_mask"].to("mps"))
-            .to("cpu")
-            .detach()
-            .numpy()
-            .squeeze()
-        )  # fmt: skip
-
-        match len(embd.shape):
-            case 2:
-                output = [v for v in embd]
-            case 1:
-                output = [embd]
-            case _:
-                raise ValueError(f"Shape of embd must be less than or equal 2. Got: {embd.shape}")
-
-        return output
-
-    def get_embd_image(self, image_bytes: BytesIO) -> ndarray:
+        if isinstance(text, str):
+            text = [text]
+
+        keys = [self._text_cache_key(t) for t in text]
+        embds = {key: self.text_cache.get(key) for key in set(keys)}
+
+        # Only cache misses reach the model, each distinct text once
+        misses = [key for key, embd in embds.items() if embd is None]
+        computed = self._encode_cached(
+            [hashlib.sha256(key[0].encode()).hexdigest() for key in misses],
+            [key[0] for key in misses],
+            self.text_batcher,
+        )
+        for key, embd in zip(misses, computed):
+            embd.flags.writeable = False
+            self.text_cache.put(key, embd)
+            embds[key] = embd
+
+        return [embds[key] for key in keys]
+
+    def _encode_cached(self, hashes: list[str], inputs: list, batcher: MicroBatcher) -> list[ndarray]:
+        """Look inputs up in the on-disk cache by content hash and run the model only for the misses."""
+
+        if self.disk_cache is None:
+            return [future.result() for future in batcher.submit_many(inputs)]
+
+        keys = [EmbdDiskCache.make_key(h, config.EMBD_MODEL_NAME, self.backend.cache_tag) for h in hashes]
+        found = self.disk_cache.get(keys)
+
+        misses = [i for i, key in enumerate(keys) if key not in found]
+        futures = batcher.submit_many([inputs[i] for i in misses])
+        computed = {keys[i]: future.result() for i, future in zip(misses, futures)}
+        self.disk_cache.put(computed)
+
+        return [found[key].astype(self.np_dtype) if key in found else computed[key] for key in keys]
+
+    @staticmethod
+    def _to_decoded(image: BytesIO | DecodedImage) -> DecodedImage:
+        if isinstance(image, DecodedImage):
+            return image
+
+        return DecodedImage.from_bytes(image.getvalue())
+
+    def get_embd_image(self, image: BytesIO | DecodedImage) -> ndarray:
         """Extract embedding from input image
 
         Args:
-            image_bytes (BytesIO): input image (already read into memory)
+            image (BytesIO | DecodedImage): input image, either already read into memory or already decoded
 
         Returns:
             ndarray: embedding vector
         """
 
-        image = Image.open(image_bytes)
-        out_sample_image = self.processor(images=image, return_tensors="pt")
-        embd = (
-            self.loaded_model
-            .get_image_features(out_sample_image["pixel_values"].to(config.DEVICE))
-            .to("cpu")
-            .detach()
-            .numpy()
-            .squeeze()
-        )  # fmt: skip
-
-        return embd
+        return self.get_embd_images([image])[0]
+
+    def get_embd_images(self, images: list[BytesIO | DecodedImage]) -> list[ndarray]:
+        decoded = [self._to_decoded(image) for image in images]
+
+        return self._encode_cached(
+            [image.content_hash for image in decoded], [image.image for image in decoded], self.image_batcher
+        )
+
+    def stats(self) -> dict:
+        return {
+            "text": self.text_batcher.stats(),
+            "image": self.image_batcher.stats(),
+            "text_cache": self.text_cache.stats(),
+            "text_padding": {
+                "dynamic_length": self.text_dynamic_length,
+                "num_tokens": self._num_text_tokens,
+                "num_padded": self._num_text_padded,
+            },
+            "disk_cache": self.disk_cache.stats() if self.disk_cache is not None else None,
+        }
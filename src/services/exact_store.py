@@ -0,0 +1,148 @@
+import os
+import threading
+from pathlib import Path
+
+import numpy as np
+from loguru import logger
+from numpy import ndarray
+
+from .emb_store import EmbdObj
+
+
+class ExactEmbdStore:
+    """Full-precision side store of a vector collection, used to re-score approximate search candidates.
+
+    Records `(id, float32 vector)` are appended to one file, each batch with a single `O_APPEND` write, so several
+    worker processes can share the store. The file is read through `np.memmap`; lookups first map records appended
+    by other processes. When an id is written again, its latest record wins.
+
+    Clearing renames an empty file over the data file instead of truncating it, as truncating a file that other
+    processes have mapped makes their reads fault (SIGBUS). Readers and writers notice the new inode and reopen it.
+    """
+
+    def __init__(self, root_dir: str, embd_dim: int, metric_type: str):
+        self.path_dir = Path(root_dir)
+        self.path_dir.mkdir(exist_ok=True, parents=True)
+        self.path_data = self.path_dir / "exact.f32"
+        self.embd_dim = embd_dim
+        self.metric_type = metric_type
+        self.dtype = np.dtype([("id", "<i8"), ("embd", "<f4", (embd_dim,))])
+
+        self._lock = threading.Lock()
+        self._fd = os.open(self.path_data, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        self._mmap: np.memmap | None = None
+        self._inode: int | None = None
+        self._rows: dict[int, int] = {}
+        self._num_rows = 0
+        self._refresh()
+
+        logger.info(f"Opened exact vector store '{self.path_dir}' with {self._num_rows} vectors.")
+
+    def _refresh(self):
+        # A record still being written by another process is skipped until it is complete
+        stat = self.path_data.stat()
+        num_rows = stat.st_size // self.dtype.itemsize
+        if stat.st_ino == self._inode and num_rows == self._num_rows:
+            return
+
+        # The file was replaced (cleared): ids map to rows of the new file only
+        if stat.st_ino != self._inode or num_rows < self._num_rows:
+            self._mmap, self._inode, self._rows, self._num_rows = None, stat.st_ino, {}, 0
+        if num_rows == 0:
+            return
+
+        self._mmap = np.memmap(self.path_data, dtype=self.dtype, mode="r", shape=(num_rows,))
+        new_ids = self._mmap["id"][self._num_rows : num_rows]
+        self._rows.update(zip(new_ids.tolist(), range(self._num_rows, num_rows)))
+        self._num_rows = num_rows
+
+    def put(self, ids: list[int], embds: list[ndarray]):
+        if len(ids) == 0:
+            return
+
+        records = np.empty(len(ids), dtype=self.dtype)
+        records["id"] = ids
+        records["embd"] = np.stack(embds).astype(np.float32)
+        with self._lock:
+            self._reopen()
+            os.write(self._fd, records.tobytes())
+
+    def _reopen(self):
+        # Appends must go to the current file, not to one that another process replaced
+        try:
+            current = self.path_data.stat().st_ino
+        except FileNotFoundError:
+            current = None
+        if current != os.fstat(self._fd).st_ino:
+            os.close(self._fd)
+            self._fd = os.open(self.path_data, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+
+    def clear(self):
+        with self._lock:
+            path_tmp = self.path_data.with_name(f"{self.path_data.name}.{os.getpid()}.tmp")
+            path_tmp.touch()
+            os.replace(path_tmp, self.path_data)
+            self._reopen()
+            self._refresh()
+
+    def get(self, ids: list[int]) -> tuple[ndarray, ndarray]:
+        """Return the vectors of the ids found and a mask of which ids were found."""
+
+        with self._lock:
+            self._refresh()
+            rows = np.array([self._rows.get(i, -1) for i in ids], dtype=np.int64)
+            found = rows >= 0
+            if not found.any():
+                return np.empty((0, self.embd_dim), dtype=np.float32), found
+
+            assert self._mmap is not None
+            # Sorted fancy indexing reads the memory map mostly forward
+            order = np.argsort(rows[found])
+            vectors = np.empty((int(found.sum()), self.embd_dim), dtype=np.float32)
+            vectors[order] = self._mmap["embd"][rows[found][order]]
+
+        return vectors, found
+
+    def _score(self, query: ndarray, vectors: ndarray) -> ndarray:
+        """Similarity of `query` to each row, higher is better; L2 is returned negated."""
+
+        query = query.astype(np.float32)
+        match self.metric_type:
+            case "COSINE":
+                norms = np.maximum(np.linalg.norm(vectors, axis=1), 1e-12) * max(np.linalg.norm(query), 1e-12)
+                return vectors @ query / norms
+            case "IP":
+                return vectors @ query
+            case "L2":
+                return -((vectors - query) ** 2).sum(1)
+            case _:
+                raise NotImplementedError()
+
+    def rerank(self, queries: list[ndarray], candidates: list[list[EmbdObj]], limit: int) -> list[list[EmbdObj]]:
+        """Re-score the candidates of each query exactly and keep the `limit` best.
+
+        Candidates whose vector is not in the store keep their approximate score.
+        """
+
+        output = []
+        for query, arr in zip(queries, candidates):
+            if len(arr) == 0:
+                output.append(arr)
+                continue
+
+            vectors, found = self.get([entry.resource_id for entry in arr])
+            if len(vectors) > 0:
+                scores = self._score(query, vectors)
+                if self.metric_type == "L2":
+                    scores = -scores
+                for entry, score in zip([entry for entry, ok in zip(arr, found) if ok], scores.tolist()):
+                    entry.similarity = score
+
+            arr = sorted(arr, key=lambda entry: entry.similarity, reverse=self.metric_type != "L2")
+            output.append(arr[:limit])
+
+        return output
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"num_rows": self._num_rows, "num_ids": len(self._rows)}
@@ -0,0 +1,69 @@
+import hashlib
+import math
+import time
+from dataclasses import dataclass, field
+from io import BytesIO
+
+from PIL import Image
+
+# CLIP resizes the short side of its inputs to this size
+CLIP_MIN_SIZE = 224
+
+
+@dataclass
+class DecodedImage:
+    """Image decoded once per upload and shared by the keyword and embedding extractors.
+
+    `image` is what CLIP embeds. CLIP resizes the short side to 224 itself, so for JPEG the decoder may reduce the
+    bitmap via draft mode, but never below that size nor below half resolution: the embedding stays that of the
+    full-resolution image and the full bitmap is not materialized for large photos. The keyword model works on a
+    half-resolution copy, `keyword_image`, derived on first use.
+    """
+
+    image: Image.Image
+    orig_size: tuple[int, int]
+    decode_ms: float
+    content_hash: str
+    _keyword_image: Image.Image | None = field(default=None, repr=False)
+
+    @property
+    def keyword_image(self) -> Image.Image:
+        if self._keyword_image is None:
+            target = _half(self.orig_size)
+            self._keyword_image = self.image if self.image.size == target else self.image.resize(target)
+
+        return self._keyword_image
+
+    @property
+    def nbytes(self) -> int:
+        """Size of the decoded pixel buffers, including the keyword copy once derived."""
+
+        images = [self.image] if self._keyword_image in (None, self.image) else [self.image, self._keyword_image]
+
+        return sum(image.width * image.height * len(image.getbands()) for image in images)
+
+    @classmethod
+    def from_bytes(cls, raw: bytes) -> "DecodedImage":
+        start = time.perf_counter()
+
+        image = Image.open(BytesIO(raw))
+        orig_size = image.size
+
+        # JPEG decoder can scale by 1/2, 1/4 or 1/8 while decoding; it never goes below the requested size
+        if image.format == "JPEG":
+            scale = max(0.5, CLIP_MIN_SIZE / max(min(orig_size), 1))
+            if scale < 1:
+                image.draft("RGB", (math.ceil(orig_size[0] * scale), math.ceil(orig_size[1] * scale)))
+
+        image = image.convert("RGB")
+
+        return cls(
+            image=image,
+            orig_size=orig_size,
+            decode_ms=(time.perf_counter() - start) * 1000,
+            content_hash=hashlib.sha256(raw).hexdigest(),
+        )
+
+
+def _half(size: tuple[int, int]) -> tuple[int, int]:
+    return max(size[0] // 2, 1), max(size[1] // 2, 1)
@@ -0,0 +1,174 @@
+import math
+import threading
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING
+
+from loguru import logger
+
+from .compression import pq_num_subvectors
+from .db import db
+
+if TYPE_CHECKING:
+    from .emb_store import EmbdStoreController
+
+# Collection sizes at which the index type changes
+MAX_ROWS_FLAT = 10_000
+MAX_ROWS_HNSW = 1_000_000
+MAX_ROWS_IVF_FLAT = 5_000_000
+
+
+@dataclass
+class IndexSpec:
+    """Vector index type with its build parameters and the search parameter trading recall for latency."""
+
+    index_type: str
+    params: dict = field(default_factory=dict)
+
+    @property
+    def search_param(self) -> str | None:
+        match self.index_type:
+            case "HNSW":
+                return "ef"
+            case "IVF_FLAT" | "IVF_SQ8" | "IVF_PQ":
+                return "nprobe"
+            case _:
+                return None
+
+    def default_search_level(self, limit: int) -> int | None:
+        match self.search_param:
+            case "ef":
+                return max(64, limit)
+            case "nprobe":
+                # Roughly 1-2% of the lists keeps recall@10 above 0.95 on CLIP embeddings
+                return max(8, self.params["nlist"] // 64)
+            case _:
+                return None
+
+    def search_params(self, limit: int, nprobe: int | None = None, ef: int | None = None) -> dict:
+        match self.search_param:
+            case "ef":
+                return {"ef": max(ef or self.default_search_level(limit), limit)}
+            case "nprobe":
+                return {"nprobe": min(nprobe or self.default_search_level(limit), self.params["nlist"])}
+            case _:
+                return {}
+
+    def build_params(self, metric_type: str) -> dict:
+        return {"index_type": self.index_type, "metric_type": metric_type, "params": self.params}
+
+    def matches(self, index_type: str, params: dict) -> bool:
+        return index_type == self.index_type and all(
+            str(params.get(name)) == str(value) for name, value in self.params.items()
+        )
+
+
+def choose_index(num_rows: int, quantization: str | None = None, embd_dim: int = 512) -> IndexSpec:
+    """Pick the index for a collection of `num_rows` vectors.
+
+    Small collections are searched exactly. HNSW gives the best recall/latency while its graph fits in memory;
+    beyond that IVF with nlist ~ 4 * sqrt(n), whose vectors are scalar-quantized to 8 bits for the largest sizes.
+    A `quantization` ("SQ8" or "PQ") trades recall for memory at every size past the exact range.
+    """
+
+    if num_rows < MAX_ROWS_FLAT:
+        return IndexSpec("FLAT")
+
+    nlist = min(65536, 2 ** round(math.log2(4 * math.sqrt(num_rows))))
+    match quantization:
+        case "SQ8":
+            return IndexSpec("IVF_SQ8", {"nlist": nlist})
+        case "PQ":
+            return IndexSpec("IVF_PQ", {"nlist": nlist, "m": pq_num_subvectors(embd_dim), "nbits": 8})
+
+    if num_rows < MAX_ROWS_HNSW:
+        return IndexSpec("HNSW", {"M": 16, "efConstruction": 200})
+    if num_rows < MAX_ROWS_IVF_FLAT:
+        return IndexSpec("IVF_FLAT", {"nlist": nlist})
+
+    return IndexSpec("IVF_SQ8", {"nlist": nlist})
+
+
+class IndexManager:
+    """Keep the index of a Milvus collection suited to its size.
+
+    A background thread periodically compares the current index with the one suited to the current size. When
+    they differ, the controller rebuilds into a shadow collection and swaps its alias (see
+    `EmbdStoreController.rebuild`), so searches keep being served from the old index until the new one is ready.
+    A Postgres advisory lock lets a single process of the deployment rebuild; the others pick the new index up.
+    """
+
+    def __init__(self, controller: "EmbdStoreController", check_interval: float = 600.0):
+        self.controller = controller
+        self.check_interval = check_interval
+
+        self._lock = threading.Lock()
+        self._rebuilding: IndexSpec | None = None
+        self._num_rebuilds = 0
+        self._last_error: str | None = None
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._run, name=f"index-manager-{self.controller.coll_name}", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.check_interval):
+            try:
+                self.check()
+            except Exception as e:
+                logger.exception(f"Index check of '{self.controller.coll_name}' failed")
+                with self._lock:
+                    self._last_error = str(e)
+
+    def check(self) -> bool:
+        """Rebuild if the collection outgrew its index; return whether a rebuild ran."""
+
+        # Another process may have rebuilt the collection already
+        target = self.controller.target_index_spec()
+        current = self.controller.refresh_index_spec()
+        if current is not None and target.matches(current.index_type, current.params):
+            return False
+
+        with self._lock:
+            if self._rebuilding is not None:
+                return False
+            self._rebuilding = target
+
+        # Every server worker runs a manager: the first one to take the lock rebuilds, the others skip
+        try:
+            with db.try_advisory_lock(f"rebuild:{self.controller.coll_name}") as acquired:
+                if not acquired:
+                    logger.info(f"Rebuild of '{self.controller.coll_name}' is run by another process")
+                    return False
+
+                current = self.controller.refresh_index_spec()
+                if current is not None and target.matches(current.index_type, current.params):
+                    return False
+
+                logger.info(f"Rebuild '{self.controller.coll_name}': {current} -> {target}")
+                self.controller.rebuild(target)
+            with self._lock:
+                self._num_rebuilds += 1
+                self._last_error = None
+        finally:
+            with self._lock:
+                self._rebuilding = None
+
+        return True
+
+    def stats(self) -> dict:
+        spec = self.controller.index_spec
+        with self._lock:
+            return {
+                "index_type": spec.index_type if spec is not None else None,
+                "params": spec.params if spec is not None else None,
+                "rebuilding": self._rebuilding.index_type if self._rebuilding is not None else None,
+                "num_rebuilds": self._num_rebuilds,
+                "last_error": self._last_error,
+            }
@@ -0,0 +1,80 @@
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+
+class QueueFullError(Exception):
+    def __init__(self, name: str):
+        super().__init__(f"Inference queue '{name}' is full")
+        self.name = name
+
+
+class InferenceExecutor:
+    """Run blocking model calls on a dedicated thread pool with a bounded backlog.
+
+    At most `max_workers` calls run concurrently and at most `max_queue` more wait behind them. Async callers are
+    rejected with `QueueFullError` as soon as the backlog is full so that latency cannot grow without limit, while
+    sync callers (background workers) simply block until a slot frees up.
+    """
+
+    def __init__(self, name: str, max_workers: int, max_queue: int):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"infer-{name}")
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._num_done = 0
+        self._num_rejected = 0
+
+    def _acquire(self, blocking: bool) -> bool:
+        if not self._slots.acquire(blocking=blocking):
+            with self._lock:
+                self._num_rejected += 1
+            return False
+
+        with self._lock:
+            self._in_flight += 1
+        return True
+
+    def _release(self):
+        with self._lock:
+            self._in_flight -= 1
+            self._num_done += 1
+        self._slots.release()
+
+    def saturated(self) -> bool:
+        with self._lock:
+            return self._in_flight >= self.max_workers + self.max_queue
+
+    async def run(self, fn: Callable, *args, **kwargs) -> Any:
+        if not self._acquire(blocking=False):
+            raise QueueFullError(self.name)
+
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._pool, functools.partial(fn, *args, **kwargs))
+        finally:
+            self._release()
+
+    def call(self, fn: Callable, *args, **kwargs) -> Any:
+        self._acquire(blocking=True)
+
+        try:
+            return self._pool.submit(fn, *args, **kwargs).result()
+        finally:
+            self._release()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "in_flight": self._in_flight,
+                "max_workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "num_done": self._num_done,
+                "num_rejected": self._num_rejected,
+            }
@@ -0,0 +1,206 @@
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+
+from pydantic import BaseModel
+
+
+class JOB_STATUS:
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    DUPLICATE = "duplicate"
+    FAILED = "failed"
+
+
+class JobInfo(BaseModel):
+    job_id: str
+    filename: str
+    status: str
+    stage: str | None
+    resource_id: int | None
+    error: str | None
+    created_at: float
+    updated_at: float
+
+
+class JobJournal:
+    """Persistent record of ingest jobs backed by a local SQLite file.
+
+    The raw upload is kept in the journal until the job reaches a final state, so jobs that were queued or running
+    when the process stopped can be replayed on the next start. Every server worker shares the file: a job is owned
+    by the process which added or claimed it, and only jobs whose owner is dead or has not renewed its lease within
+    `lease_s` are claimed by another one.
+    """
+
+    def __init__(self, path: str, lease_s: float = 60.0):
+        Path(path).parent.mkdir(exist_ok=True, parents=True)
+        self.lease_s = lease_s
+        # The pid alone is reused, e.g. by a restarted container whose server is pid 1 again
+        self.owner = f"{os.getpid()}:{uuid.uuid4().hex}"
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS job (
+                id              TEXT PRIMARY KEY,
+                filename        TEXT NOT NULL,
+                content_type    TEXT NOT NULL,
+                content_hash    TEXT,
+                raw             BLOB,
+                status          TEXT NOT NULL,
+                stage           TEXT,
+                resource_id     INTEGER,
+                error           TEXT,
+                created_at      REAL NOT NULL,
+                updated_at      REAL NOT NULL
+            )
+            """
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(job)")}
+        if "content_hash" not in columns:
+            self._conn.execute("ALTER TABLE job ADD COLUMN content_hash TEXT")
+        if "owner" not in columns:
+            self._conn.execute("ALTER TABLE job ADD COLUMN owner TEXT")
+            self._conn.execute("ALTER TABLE job ADD COLUMN lease_until REAL")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS job_status ON job (status)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS job_content_hash ON job (content_hash)")
+
+    def add(self, filename: str, content_type: str, raw: bytes, content_hash: str | None = None) -> str:
+        job_id = uuid.uuid4().hex
+        now = time.time()
+
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO job (id, filename, content_type, content_hash, raw, status, owner, lease_until,"
+                " created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    job_id,
+                    filename,
+                    content_type,
+                    content_hash,
+                    raw,
+                    JOB_STATUS.QUEUED,
+                    self.owner,
+                    now + self.lease_s,
+                    now,
+                    now,
+                ),
+            )
+
+        return job_id
+
+    def find_unfinished(self, content_hash: str) -> str | None:
+        """Return the id of a queued or running job for the same content, if any."""
+
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id FROM job WHERE content_hash = ? AND status IN (?, ?)",
+                (content_hash, JOB_STATUS.QUEUED, JOB_STATUS.RUNNING),
+            ).fetchone()
+
+        return row[0] if row is not None else None
+
+    def mark_stage(self, job_id: str, stage: str):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE job SET status = ?, stage = ?, updated_at = ? WHERE id = ?",
+                (JOB_STATUS.RUNNING, stage, time.time(), job_id),
+            )
+
+    def finish(self, job_id: str, status: str, resource_id: int | None = None, error: str | None = None):
+        # Raw bytes are no longer needed once the job reaches a final state
+        with self._lock:
+            self._conn.execute(
+                "UPDATE job SET status = ?, resource_id = ?, error = ?, raw = NULL, updated_at = ? WHERE id = ?",
+                (status, resource_id, error, time.time(), job_id),
+            )
+
+    def fetch(self, job_id: str) -> JobInfo | None:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, filename, status, stage, resource_id, error, created_at, updated_at FROM job WHERE id = ?",
+                (job_id,),
+            ).fetchone()
+
+        if row is None:
+            return None
+
+        return JobInfo(
+            job_id=row[0],
+            filename=row[1],
+            status=row[2],
+            stage=row[3],
+            resource_id=row[4],
+            error=row[5],
+            created_at=row[6],
+            updated_at=row[7],
+        )
+
+    def _is_abandoned(self, owner: str | None, lease_until: float | None, now: float) -> bool:
+        # Jobs of this process are in its queues already, even if a stall let their lease lapse
+        if owner == self.owner:
+            return False
+        if owner is None or lease_until is None or lease_until < now:
+            return True
+
+        pid = int(owner.split(":")[0])
+        if pid == os.getpid():
+            # Same pid, other owner: a previous incarnation of this process
+            return owner != self.owner
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return True
+        except PermissionError:
+            pass
+
+        return False
+
+    def claim_unfinished(self) -> list[tuple[str, str, str, bytes, str | None]]:
+        """Take over the queued or running jobs whose owner is gone, and return them."""
+
+        now = time.time()
+        with self._lock:
+            # Claims of concurrent workers are serialized by the write lock of the transaction
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._conn.execute(
+                    "SELECT id, filename, content_type, raw, content_hash, owner, lease_until FROM job"
+                    " WHERE status IN (?, ?) ORDER BY created_at",
+                    (JOB_STATUS.QUEUED, JOB_STATUS.RUNNING),
+                ).fetchall()
+                claimed = [row[:5] for row in rows if self._is_abandoned(row[5], row[6], now)]
+                self._conn.executemany(
+                    "UPDATE job SET owner = ?, lease_until = ? WHERE id = ?",
+                    [(self.owner, now + self.lease_s, row[0]) for row in claimed],
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+        return [tuple(row) for row in claimed]
+
+    def renew_leases(self):
+        """Extend the lease of the unfinished jobs of this process; to call well within `lease_s`."""
+
+        with self._lock:
+            self._conn.execute(
+                "UPDATE job SET lease_until = ? WHERE owner = ? AND status IN (?, ?)",
+                (time.time() + self.lease_s, self.owner, JOB_STATUS.QUEUED, JOB_STATUS.RUNNING),
+            )
+
+    def count_unfinished(self) -> int:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT COUNT(*) FROM job WHERE status IN (?, ?)", (JOB_STATUS.QUEUED, JOB_STATUS.RUNNING)
+            ).fetchone()
+
+        return row[0]
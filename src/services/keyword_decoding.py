@@ -0,0 +1,127 @@
+import re
+from dataclasses import dataclass
+from typing import Callable
+
+import torch
+from transformers import LogitsProcessor, PreTrainedTokenizerBase, StoppingCriteria
+
+
+class SuffixStoppingCriteria(StoppingCriteria):
+    """Stop a row as soon as every suffix pattern has matched inside completed lines of its generated text.
+
+    Only text up to the last line break is considered, so a word that is still being generated cannot match
+    early. Post-processing of `KeywordExtractionUtils` works line by line, which keeps the extracted keywords
+    identical to those of a generation that ran until `max_new_tokens`.
+    """
+
+    def __init__(
+        self,
+        tokenizer: PreTrainedTokenizerBase,
+        patterns: list[str],
+        prompt_len: int,
+        normalize: Callable[[str], str],
+    ):
+        self.tokenizer = tokenizer
+        self.patterns = [re.compile(pattern) for pattern in patterns]
+        self.prompt_len = prompt_len
+        self.normalize = normalize
+
+        self.done: list[bool] | None = None
+
+    def _all_matched(self, ids: torch.LongTensor) -> bool:
+        text = self.normalize(self.tokenizer.decode(ids, skip_special_tokens=True))
+        completed = text[: text.rfind("\n") + 1]
+
+        return all(pattern.search(completed) is not None for pattern in self.patterns)
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        if self.done is None:
+            self.done = [False] * input_ids.shape[0]
+
+        for row, ids in enumerate(input_ids):
+            if self.done[row]:
+                continue
+
+            # A line can only complete on a token carrying whitespace
+            last = self.tokenizer.decode(ids[-1:], skip_special_tokens=True)
+            if last != "" and not last.isspace() and " " not in last and "\n" not in last:
+                continue
+
+            self.done[row] = self._all_matched(ids[self.prompt_len :])
+
+        return torch.tensor(self.done, dtype=torch.bool, device=input_ids.device)
+
+
+@dataclass(frozen=True)
+class FieldTemplate:
+    """Token tables of a `<prefix_1><value>\\n<prefix_2><value>\\n...` template, built once per tokenizer."""
+
+    prefix_ids: list[list[int]]
+    newline_id: int
+    eos_id: int
+    # Any token whose text contains a line break ends the value of the current field
+    newline_ids: frozenset[int]
+
+    @classmethod
+    def from_tokenizer(cls, tokenizer: PreTrainedTokenizerBase, prefixes: list[str]) -> "FieldTemplate":
+        assert tokenizer.eos_token_id is not None
+
+        # Scans the whole vocabulary: build it once, not per generation
+        return cls(
+            prefix_ids=[tokenizer.encode(prefix, add_special_tokens=False) for prefix in prefixes],
+            newline_id=tokenizer.encode("\n", add_special_tokens=False)[-1],
+            eos_id=tokenizer.eos_token_id,
+            newline_ids=frozenset(
+                idx
+                for token, idx in tokenizer.get_vocab().items()
+                if "\n" in tokenizer.convert_tokens_to_string([token])
+            ),
+        )
+
+
+class FieldTemplateLogitsProcessor(LogitsProcessor):
+    """Constrain generation to the `template` fields followed by end-of-sequence.
+
+    Prefix tokens are forced, values are generated freely until a line break (or `max_value_tokens`), so the model
+    only spends tokens on the structured fields the post-processing extracts.
+    """
+
+    def __init__(self, template: FieldTemplate, prompt_len: int, max_value_tokens: int = 16):
+        self.template = template
+        self.prompt_len = prompt_len
+        self.max_value_tokens = max_value_tokens
+
+    def _next_forced(self, generated: list[int]) -> int | None:
+        """Replay the template over the generated tokens and return the token to force, if any."""
+
+        pos = 0
+        for prefix in self.template.prefix_ids:
+            # Prefix part
+            for token in prefix:
+                if pos == len(generated):
+                    return token
+                pos += 1
+
+            # Free value part
+            num_value = 0
+            while True:
+                if pos == len(generated):
+                    return self.template.newline_id if num_value >= self.max_value_tokens else None
+                token = generated[pos]
+                pos += 1
+                num_value += 1
+                if token in self.template.newline_ids:
+                    break
+
+        return self.template.eos_id
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor) -> torch.FloatTensor:
+        for row, ids in enumerate(input_ids):
+            forced = self._next_forced(ids[self.prompt_len :].tolist())
+            if forced is None:
+                continue
+
+            scores[row, :] = -float("inf")
+            scores[row, forced] = 0
+
+        return scores
@@ -0,0 +1,261 @@
+import math
+import threading
+import time
+from typing import Callable
+
+import numpy as np
+from loguru import logger
+from numpy import ndarray
+
+# Appended ids are merged into the sorted array of a posting once this many accumulate
+TAIL_MERGE_SIZE = 1024
+
+
+class Posting:
+    """Sorted resource ids of one keyword: a compact array plus a short tail of recent appends."""
+
+    def __init__(self, ids: ndarray | None = None):
+        self.ids = ids if ids is not None else np.empty(0, dtype=np.int64)
+        self.tail: list[int] = []
+
+    def __len__(self) -> int:
+        return len(self.ids) + len(self.tail)
+
+    def append(self, resource_id: int):
+        self.tail.append(resource_id)
+        if len(self.tail) >= TAIL_MERGE_SIZE:
+            self.merge()
+
+    def merge(self):
+        if len(self.tail) == 0:
+            return
+
+        tail = sorted(self.tail)
+        self.tail = []
+        merged = np.concatenate([self.ids, np.array(tail, dtype=np.int64)])
+        # Ids are assigned increasingly, so a full sort is only needed when concurrent inserts landed out of order
+        if len(self.ids) > 0 and tail[0] <= self.ids[-1]:
+            merged = np.unique(merged)
+        self.ids = merged
+
+
+class KeywordIndex:
+    """In-memory inverted index from keyword id to the sorted ids of resources tagged with it.
+
+    Built from the `resource` table at startup (in the background, see `start_loading`) and updated on insert;
+    resources inserted by other processes (server workers, the bulk CLI) are read by `catch_up`. Queries rank
+    resources by the summed IDF of the matched keywords, with OR (any keyword) or AND (every keyword) semantics.
+    Until loading finishes `ready` is False and callers should fall back to the DB.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._postings: dict[int, Posting] = {}
+        self._num_resources = 0
+        # Bumped by every change so that cached search results can tell they are stale
+        self.epoch = 0
+
+        self.ready = False
+        # Inserts made while loading; those past the last loaded id are applied when loading ends
+        self._pending: list[tuple[int, list[int]]] = []
+        # Resources up to this id were read from the DB; those indexed past it are kept so as not to add them twice
+        self._last_loaded = -1
+        self._indexed_after: set[int] = set()
+
+    # =================================================
+    # Build
+    # =================================================
+
+    def load(self, fetch_page: Callable[[int, int], list[tuple[int, list[int]]]], page_size: int = 10000):
+        """Build the index from `fetch_page(after_id, limit)`, which returns (resource_id, keyword_ids) by id."""
+
+        start = time.perf_counter()
+        postings: dict[int, list[int]] = {}
+        num_resources = 0
+        last_id = -1
+        while True:
+            page = fetch_page(last_id, page_size)
+            for resource_id, keyword_ids in page:
+                for keyword_id in set(keyword_ids or []):
+                    postings.setdefault(keyword_id, []).append(resource_id)
+            num_resources += len(page)
+            if len(page) > 0:
+                last_id = page[-1][0]
+            if len(page) < page_size:
+                break
+
+        with self._lock:
+            self._postings = {
+                keyword_id: Posting(np.array(ids, dtype=np.int64)) for keyword_id, ids in postings.items()
+            }
+            self._num_resources = num_resources
+
+            self._last_loaded = last_id
+            pending, self._pending = self._pending, []
+            for resource_id, keyword_ids in pending:
+                if resource_id > last_id and resource_id not in self._indexed_after:
+                    self._add(resource_id, keyword_ids)
+                    self._indexed_after.add(resource_id)
+            self.ready = True
+            self.epoch += 1
+
+        logger.info(
+            f"Loaded keyword index: {num_resources} resources, {len(postings)} keywords "
+            f"in {time.perf_counter() - start:.1f}s"
+        )
+
+    def start_loading(self, fetch_page: Callable[[int, int], list[tuple[int, list[int]]]]) -> threading.Thread:
+        thread = threading.Thread(target=self.load, args=(fetch_page,), name="keyword-index-load", daemon=True)
+        thread.start()
+
+        return thread
+
+    def _add(self, resource_id: int, keyword_ids: list[int]):
+        for keyword_id in set(keyword_ids):
+            posting = self._postings.get(keyword_id)
+            if posting is None:
+                posting = self._postings[keyword_id] = Posting()
+            posting.append(resource_id)
+        self._num_resources += 1
+
+    def add(self, resource_id: int, keyword_ids: list[int]):
+        with self._lock:
+            if not self.ready:
+                self._pending.append((resource_id, keyword_ids))
+                return
+            if resource_id in self._indexed_after:
+                return
+            self._add(resource_id, keyword_ids)
+            self._indexed_after.add(resource_id)
+            self.epoch += 1
+
+    def catch_up(self, fetch_page: Callable[[int, int], list[tuple[int, list[int]]]], page_size: int = 10000):
+        """Index resources past the last one read from the DB, e.g. those inserted by other processes."""
+
+        if not self.ready:
+            return
+
+        with self._lock:
+            last_id = prev_id = self._last_loaded
+        num_added = 0
+        while True:
+            page = fetch_page(last_id, page_size)
+            with self._lock:
+                for resource_id, keyword_ids in page:
+                    if resource_id not in self._indexed_after:
+                        self._add(resource_id, keyword_ids or [])
+                        self._indexed_after.add(resource_id)
+                        num_added += 1
+            if len(page) > 0:
+                last_id = page[-1][0]
+            if len(page) < page_size:
+                break
+
+        with self._lock:
+            self._last_loaded = last_id
+            # Ids up to the previous watermark are dropped: a local `add` lagging a whole poll behind is unlikely
+            self._indexed_after = {resource_id for resource_id in self._indexed_after if resource_id > prev_id}
+            if num_added > 0:
+                self.epoch += 1
+
+        if num_added > 0:
+            logger.debug(f"Keyword index caught up with {num_added} resources inserted elsewhere")
+
+    # =================================================
+    # Query
+    # =================================================
+
+    def _idf(self, df: int) -> float:
+        return math.log((self._num_resources + 1) / (df + 1)) + 1
+
+    @staticmethod
+    def _intersect_recent(postings: list[ndarray], topk: int) -> ndarray:
+        """Return the `topk` largest ids present in every posting, largest first.
+
+        Ids of the shortest posting are checked from its end in growing chunks, so a query stops as soon as
+        enough of the most recent matches are found instead of intersecting whole postings.
+        """
+
+        postings = sorted(postings, key=len)
+        rarest, others = postings[0], postings[1:]
+
+        out = []
+        num_found = 0
+        end = len(rarest)
+        chunk = max(4 * topk, 64)
+        while end > 0 and num_found < topk:
+            ids = rarest[max(end - chunk, 0) : end][::-1]
+            for other in others:
+                # Binary-search the candidates in the next sorted posting
+                pos = np.searchsorted(other, ids)
+                found = pos < len(other)
+                found[found] = other[pos[found]] == ids[found]
+                ids = ids[found]
+            out.append(ids)
+            num_found += len(ids)
+            end -= chunk
+            chunk *= 2
+
+        return np.concatenate(out)[:topk] if len(out) > 0 else np.empty(0, dtype=np.int64)
+
+    def search(self, keyword_ids: list[int], topk: int, match_all: bool = False) -> list[tuple[int, float]]:
+        """Return up to `topk` (resource_id, score) pairs, best first; ties go to the most recent resource."""
+
+        with self._lock:
+            postings = []
+            for keyword_id in set(keyword_ids):
+                posting = self._postings.get(keyword_id)
+                if posting is None:
+                    if match_all:
+                        return []
+                    continue
+                posting.merge()
+                postings.append((posting.ids, self._idf(len(posting.ids))))
+
+        if len(postings) == 0 or topk == 0:
+            return []
+
+        # Resources matching every keyword have the highest possible score
+        score_all = sum(idf for _, idf in postings)
+        matched_all = self._intersect_recent([ids for ids, _ in postings], topk)
+        if match_all or len(matched_all) == topk:
+            return [(int(resource_id), score_all) for resource_id in matched_all]
+
+        total = sum(len(ids) for ids, _ in postings)
+        max_id = max(int(ids[-1]) for ids, _ in postings)
+        if total * 8 < max_id:
+            # Few candidates: aggregate scores over the concatenated postings
+            cands, inverse = np.unique(np.concatenate([ids for ids, _ in postings]), return_inverse=True)
+            scores = np.bincount(inverse, weights=np.concatenate([np.full(len(ids), idf) for ids, idf in postings]))
+        else:
+            # Long postings: scatter into a dense score array indexed by resource id (ids are unique per posting)
+            dense = np.zeros(max_id + 1)
+            for ids, idf in postings:
+                dense[ids] += idf
+            cands = np.flatnonzero(dense)
+            scores = dense[cands]
+
+        # Partial selection of the k best before ordering them by score, then recency
+        if len(cands) > topk:
+            threshold = scores[np.argpartition(-scores, topk - 1)[topk - 1]]
+            above = np.flatnonzero(scores > threshold)
+            # Candidates are sorted by id, so the most recent ties are the last ones
+            ties = np.flatnonzero(scores == threshold)
+            selected = np.concatenate([above, ties[len(ties) - (topk - len(above)) :]])
+        else:
+            selected = np.arange(len(cands))
+        order = np.lexsort((-cands[selected], -scores[selected]))[:topk]
+
+        return [(int(cands[selected[i]]), float(scores[selected[i]])) for i in order]
+
+    def __len__(self) -> int:
+        return self._num_resources
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "ready": self.ready,
+                "num_resources": self._num_resources,
+                "num_keywords": len(self._postings),
+                "num_postings": sum(len(posting) for posting in self._postings.values()),
+            }
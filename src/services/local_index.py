@@ -0,0 +1,466 @@
+import fcntl
+import heapq
+import json
+import os
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable, List
+
+import numpy as np
+from loguru import logger
+from numpy import ndarray
+
+from .compression import pq_num_subvectors
+from .emb_store import EmbdFilter, EmbdObj
+
+if TYPE_CHECKING:
+    from .exact_store import ExactEmbdStore
+
+try:
+    import faiss
+except ImportError:
+    faiss = None
+
+
+class LocalEmbdStoreController:
+    """In-process alternative to the Milvus-backed `EmbdStoreController`.
+
+    Vectors are appended as float16 rows to a flat file and read back through `np.memmap`, so the store can open
+    millions of vectors without copying them into the Python heap. The row number is the object id; the resource
+    id and the scalar fields used by search filters are kept in parallel int64 files. Search is an exact, chunked
+    NumPy top-k unless `faiss` is installed, in which case an IVF or HNSW index is built and persisted next to the
+    vectors. An `exact_store` re-scores over-fetched candidates in float32, and `quantization` ("SQ8" or "PQ")
+    compresses the codes of the faiss index, as in `EmbdStoreController`.
+
+    Several processes may open the same collection (server workers, the bulk ingest CLI): writes take an exclusive
+    flock on the collection directory and reads a shared one, and each re-derives the row count from the file sizes
+    so that rows appended by the other processes are mapped, and indexed, before being used.
+    """
+
+    CHUNK_ROWS = 65536
+    MIN_ROWS_FAISS = 10000
+
+    def __init__(
+        self,
+        fieldname_id: str,
+        fieldname_res_id: str,
+        fieldname_embd: str,
+        index_type: str,
+        metric_type: str,
+        coll_name: str,
+        embd_dim: int,
+        root_dir: str,
+        nlist: int = 128,
+        scalar_fields: list[str] | None = None,
+        exact_store: "ExactEmbdStore | None" = None,
+        rerank_factor: int = 4,
+        quantization: str | None = None,
+        schema_tag: str = "",
+        check_schema: bool = True,
+    ):
+        self.fieldname_id = fieldname_id
+        self.fieldname_res_id = fieldname_res_id
+        self.fieldname_embd = fieldname_embd
+        self.index_type = index_type
+        self.metric_type = metric_type
+        self.coll_name = coll_name
+        self.embd_dim = embd_dim
+        self.nlist = nlist
+        self.scalar_fields = scalar_fields or []
+        self.exact_store = exact_store
+        self.rerank_factor = rerank_factor
+        self.quantization = quantization
+        self.schema_tag = schema_tag
+        self.check_schema = check_schema
+
+        self.path_dir = Path(root_dir) / coll_name
+        self.path_vectors = self.path_dir / "vectors.f16"
+        self.path_ids = self.path_dir / "ids.i64"
+        self.path_scalars = self.path_dir / "scalars.i64"
+        self.path_meta = self.path_dir / "meta.json"
+        self.path_faiss = self.path_dir / "index.faiss"
+
+        self._lock = threading.RLock()
+        self.path_dir.mkdir(exist_ok=True, parents=True)
+        self._file_lock = open(self.path_dir / "collection.lock", "w")
+        self._flock_exclusive: bool | None = None
+        self.epoch = 0
+        self._initialize()
+
+    @contextmanager
+    def _locked(self, exclusive: bool = False):
+        """Hold the thread lock and the flock of the collection, exclusive for writers and shared for readers."""
+
+        with self._lock:
+            if self._flock_exclusive is not None:
+                # Nested in a section which already holds the flock
+                assert self._flock_exclusive or not exclusive, "Cannot upgrade a shared flock"
+                yield
+                return
+
+            fcntl.flock(self._file_lock, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            self._flock_exclusive = exclusive
+            try:
+                yield
+            finally:
+                self._flock_exclusive = None
+                fcntl.flock(self._file_lock, fcntl.LOCK_UN)
+
+    def _initialize(self):
+        with self._locked(exclusive=True):
+            self._open()
+
+        logger.info(f"Opened local collection '{self.coll_name}' with {self.num_rows} vectors.")
+
+    def _open(self):
+        self.path_dir.mkdir(exist_ok=True, parents=True)
+
+        if self.path_meta.exists() and self.check_schema:
+            meta = json.loads(self.path_meta.read_text())
+            # Checked before the files are trimmed to a common row count, which a missing scalar file would zero
+            if (
+                meta["embd_dim"] != self.embd_dim
+                or meta["metric_type"] != self.metric_type
+                or meta.get("projection", "") != self.schema_tag
+                or self._stored_scalar_fields(meta) != self.scalar_fields
+            ):
+                raise ValueError(
+                    f"Collection '{self.coll_name}' on disk does not match the requested schema: {meta}; "
+                    "run `python -m src.maintenance rebuild-embd-store`"
+                )
+        elif not self.path_meta.exists():
+            self.path_meta.write_text(
+                json.dumps(
+                    {
+                        "embd_dim": self.embd_dim,
+                        "metric_type": self.metric_type,
+                        "index_type": self.index_type,
+                        "projection": self.schema_tag,
+                        "scalar_fields": self.scalar_fields,
+                    }
+                )
+            )
+
+        self._open_files()
+
+        # A crash between the appends leaves some files longer; the shortest one is authoritative. Trimming is safe
+        # as the exclusive flock keeps the other processes from appending meanwhile
+        self.num_rows = self._rows_on_disk()
+        self._file_vectors.truncate(self.num_rows * 2 * self.embd_dim)
+        self._file_ids.truncate(self.num_rows * 8)
+        self._file_scalars.truncate(self.num_rows * 8 * len(self.scalar_fields))
+
+        self._vectors: np.memmap | None = None
+        self._ids: np.memmap | None = None
+        self._scalars: np.memmap | None = None
+        self._remap()
+
+        self._faiss_index = self._load_faiss()
+
+    def _open_files(self):
+        self._file_vectors = open(self.path_vectors, "ab")
+        self._file_ids = open(self.path_ids, "ab")
+        self._file_scalars = open(self.path_scalars, "ab")
+        self._inode = os.fstat(self._file_vectors.fileno()).st_ino
+
+    def _close_files(self):
+        self._file_vectors.close()
+        self._file_ids.close()
+        self._file_scalars.close()
+
+    def _rows_on_disk(self) -> int:
+        num_rows = min(self.path_vectors.stat().st_size // (2 * self.embd_dim), self.path_ids.stat().st_size // 8)
+        if len(self.scalar_fields) > 0:
+            num_rows = min(num_rows, self.path_scalars.stat().st_size // (8 * len(self.scalar_fields)))
+
+        return num_rows
+
+    def _refresh(self):
+        """Map the rows other processes appended since the last call; the flock must be held."""
+
+        # Another process dropped the collection: files were replaced, the rows known so far are gone
+        if os.stat(self.path_vectors).st_ino != self._inode:
+            self._close_files()
+            self._open_files()
+            self.num_rows, self._faiss_index = 0, None
+
+        num_rows = self._rows_on_disk()
+        if num_rows == self.num_rows:
+            return
+
+        start, self.num_rows = self.num_rows, num_rows
+        self._remap()
+        self.epoch += 1
+
+        if self._faiss_index is not None:
+            self._add_faiss(self._faiss_index, start, self.num_rows)
+        elif faiss is not None and self.num_rows >= self.MIN_ROWS_FAISS:
+            self._faiss_index = self._build_faiss()
+
+    def _stored_scalar_fields(self, meta: dict) -> list[str]:
+        if "scalar_fields" in meta:
+            return meta["scalar_fields"]
+
+        # Written before the key existed: the scalars are there if their file covers every stored vector
+        num_rows = self.path_vectors.stat().st_size // (2 * self.embd_dim) if self.path_vectors.exists() else 0
+        size_scalars = self.path_scalars.stat().st_size if self.path_scalars.exists() else 0
+
+        return self.scalar_fields if size_scalars >= num_rows * 8 * len(self.scalar_fields) else []
+
+    def _remap(self):
+        if self.num_rows == 0:
+            self._vectors, self._ids, self._scalars = None, None, None
+            return
+
+        self._vectors = np.memmap(self.path_vectors, dtype=np.float16, mode="r", shape=(self.num_rows, self.embd_dim))
+        self._ids = np.memmap(self.path_ids, dtype=np.int64, mode="r", shape=(self.num_rows,))
+        if len(self.scalar_fields) > 0:
+            self._scalars = np.memmap(
+                self.path_scalars, dtype=np.int64, mode="r", shape=(self.num_rows, len(self.scalar_fields))
+            )
+
+    # =================================================
+    # FAISS index (optional)
+    # =================================================
+
+    def _faiss_metric(self) -> int:
+        return faiss.METRIC_L2 if self.metric_type == "L2" else faiss.METRIC_INNER_PRODUCT
+
+    def _load_faiss(self):
+        if faiss is None or self.num_rows < self.MIN_ROWS_FAISS:
+            return None
+
+        if self.path_faiss.exists():
+            index = faiss.read_index(str(self.path_faiss))
+            if index.ntotal <= self.num_rows:
+                self._add_faiss(index, index.ntotal, self.num_rows)
+                return index
+
+        return self._build_faiss()
+
+    def _build_faiss(self):
+        match self.index_type, self.quantization:
+            case "HNSW", None:
+                index = faiss.IndexHNSWFlat(self.embd_dim, 32, self._faiss_metric())
+            case _:
+                quantizer = faiss.IndexFlat(self.embd_dim, self._faiss_metric())
+                match self.quantization:
+                    case "SQ8":
+                        index = faiss.IndexIVFScalarQuantizer(
+                            quantizer, self.embd_dim, self.nlist, faiss.ScalarQuantizer.QT_8bit, self._faiss_metric()
+                        )
+                    case "PQ":
+                        index = faiss.IndexIVFPQ(
+                            quantizer,
+                            self.embd_dim,
+                            self.nlist,
+                            pq_num_subvectors(self.embd_dim),
+                            8,
+                            self._faiss_metric(),
+                        )
+                    case _:
+                        index = faiss.IndexIVFFlat(quantizer, self.embd_dim, self.nlist, self._faiss_metric())
+
+                # Train on a bounded random sample rather than the whole store
+                assert self._vectors is not None
+                sample_size = min(self.num_rows, self.nlist * 256)
+                sample = np.sort(np.random.default_rng(0).choice(self.num_rows, sample_size, replace=False))
+                index.train(np.ascontiguousarray(self._vectors[sample], dtype=np.float32))
+
+        self._add_faiss(index, 0, self.num_rows)
+        logger.info(f"Built faiss '{self.index_type}' index for '{self.coll_name}' over {self.num_rows} vectors.")
+
+        return index
+
+    def _add_faiss(self, index, start: int, end: int):
+        assert self._vectors is not None
+        for i in range(start, end, self.CHUNK_ROWS):
+            index.add(np.ascontiguousarray(self._vectors[i : min(i + self.CHUNK_ROWS, end)], dtype=np.float32))
+
+    # =================================================
+    # Controller interface
+    # =================================================
+
+    def drop_collection(self):
+        with self._locked(exclusive=True):
+            self._close_files()
+            for path in [self.path_vectors, self.path_ids, self.path_scalars, self.path_meta, self.path_faiss]:
+                path.unlink(missing_ok=True)
+
+            self._open()
+            if self.exact_store is not None:
+                self.exact_store.clear()
+            self.epoch += 1
+
+        logger.info(f"Dropped collection '{self.coll_name}'.")
+
+    def _prepare(self, embds: ndarray) -> ndarray:
+        embds = embds.astype(np.float32)
+        if self.metric_type == "COSINE":
+            embds = embds / np.maximum(np.linalg.norm(embds, axis=1, keepdims=True), 1e-12)
+
+        return embds
+
+    def insert(self, entities: list):
+        ids, embds, *scalars = entities
+        assert len(scalars) == len(self.scalar_fields)
+        if self.exact_store is not None:
+            self.exact_store.put(ids, embds)
+        embds = self._prepare(np.stack(embds))
+
+        with self._locked(exclusive=True):
+            # Append to the files of the current collection, which another process may have dropped
+            self._refresh()
+            self._file_vectors.write(embds.astype(np.float16).tobytes())
+            self._file_ids.write(np.asarray(ids, dtype=np.int64).tobytes())
+            if len(scalars) > 0:
+                self._file_scalars.write(np.asarray(scalars, dtype=np.int64).T.tobytes())
+            self._file_vectors.flush()
+            self._file_ids.flush()
+            self._file_scalars.flush()
+
+            self._refresh()
+
+    def sync(self) -> bool:
+        with self._locked(exclusive=True):
+            os.fsync(self._file_vectors.fileno())
+            os.fsync(self._file_ids.fileno())
+            os.fsync(self._file_scalars.fileno())
+
+            if self._faiss_index is not None:
+                faiss.write_index(self._faiss_index, str(self.path_faiss))
+
+        return True
+
+    # Inserts are written through to the files: nothing waits in a buffer
+
+    def check_room(self):
+        pass
+
+    def when_written(self, callback: Callable[[], None]):
+        callback()
+
+    def buffer_stats(self) -> dict:
+        return {"num_buffered": 0}
+
+    def find_ids(self, ids: list[int]) -> set[int]:
+        with self._locked():
+            self._refresh()
+            if self._ids is None or len(ids) == 0:
+                return set()
+            ids_arr = np.asarray(ids, dtype=np.int64)
+
+            return set(ids_arr[np.isin(ids_arr, self._ids)].tolist())
+
+    def close(self):
+        self.sync()
+
+    def sample_vectors(self, num_rows: int) -> ndarray:
+        """Read up to `num_rows` stored vectors, picked at random, as float32."""
+
+        with self._locked():
+            self._refresh()
+            if self.num_rows == 0:
+                return np.empty((0, self.embd_dim), dtype=np.float32)
+
+            assert self._vectors is not None
+            rows = np.random.default_rng(0).choice(self.num_rows, min(num_rows, self.num_rows), replace=False)
+            return np.asarray(self._vectors[np.sort(rows)], dtype=np.float32)
+
+    def _filter_rows(self, filters: EmbdFilter | None) -> ndarray | None:
+        """Mask of the rows passing `filters`, or None when nothing is filtered."""
+
+        if filters is None or filters.is_empty():
+            return None
+
+        assert self._scalars is not None
+        return filters.mask({name: self._scalars[:, i] for i, name in enumerate(self.scalar_fields)})
+
+    def _search_exact(self, queries: ndarray, limit: int, mask: ndarray | None = None) -> tuple[ndarray, ndarray]:
+        """Chunked top-k over the memory-mapped vectors; returns (scores, rows), higher score is better."""
+
+        assert self._vectors is not None
+        heaps: list[list[tuple[float, int]]] = [[] for _ in range(len(queries))]
+
+        for start in range(0, self.num_rows, self.CHUNK_ROWS):
+            chunk = np.asarray(self._vectors[start : start + self.CHUNK_ROWS], dtype=np.float32)
+            if self.metric_type == "L2":
+                scores = -((chunk**2).sum(1)[None, :] - 2 * queries @ chunk.T + (queries**2).sum(1)[:, None])
+            else:
+                scores = queries @ chunk.T
+            if mask is not None:
+                scores[:, ~mask[start : start + self.CHUNK_ROWS]] = -np.inf
+
+            k = min(limit, chunk.shape[0])
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            for heap, row_scores, row_top in zip(heaps, scores, top):
+                for i in row_top:
+                    if row_scores[i] == -np.inf:
+                        continue
+                    item = (float(row_scores[i]), start + int(i))
+                    if len(heap) < limit:
+                        heapq.heappush(heap, item)
+                    else:
+                        heapq.heappushpop(heap, item)
+
+        out_scores = np.full((len(queries), limit), -np.inf, dtype=np.float32)
+        out_rows = np.full((len(queries), limit), -1, dtype=np.int64)
+        for q, heap in enumerate(heaps):
+            for j, (score, row) in enumerate(sorted(heap, reverse=True)):
+                out_scores[q, j], out_rows[q, j] = score, row
+
+        return out_scores, out_rows
+
+    def search(
+        self,
+        query: ndarray | List[ndarray],
+        limit: int = 10,
+        nprobe: int | None = None,
+        ef: int | None = None,
+        filters: EmbdFilter | None = None,
+    ) -> list[list[EmbdObj]]:
+        if isinstance(query, ndarray):
+            query = [query]
+        num_fetch = limit * self.rerank_factor if self.exact_store is not None else limit
+
+        with self._locked():
+            self._refresh()
+            if self.num_rows == 0:
+                return [[] for _ in query]
+
+            queries = self._prepare(np.stack(query))
+            mask = self._filter_rows(filters)
+            if self._faiss_index is not None:
+                # Filtered rows are excluded inside the index traversal rather than dropped afterwards
+                selector = {"sel": faiss.IDSelectorBatch(np.flatnonzero(mask))} if mask is not None else {}
+                if hasattr(self._faiss_index, "nprobe"):
+                    params = faiss.SearchParametersIVF(nprobe=nprobe or 10, **selector)
+                else:
+                    params = faiss.SearchParametersHNSW(efSearch=max(ef or 64, num_fetch), **selector)
+                scores, rows = self._faiss_index.search(queries, num_fetch, params=params)
+                if self.metric_type == "L2":
+                    scores = -scores
+            else:
+                scores, rows = self._search_exact(queries, num_fetch, mask)
+
+            ids = self._ids
+            assert ids is not None
+
+        output = []
+        for row_scores, row_rows in zip(scores, rows):
+            arr = [
+                EmbdObj(
+                    obj_id=int(row),
+                    similarity=float(-score if self.metric_type == "L2" else score),
+                    resource_id=int(ids[row]),
+                )
+                for score, row in zip(row_scores, row_rows)
+                if row >= 0
+            ]
+            output.append(arr)
+
+        if self.exact_store is not None:
+            output = self.exact_store.rerank(query, output, limit)
+
+        return output
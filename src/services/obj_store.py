@@ -11,6 +11,8 @@ class ObjStoreUtils:
     def _get_path(self, filename: str) -> Path:
         name = Path(filename)
         path = self.path_dir / name.suffix[1:] / name
+        if not path.resolve().is_relative_to((self.path_dir / name.suffix[1:]).resolve()):
+            raise ValueError(f"File name '{filename}' points outside of the object store")
 
         path.parent.mkdir(exist_ok=True, parents=True)
 
@@ -0,0 +1,357 @@
+import queue
+import threading
+import time
+from dataclasses import dataclass, field
+from io import BytesIO
+from typing import TYPE_CHECKING, Callable
+
+from loguru import logger
+from numpy import ndarray
+
+from src import config
+
+from .db import db
+from .db.model import RESOURCE_TYPE
+from .dedup import PerceptualHashIndex, dhash, to_signed
+from .emb_store import EmbdStoreUtils
+from .image import DecodedImage
+from .inference import InferenceExecutor, QueueFullError
+from .journal import JOB_STATUS, JobJournal
+from .keyword_index import KeywordIndex
+from .obj_store import ObjStoreUtils
+
+if TYPE_CHECKING:
+    from .embedding_extraction import EmbdExtractionUtils
+    from .keyword_extraction import KeywordExtractionUtils
+
+
+@dataclass
+class IngestJob:
+    job_id: str
+    filename: str
+    content_type: str
+    raw: bytes
+    content_hash: str | None = None
+
+    res_type: str | None = None
+    phash: int | None = None
+    image: DecodedImage | None = None
+    keywords: list[dict] = field(default_factory=list)
+    embd_keywords: list[ndarray] = field(default_factory=list)
+    embd_img: ndarray | None = None
+    # Set when the resource row exists without its vector (a crash lost the vector): the job completes it
+    resource_id: int | None = None
+
+
+@dataclass
+class Stage:
+    name: str
+    fn: Callable
+    num_workers: int
+    queue: queue.Queue
+
+    # Batched stages receive a list of up to `batch_size` jobs and return a list aligned with it, whatever the size
+    batched: bool = False
+    batch_size: int = 1
+    max_wait: float = 0.0
+
+
+class IngestPipeline:
+    """Process uploads through decode -> keyword -> embed -> dedup -> persist.
+
+    Every stage owns a queue and a pool of worker threads, so different uploads progress through different stages
+    at the same time. Each job is recorded in a `JobJournal`; unfinished jobs are replayed from the first stage when
+    the pipeline starts again.
+    """
+
+    def __init__(
+        self,
+        journal: JobJournal,
+        embd_store: EmbdStoreUtils,
+        obj_store: ObjStoreUtils,
+        embd_extractor: "EmbdExtractionUtils",
+        keyword_extractor: "KeywordExtractionUtils",
+        clip_executor: InferenceExecutor,
+        keyword_executor: InferenceExecutor,
+        phash_index: PerceptualHashIndex,
+        keyword_index: KeywordIndex,
+        thres_match: float = 0.95,
+    ):
+        self.journal = journal
+        self.embd_store = embd_store
+        self.obj_store = obj_store
+        self.embd_extractor = embd_extractor
+        self.keyword_extractor = keyword_extractor
+        self.clip_executor = clip_executor
+        self.keyword_executor = keyword_executor
+        self.phash_index = phash_index
+        self.keyword_index = keyword_index
+        self.thres_match = thres_match
+
+        # Entry queue is unbounded as admission is limited in `submit`; queues between stages apply backpressure
+        size = config.INGEST_QUEUE_SIZE
+        self.stages = [
+            Stage("decode", self._decode, config.INGEST_WORKERS_DECODE, queue.Queue()),
+            Stage(
+                "keyword",
+                self._extract_keyword,
+                config.INGEST_WORKERS_KEYWORD,
+                queue.Queue(size),
+                batched=True,
+                batch_size=config.KEYWORD_BATCH_SIZE,
+                max_wait=config.KEYWORD_BATCH_MAX_WAIT_MS / 1000,
+            ),
+            Stage("embed", self._extract_embd, config.INGEST_WORKERS_EMBED, queue.Queue(size)),
+            Stage("dedup", self._check_matching, config.INGEST_WORKERS_DEDUP, queue.Queue(size)),
+            Stage("persist", self._persist, config.INGEST_WORKERS_PERSIST, queue.Queue(size)),
+        ]
+
+        self._threads: list[threading.Thread] = []
+        # Makes the last dedup check and the writes of a job atomic with respect to the other persist workers
+        self._persist_lock = threading.Lock()
+
+    # =================================================
+    # Lifecycle
+    # =================================================
+
+    def start(self):
+        for idx, stage in enumerate(self.stages):
+            next_stage = self.stages[idx + 1] if idx + 1 < len(self.stages) else None
+            for i in range(stage.num_workers):
+                thread = threading.Thread(
+                    target=self._work, args=(stage, next_stage), name=f"ingest-{stage.name}-{i}", daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+
+        # Jobs of this process stay owned while it runs; the others replay only those of dead or stalled processes
+        thread = threading.Thread(target=self._renew_leases, name="ingest-lease", daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+        self._replay()
+
+    def _renew_leases(self):
+        while True:
+            time.sleep(self.journal.lease_s / 3)
+            try:
+                self.journal.renew_leases()
+                # Jobs of a worker which died meanwhile are taken over without waiting for a restart
+                self._replay()
+            except Exception:
+                logger.exception("Failed to renew the leases of ingest jobs")
+
+    def _replay(self):
+        # Replay jobs left unfinished by a previous run, or by another worker which stopped
+        unfinished = self.journal.claim_unfinished()
+        if len(unfinished) > 0:
+            logger.info(f"Replay {len(unfinished)} unfinished ingest jobs")
+        for job_id, filename, content_type, raw, raw_hash in unfinished:
+            self.stages[0].queue.put(IngestJob(job_id, filename, content_type, raw, raw_hash))
+
+    def submit(self, raw: bytes, filename: str, content_type: str, content_hash: str | None = None) -> str:
+        if self.journal.count_unfinished() >= config.INGEST_MAX_PENDING:
+            raise QueueFullError("ingest")
+
+        job_id = self.journal.add(filename, content_type, raw, content_hash)
+        self.stages[0].queue.put(IngestJob(job_id, filename, content_type, raw, content_hash))
+
+        return job_id
+
+    @staticmethod
+    def _collect(stage: Stage) -> list[IngestJob]:
+        jobs = [stage.queue.get()]
+
+        deadline = time.monotonic() + stage.max_wait
+        while len(jobs) < stage.batch_size:
+            try:
+                jobs.append(stage.queue.get(timeout=max(deadline - time.monotonic(), 0)))
+            except queue.Empty:
+                break
+
+        return jobs
+
+    def _work(self, stage: Stage, next_stage: Stage | None):
+        while True:
+            jobs = self._collect(stage)
+
+            try:
+                for job in jobs:
+                    self.journal.mark_stage(job.job_id, stage.name)
+                outs = stage.fn(jobs) if stage.batched else [stage.fn(jobs[0])]
+            except Exception as e:
+                logger.exception(f"Ingest jobs {[job.job_id for job in jobs]} failed at stage '{stage.name}'")
+                for job in jobs:
+                    self.journal.finish(job.job_id, JOB_STATUS.FAILED, error=f"{stage.name}: {e}")
+                continue
+
+            # Stages return None when the job finished early (e.g. duplicate)
+            for out in outs:
+                if out is not None and next_stage is not None:
+                    next_stage.queue.put(out)
+
+    def stats(self) -> dict:
+        return {stage.name: {"queue_depth": stage.queue.qsize(), "workers": stage.num_workers} for stage in self.stages}
+
+    # =================================================
+    # Stages
+    # =================================================
+
+    def _decode(self, job: IngestJob) -> IngestJob | None:
+        logger.debug(f"content_type: {job.content_type}")
+        if job.content_type.startswith("image"):
+            job.res_type = RESOURCE_TYPE.IMAGE.val
+        elif job.content_type.startswith("video"):
+            job.res_type = RESOURCE_TYPE.VIDEO.val
+        else:
+            raise NotImplementedError(f"Unsupported content type: {job.content_type}")
+
+        if job.res_type != RESOURCE_TYPE.IMAGE.val:
+            raise NotImplementedError("Only images can be processed for now")
+
+        # Decoded once here and shared by both extractors; corrupted files fail before reaching the models
+        job.image = DecodedImage.from_bytes(job.raw)
+        logger.debug(f"Decoded {job.image.orig_size} -> {job.image.image.size} in {job.image.decode_ms:.1f}ms")
+
+        # Near-identical images are caught by perceptual hash before any model runs
+        job.phash = dhash(job.image.image)
+        resource_id = self.phash_index.find(job.phash)
+        if resource_id is not None and self.embd_store.missing_res_embd([resource_id]):
+            # Typically a job replayed after a crash which lost its vector before it was written
+            logger.info(f"Resource {resource_id} has no vector: complete it")
+            job.resource_id = resource_id
+        elif resource_id is not None:
+            logger.info(f"Uploaded resource perceptually identical to one already in system: {resource_id}")
+            self.journal.finish(job.job_id, JOB_STATUS.DUPLICATE, resource_id=resource_id)
+            return None
+
+        return job
+
+    def _extract_keyword(self, jobs: list[IngestJob]) -> list[IngestJob]:
+        logger.debug(f"Extract keywords of {len(jobs)} uploads")
+
+        # Keywords are matched back to jobs by position, so every job must contribute its image
+        images = [job.image for job in jobs]
+        assert all(image is not None for image in images), "Keyword stage received undecoded jobs"
+        keywords = self.keyword_executor.call(self.keyword_extractor.extract_keywords_batch, images)
+        for job, words in zip(jobs, keywords):
+            job.keywords = words
+
+        return jobs
+
+    def _extract_embd(self, job: IngestJob) -> IngestJob:
+        logger.debug("Extract embeddings")
+
+        job.embd_keywords = self.clip_executor.call(
+            self.embd_extractor.get_embd_text, [word["word"] for word in job.keywords if word is not None]
+        )
+        assert job.image is not None
+        job.embd_img = self.clip_executor.call(self.embd_extractor.get_embd_image, job.image)
+
+        return job
+
+    def _check_matching(self, job: IngestJob) -> IngestJob | None:
+        # Check match using image
+        logger.debug("Check matching with image")
+
+        assert job.embd_img is not None
+        out = self.embd_store.search_similar_res(job.embd_img) if job.resource_id is None else []
+        if out != []:
+            res_similar = out[0]
+            if res_similar.similarity >= self.thres_match:
+                logger.info(f"Uploaded resource similar with one already in system: {res_similar.resource_id}")
+                self.journal.finish(job.job_id, JOB_STATUS.DUPLICATE, resource_id=res_similar.resource_id)
+                return None
+
+        keywords_similar = self.embd_store.search_similar_keyword(job.embd_keywords) if job.embd_keywords else []
+        for similar, keyword in zip(keywords_similar, job.keywords):
+            keyword["resource_id"] = (
+                similar[0].resource_id if similar != [] and similar[0].similarity >= self.thres_match else None
+            )
+
+        return job
+
+    def _persist(self, job: IngestJob) -> None:
+        # Fail before writing anything while the vector store cannot take more vectors
+        self.embd_store.check_room()
+
+        # Jobs checked by the dedup stage at the same time do not see each other: check again against everything
+        # persisted so far, and write before releasing the lock
+        with self._persist_lock:
+            resource_id = self._find_duplicate(job) if job.resource_id is None else None
+            if resource_id is not None:
+                logger.info(f"Uploaded resource persisted meanwhile by another job: {resource_id}")
+                self.journal.finish(job.job_id, JOB_STATUS.DUPLICATE, resource_id=resource_id)
+                return
+
+            self._store(job)
+
+    def _find_duplicate(self, job: IngestJob) -> int | None:
+        """Return the stored resource `job` duplicates, by perceptual hash or by image embedding."""
+
+        if job.phash is not None:
+            resource_id = self.phash_index.find(job.phash)
+            if resource_id is not None:
+                return resource_id
+
+        # Buffered vectors are searched as well, so resources persisted just before are found
+        assert job.embd_img is not None
+        out = self.embd_store.search_similar_res(job.embd_img)
+        if out != [] and out[0].similarity >= self.thres_match:
+            return out[0].resource_id
+
+        return None
+
+    def _store(self, job: IngestJob) -> None:
+        # Store in Object store
+        logger.debug("Store file")
+
+        self.obj_store.save(job.filename, BytesIO(job.raw))
+
+        # Store new keywords in Attribute DB and Embd store
+        logger.debug("Store keyword")
+
+        new = [
+            (keyword, embd)
+            for keyword, embd in zip(job.keywords, job.embd_keywords)
+            if keyword.get("resource_id") is None
+        ]
+        if len(new) > 0:
+            inserted = db.insert_keywords([(keyword["category"], keyword["word"]) for keyword, _ in new])
+            for (keyword, _), (keyword_id, _) in zip(new, inserted):
+                keyword["resource_id"] = keyword_id
+
+            # Words another worker stored meanwhile already have their vector
+            fresh = [(embd, keyword_id) for (_, embd), (keyword_id, is_new) in zip(new, inserted) if is_new]
+            if len(fresh) > 0:
+                self.embd_store.insert_keyword_embd([embd for embd, _ in fresh], [i for _, i in fresh])
+
+        # Store resource metadata in Attribute DB
+        logger.debug("Store metadata")
+
+        assert job.res_type is not None
+        if job.resource_id is not None:
+            resource = db.fetch_resource(job.resource_id)
+            assert resource is not None
+        else:
+            resource = db.insert_resource(
+                job.res_type,
+                job.filename,
+                [word["word"] for word in job.keywords],
+                content_hash=job.content_hash,
+                phash=to_signed(job.phash) if job.phash is not None else None,
+            )
+
+        # Store in Embedding store
+        logger.debug("Store embedding")
+
+        assert resource.id and job.embd_img is not None
+        self.embd_store.insert_res_embd(job.embd_img, resource.id, resource.resource_type, resource.date_added)
+        if job.resource_id is None:
+            if job.phash is not None:
+                self.phash_index.add(job.phash, resource.id)
+            self.keyword_index.add(resource.id, resource.keywords)
+
+        # Vectors wait in the store buffer for a while: the job stays replayable until they are written
+        resource_id = resource.id
+        self.embd_store.when_written(lambda: self.journal.finish(job.job_id, JOB_STATUS.DONE, resource_id=resource_id))
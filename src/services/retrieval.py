@@ -0,0 +1,147 @@
+import asyncio
+import time
+from typing import Callable
+
+from numpy import ndarray
+
+from .cache import SharedEpoch
+from .db import db
+from .emb_store import EmbdFilter, EmbdStoreUtils
+from .keyword_index import KeywordIndex
+
+
+def reciprocal_rank_fusion(legs: list[list[tuple[int, float]]], k: int = 60) -> list[tuple[int, float]]:
+    """Score each resource by the sum of 1 / (k + rank) over the ranked lists it appears in."""
+
+    scores: dict[int, float] = {}
+    for leg in legs:
+        for rank, (resource_id, _) in enumerate(leg, start=1):
+            scores[resource_id] = scores.get(resource_id, 0.0) + 1 / (k + rank)
+
+    return sorted(scores.items(), key=lambda entry: (-entry[1], -entry[0]))
+
+
+def weighted_fusion(legs: list[list[tuple[int, float]]], weights: list[float]) -> list[tuple[int, float]]:
+    """Score each resource by the weighted sum of its min-max normalized scores."""
+
+    scores: dict[int, float] = {}
+    for leg, weight in zip(legs, weights):
+        if len(leg) == 0:
+            continue
+        low, high = min(score for _, score in leg), max(score for _, score in leg)
+        for resource_id, score in leg:
+            norm = (score - low) / (high - low) if high > low else 1.0
+            scores[resource_id] = scores.get(resource_id, 0.0) + weight * norm
+
+    return sorted(scores.items(), key=lambda entry: (-entry[1], -entry[0]))
+
+
+class HybridRetriever:
+    """Retrieve resources for a query embedding from CLIP similarity, keyword matches, or both fused.
+
+    The keyword leg maps the query to its closest stored keywords, then to the resources tagged with them. Both
+    legs run concurrently in worker threads. Filters are applied inside each store (Milvus expression, SQL `WHERE`)
+    so that every leg returns `topk` matching candidates instead of being trimmed afterwards.
+    """
+
+    def __init__(
+        self,
+        embd_store: EmbdStoreUtils,
+        keyword_index: KeywordIndex,
+        shared_epoch: SharedEpoch | None = None,
+        fusion: str = "rrf",
+        rrf_k: int = 60,
+        vector_weight: float = 0.5,
+        num_keywords: int = 5,
+        keyword_min_sim: float = 0.8,
+        fetch_factor: int = 4,
+    ):
+        self.embd_store = embd_store
+        self.keyword_index = keyword_index
+        self.shared_epoch = shared_epoch
+        self.fusion = fusion
+        self.rrf_k = rrf_k
+        self.vector_weight = vector_weight
+        self.num_keywords = num_keywords
+        self.keyword_min_sim = keyword_min_sim
+        self.fetch_factor = fetch_factor
+
+    def epoch(self) -> tuple:
+        """Write epoch of everything the retrieval legs read from, including writes of other processes."""
+
+        shared = self.shared_epoch.value if self.shared_epoch is not None else None
+
+        return self.embd_store.epoch, self.keyword_index.epoch, shared
+
+    def search_vector(
+        self, embd: ndarray, limit: int, filters: EmbdFilter, nprobe: int | None = None, ef: int | None = None
+    ) -> list[tuple[int, float]]:
+        return [
+            (entry.resource_id, entry.similarity)
+            for entry in self.embd_store.search_similar_res(embd, limit=limit, filters=filters, nprobe=nprobe, ef=ef)
+        ]
+
+    def search_keyword(self, embd: ndarray, limit: int, filters: EmbdFilter) -> list[tuple[int, float]]:
+        similar = self.embd_store.search_similar_keyword(embd, limit=self.num_keywords)[0]
+        keyword_ids = [entry.resource_id for entry in similar if entry.similarity >= self.keyword_min_sim]
+        if len(keyword_ids) == 0:
+            return []
+
+        # The in-memory index holds no resource attributes; filtered queries go to the DB
+        if filters.is_empty() and self.keyword_index.ready:
+            return self.keyword_index.search(keyword_ids, limit)
+
+        return db.fetch_resources_by_keywords(
+            keyword_ids, False, limit, filters.res_type, filters.added_after, filters.added_before
+        )
+
+    @staticmethod
+    async def _timed(fn: Callable, *args) -> tuple[list[tuple[int, float]], float]:
+        start = time.perf_counter()
+        out = await asyncio.to_thread(fn, *args)
+
+        return out, (time.perf_counter() - start) * 1000
+
+    async def search(
+        self,
+        embd: ndarray,
+        topk: int,
+        mode: str = "hybrid",
+        filters: EmbdFilter | None = None,
+        fusion: str | None = None,
+        nprobe: int | None = None,
+        ef: int | None = None,
+    ) -> tuple[list[tuple[int, float]], dict[str, float]]:
+        """Return up to `topk` (resource_id, score) pairs and the latency in ms of every step.
+
+        `nprobe` (IVF) and `ef` (HNSW) raise the recall of the vector leg at the cost of latency; by default the
+        index picks them from its size.
+        """
+
+        filters = filters or EmbdFilter()
+        limit = topk * self.fetch_factor if mode == "hybrid" else topk
+
+        legs = {}
+        if mode in ("vector", "hybrid"):
+            legs["vector"] = self._timed(self.search_vector, embd, limit, filters, nprobe, ef)
+        if mode in ("keyword", "hybrid"):
+            legs["keyword"] = self._timed(self.search_keyword, embd, limit, filters)
+
+        results = dict(zip(legs, await asyncio.gather(*legs.values())))
+        timings = {name: elapsed for name, (_, elapsed) in results.items()}
+        if mode != "hybrid":
+            return results[mode][0][:topk], timings
+
+        start = time.perf_counter()
+        match fusion or self.fusion:
+            case "rrf":
+                fused = reciprocal_rank_fusion([results["vector"][0], results["keyword"][0]], self.rrf_k)
+            case "weighted":
+                fused = weighted_fusion(
+                    [results["vector"][0], results["keyword"][0]], [self.vector_weight, 1 - self.vector_weight]
+                )
+            case _:
+                raise NotImplementedError(f"Unknown fusion: {fusion or self.fusion}")
+        timings["fusion"] = (time.perf_counter() - start) * 1000
+
+        return fused[:topk], timings
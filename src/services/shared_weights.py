@@ -0,0 +1,74 @@
+import fcntl
+import os
+from itertools import chain
+from pathlib import Path
+
+import torch
+from loguru import logger
+from transformers import AutoConfig, GenerationConfig, PreTrainedModel
+
+
+def snapshot_path(root_dir: str, model_name: str, dtype: torch.dtype) -> Path:
+    return Path(root_dir) / f"{model_name.strip('/').replace('/', '--')}-{str(dtype).removeprefix('torch.')}.pt"
+
+
+def load_shared(
+    model_cls: type[PreTrainedModel], model_name: str, dtype: torch.dtype, root_dir: str, device: str = "cpu"
+) -> PreTrainedModel:
+    """Load `model_name` with its weights memory-mapped from a snapshot under `root_dir`.
+
+    The model is built on the meta device and every parameter and buffer is then assigned a tensor mapped from the
+    snapshot file. Pages of a file mapping live in the page cache, so all processes of the host loading the same
+    snapshot share one copy of the weights; each one only pays for its activations. Weights are never written by
+    inference, so the private mapping is never copied. `from_pretrained` alone only maps checkpoint files that need
+    no dtype conversion (e.g. not the bfloat16 Qwen checkpoints run in float16) and copies the weights otherwise;
+    the snapshot is stored in `dtype` already.
+
+    The snapshot is written on first use, under a lock so that concurrent workers wait for one writer instead of
+    each mapping its own file. Weights moved to another `device` are copied there and no longer shared.
+    """
+
+    path = snapshot_path(root_dir, model_name, dtype)
+    path.parent.mkdir(exist_ok=True, parents=True)
+    with open(path.with_name(f"{path.name}.lock"), "w") as file_lock:
+        fcntl.flock(file_lock, fcntl.LOCK_EX)
+        if not path.exists():
+            _write_snapshot(model_cls.from_pretrained(model_name, dtype=dtype), path)
+
+    with torch.device("meta"):
+        model = model_cls._from_config(AutoConfig.from_pretrained(model_name), dtype=dtype)
+    for name, tensor in torch.load(path, mmap=True, weights_only=True).items():
+        module_name, _, attr = name.rpartition(".")
+        module = model.get_submodule(module_name)
+        if attr in module._parameters:
+            module._parameters[attr] = torch.nn.Parameter(tensor, requires_grad=False)
+        else:
+            module._buffers[attr] = tensor
+    model.tie_weights()
+
+    missing = [name for name, t in chain(model.named_parameters(), model.named_buffers()) if t.is_meta]
+    if len(missing) > 0:
+        raise ValueError(f"Snapshot '{path}' lacks {len(missing)} tensors of '{model_name}', e.g. {missing[:3]}")
+
+    # Generation defaults (e.g. end-of-turn tokens) are not part of the model config
+    try:
+        model.generation_config = GenerationConfig.from_pretrained(model_name)
+    except OSError:
+        pass
+
+    logger.info(f"Mapped weights of '{model_name}' from '{path}'")
+    if device != "cpu":
+        logger.warning(f"Weights of '{model_name}' are copied to '{device}' and not shared between processes")
+        model = model.to(device)
+
+    return model.eval()
+
+
+def _write_snapshot(model: PreTrainedModel, path: Path):
+    # Buffers are saved as well: non-persistent ones (e.g. rotary frequencies) are missing from the state dict
+    tensors = {name: t.detach().contiguous() for name, t in chain(model.named_parameters(), model.named_buffers())}
+    path_tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    torch.save(tensors, path_tmp)
+    os.replace(path_tmp, path)
+
+    logger.info(f"Wrote weight snapshot of {len(tensors)} tensors to '{path}'")
@@ -0,0 +1,57 @@
+import threading
+import time
+from contextlib import contextmanager
+
+from loguru import logger
+
+
+class StartupState:
+    """Progress of the server startup, reported by the health and readiness probes.
+
+    Durations are wall-clock milliseconds: one entry per loaded service or startup step, and `ready_ms` from the
+    start of the lifespan until every service is loaded and warmed up.
+    """
+
+    def __init__(self):
+        self.steps: dict[str, float] = {}
+        self.ready = False
+        self.error: str | None = None
+        self.ready_ms: float | None = None
+
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def begin(self):
+        self._start = time.perf_counter()
+
+    def record(self, name: str, elapsed_ms: float):
+        with self._lock:
+            self.steps[name] = round(elapsed_ms, 1)
+
+    @contextmanager
+    def step(self, name: str):
+        start = time.perf_counter()
+        yield
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        self.record(name, elapsed_ms)
+        logger.info(f"Startup step '{name}' done in {elapsed_ms:.0f} ms")
+
+    def set_ready(self):
+        self.ready_ms = round((time.perf_counter() - self._start) * 1000, 1)
+        self.ready = True
+        logger.info(f"Ready in {self.ready_ms:.0f} ms")
+
+    def set_failed(self, error: BaseException):
+        self.error = f"{type(error).__name__}: {error}"
+        logger.opt(exception=error).error(f"Startup failed: {self.error}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            steps = dict(self.steps)
+
+        return {
+            "ready": self.ready,
+            "error": self.error,
+            "ready_ms": self.ready_ms,
+            "steps_ms": steps,
+        }